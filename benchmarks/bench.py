@@ -0,0 +1,263 @@
+'''Time modot commands against a synthetic set of domains and modules.
+
+Generates N domains x M modules x K files (a fraction of them templated)
+plus a few themes and colors under a temporary HOME, then times each
+command in a fresh interpreter, cold (modot's caches and the outputs
+removed first) and warm (left from the previous run). The internals are
+also timed in-process. Results are printed as JSON.
+
+    python benchmarks/bench.py --domains 4 --modules 20 --files 10
+'''
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+import time
+from typing import Callable, Dict, List
+
+import click
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_PATH))
+
+# pylint: disable=wrong-import-position
+from modot import deployer, hostconfig, module_utils  # noqa: E402
+from modot.context import CONTEXT_CACHE_FILENAME  # noqa: E402
+from modot.manifest import MANIFEST_FILENAME  # noqa: E402
+from modot.snapshot import SNAPSHOT_FILENAME  # noqa: E402
+from modot.template_cache import TEMPLATE_CACHE_DIRNAME  # noqa: E402
+from modot.templater import Templater  # noqa: E402
+
+
+MODOT_RELPATH = Path('.local/share/modot')
+# Everything modot keeps under MODOT_PATH to speed up later runs
+CACHE_NAMES = (MANIFEST_FILENAME, SNAPSHOT_FILENAME, TEMPLATE_CACHE_DIRNAME,
+               CONTEXT_CACHE_FILENAME)
+THEMES = ('t1', 't2')
+COLORS = ('c1', 'c2')
+COLOR_KEYS = ('bg', 'fg', 'black', 'red', 'green', 'yellow', 'blue',
+              'magenta', 'cyan', 'white')
+THEME_KEYS = ('font', 'font_size', 'gap', 'border', 'icons')
+
+
+# pylint: disable-next=too-many-arguments,too-many-locals
+def generate(home: Path, domains: int, modules: int, files: int,
+             templated: float, size: int, seed: int) -> Path:
+    '''Write a synthetic host config and its modules, returning its path.
+
+    Every domain contains the same module names, so each output is the
+    concatenation of one file from each domain.
+    '''
+    rand = random.Random(seed)
+    dots = home / 'dots'
+    for kind, names, keys in (('themes', THEMES, THEME_KEYS),
+                              ('colors', COLORS, COLOR_KEYS)):
+        (dots / kind).mkdir(parents=True)
+        for name in names:
+            (dots / kind / f'{name}.yaml').write_text(''.join(
+                f'{key}: "{name}-{key}"\n' for key in keys))
+    keys = COLOR_KEYS + THEME_KEYS
+    for dom_index in range(domains):
+        for mod_index in range(modules):
+            (home / 'out' / f'mod{mod_index}').mkdir(
+                parents=True, exist_ok=True)
+            module_path = dots / f'dom{dom_index}' / f'mod{mod_index}'
+            module_path.mkdir(parents=True)
+            module_yaml = []
+            for file_index in range(files):
+                name = f'file{file_index}.conf'
+                module_yaml.append(
+                    f'{name}:\n  out: ~/out/mod{mod_index}/{name}\n')
+                (module_path / name).write_text(
+                    _file_text(rand, size, rand.random() < templated, keys))
+            (module_path / module_utils.MODULE_CONF_FILENAME).write_text(
+                ''.join(module_yaml))
+    host_path = dots / 'host.yaml'
+    host_path.write_text(
+        'themes: ~/dots/themes\n'
+        'colors: ~/dots/colors\n'
+        f'default_theme: {THEMES[0]}\n'
+        f'default_color: {COLORS[0]}\n'
+        'domains:\n'
+        + ''.join(f'  - ~/dots/dom{index}\n' for index in range(domains))
+        + 'modules:\n'
+        + ''.join(f'  - mod{index}\n' for index in range(modules)))
+    return host_path
+
+
+def _file_text(rand: random.Random, size: int, templated: bool,
+               keys: tuple) -> str:
+    '''Return about size bytes of config-like lines.'''
+    lines = []
+    length = 0
+    while length < size:
+        if templated and rand.random() < 0.2:
+            line = f'option_{len(lines)} = {{{{{rand.choice(keys)}}}}}\n'
+        else:
+            line = f'option_{len(lines)} = value_{rand.randrange(10**6)}\n'
+        lines.append(line)
+        length += len(line)
+    return ''.join(lines)
+
+
+def clear_caches(home: Path, outputs: bool = True):
+    '''Remove modot's caches, and optionally the deployed outputs.'''
+    for name in CACHE_NAMES:
+        path = home / MODOT_RELPATH / name
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+    if outputs:
+        for out_dir in (home / 'out').iterdir():
+            for out_path in out_dir.iterdir():
+                out_path.unlink()
+
+
+def run_modot(home: Path, *args: str) -> float:
+    '''Run a modot command in a fresh interpreter and return its runtime.'''
+    env = {**os.environ, 'HOME': str(home),
+           'PYTHONPATH': os.pathsep.join(
+               filter(None, (str(REPO_PATH), os.environ.get('PYTHONPATH'))))}
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-c', 'from modot.cli import cli; cli()', *args],
+        env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    '''Return summary statistics of a list of timings, in seconds.'''
+    return {'min': min(samples), 'median': statistics.median(samples),
+            'max': max(samples), 'runs': len(samples)}
+
+
+def time_commands(home: Path, host_path: Path,
+                  repeat: int) -> Dict[str, dict]:
+    '''Time each command cold and warm.'''
+    deploy = ('deploy', str(host_path), '--non-interactive',
+              '-t', THEMES[0], '-c', COLORS[0])
+    commands = {
+        'deploy': lambda _: deploy,
+        'dryrun': lambda _: (*deploy, '--dryrun'),
+        'reload': lambda _: ('reload',),
+        'color_set': lambda run: ('color', 'set', COLORS[run % 2]),
+        'theme_get': lambda _: ('theme', 'get'),
+        'color_get': lambda _: ('color', 'get'),
+    }
+    results: Dict[str, dict] = {}
+    for name, make_args in commands.items():
+        for state in ('cold', 'warm'):
+            clear_caches(home)
+            run_modot(home, *deploy)
+            samples = []
+            for run in range(repeat):
+                if state == 'cold':
+                    clear_caches(home)
+                samples.append(run_modot(home, *make_args(run)))
+            results[f'{name}_{state}'] = summarize(samples)
+    return results
+
+
+# pylint: disable-next=too-many-locals
+def time_internals(home: Path, host_path: Path,
+                   repeat: int) -> Dict[str, dict]:
+    '''Time the parse, check and deploy stages in-process.'''
+    clear_caches(home)
+    run_modot(home, 'deploy', str(host_path), '--non-interactive',
+              '-t', THEMES[0], '-c', COLORS[0])
+    modot_path = home / MODOT_RELPATH
+    with _home(home):
+        host_cfg = hostconfig.from_file(host_path)
+        module_paths = list(module_utils.get_module_paths(host_cfg))
+        rule_lists = [module_utils.get_rules(path) for path in module_paths]
+    templater = Templater(modot_path, host_cfg)
+    cats = deployer.build_cats(rule_lists, templater)
+
+    def deploy_cold():
+        for cat in cats.values():
+            cat.rules[0].out.unlink()
+            cat.deploy()
+
+    stages: Dict[str, Callable[[], object]] = {
+        'get_module_paths': lambda: list(
+            module_utils.get_module_paths(host_cfg)),
+        'get_rules': lambda: [
+            module_utils.get_rules(path) for path in module_paths],
+        'build_and_check_cats': lambda: deployer.check_cats(
+            deployer.build_cats(rule_lists, templater)),
+        'cat_deploy_warm': lambda: [cat.deploy() for cat in cats.values()],
+        'cat_deploy_cold': deploy_cold,
+    }
+    results = {}
+    with _home(home):
+        for name, stage in stages.items():
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                stage()
+                samples.append(time.perf_counter() - start)
+            results[name] = summarize(samples)
+    return results
+
+
+@contextmanager
+def _home(home: Path):
+    '''Point ~ at home while parsing in-process.'''
+    real_home = os.environ.get('HOME')
+    os.environ['HOME'] = str(home)
+    try:
+        yield
+    finally:
+        if real_home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = real_home
+
+
+@click.command()
+@click.option('--domains', default=4, show_default=True)
+@click.option('--modules', default=20, show_default=True,
+              help='Modules per domain.')
+@click.option('--files', default=10, show_default=True,
+              help='Files per module.')
+@click.option('--templated', default=0.5, show_default=True,
+              help='Fraction of files containing template tags.')
+@click.option('--size', default=2048, show_default=True,
+              help='Approximate size of each file in bytes.')
+@click.option('--repeat', default=5, show_default=True)
+@click.option('--seed', default=0, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False),
+              help='Write the JSON here instead of to stdout.')
+# pylint: disable-next=too-many-arguments
+def main(domains: int, modules: int, files: int, templated: float,
+         size: int, repeat: int, seed: int, output: str):
+    '''Generate a synthetic config and print command timings as JSON.'''
+    with TemporaryDirectory(prefix='modot-bench-') as tmpdir:
+        home = Path(tmpdir)
+        host_path = generate(home, domains, modules, files, templated,
+                             size, seed)
+        report = {
+            'params': {'domains': domains, 'modules': modules,
+                       'files': files, 'templated': templated,
+                       'size': size, 'repeat': repeat, 'seed': seed},
+            'python': sys.version.split()[0],
+            'commands': time_commands(home, host_path, repeat),
+            'internals': time_internals(home, host_path, repeat),
+        }
+        clear_caches(home)
+    text = json.dumps(report, indent=2)
+    if output:
+        Path(output).write_text(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,275 @@
+'''Deploy many host configs into separate target roots in one run.
+
+Each host config and module is parsed once however many targets share it,
+each source is read once, and each templated source is rendered once per
+distinct theme/color pair, across a process pool. The rendered sources are
+then concatenated and written into every target that uses them.
+'''
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+import locale
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from modot import deployer
+from modot import hostconfig
+from modot import module_utils
+from modot import template_cache
+from modot import yaml_utils
+from modot.cat import (Cat, is_binary, join_parts, mirror_tree,
+                       write_output)
+from modot.fileio import fsync_dirs
+from modot.rule import EXECUTABLE, FORCE_REWRITE, MIRROR, Rule
+from modot.stat_cache import StatCache
+from modot.template_cache import TEMPLATE_CACHE_DIRNAME
+from modot.templater import StaticTemplater, Templater, load_context
+
+
+# Rendered text of one source: keyed by context index, or by None for
+# sources without tags, which render the same under every context. Raw and
+# binary sources are kept as bytes
+Rendered = Dict[Optional[int], Union[str, bytes]]
+
+# A templater for each context, sharing one template cache
+_worker_templaters: List[StaticTemplater] = []
+
+
+@dataclass
+class BatchTarget():
+    '''A host config to deploy into a target root with a theme and color.
+
+    An empty theme or color falls back to the host config's default.
+    '''
+    host_path: Path
+    root: Path
+    theme: str = ''
+    color: str = ''
+
+
+@dataclass
+class _Plan():
+    '''The checked cats of one target and the context they render with.'''
+    target: BatchTarget
+    cats: List[Cat]
+    context_index: int
+
+
+def load_targets(batch_path: Path) -> List[BatchTarget]:
+    '''Read the targets listed in a batch file.
+
+    The file is a YAML list of mappings with host and root paths and an
+    optional theme and color.
+    '''
+    with open(batch_path, 'r') as stream:
+        entries = yaml_utils.safe_load(stream) or []
+    return [BatchTarget(Path(entry['host']).expanduser(),
+                        Path(entry['root']).expanduser(),
+                        entry.get('theme') or '', entry.get('color') or '')
+            for entry in entries]
+
+
+def rebase(out: Path, root: Path, home: Path) -> Path:
+    '''Move an output from under home, or else from under /, to root.'''
+    if out == home or home in out.parents:
+        return root / out.relative_to(home)
+    return root / out.relative_to(out.anchor)
+
+
+def batch_deploy(targets: List[BatchTarget], modot_path: Path,
+                 jobs: int = deployer.DEFAULT_JOBS,
+                 home: Optional[Path] = None) -> int:
+    '''Check and deploy every target, returning how many outputs changed.
+
+    Outputs under home (the invoking user's by default) are moved under
+    each target's root, creating directories as needed. Raises
+    CatCheckError before writing anything if any target fails its checks,
+    and DeployError listing every output that failed to render or write.
+    '''
+    home = home or Path('~').expanduser()
+    contexts: Dict[Tuple[Path, Path, Path], int] = {}
+    host_cfgs: Dict[Path, hostconfig.HostConfig] = {}
+    plans = _plan_targets(targets, modot_path, home, contexts, host_cfgs)
+    needed: Dict[Path, Set[int]] = {}
+    raw_srcs: Set[Path] = set()
+    for plan in plans:
+        for cat in plan.cats:
+            if cat.flags & MIRROR:
+                continue
+            for rule in cat.rules:
+                needed.setdefault(rule.src, set()).add(plan.context_index)
+                if rule.raw:
+                    raw_srcs.add(rule.src)
+    context_list = [load_context(theme_path, color_path, host_cfgs[host_key])
+                    for host_key, theme_path, color_path in contexts]
+    try:
+        rendered = _render_all(needed, raw_srcs, context_list, modot_path,
+                               jobs)
+    finally:
+        # Workers store templates from their own processes
+        template_cache.prune(modot_path / TEMPLATE_CACHE_DIRNAME)
+    return _write_all(plans, rendered, jobs)
+
+
+def _plan_targets(targets: List[BatchTarget], modot_path: Path, home: Path,
+                  contexts: Dict[Tuple[Path, Path, Path], int],
+                  host_cfgs: Dict[Path, hostconfig.HostConfig]
+                  ) -> List[_Plan]:
+    '''Parse, rebase and check the cats of every target.
+
+    Host configs, keyed into host_cfgs, and modules shared between targets
+    are parsed once. The host and theme/color pair of each target is
+    indexed into contexts.
+    '''
+    module_rules: Dict[Path, List[Rule]] = {}
+    stats = StatCache()
+    plans = []
+    for target in targets:
+        host_key = target.host_path.resolve()
+        if host_key not in host_cfgs:
+            host_cfgs[host_key] = hostconfig.from_file(target.host_path)
+        host_cfg = host_cfgs[host_key]
+        rule_lists = [
+            [rule.with_out(rebase(rule.out, target.root, home))
+             for rule in _module_rules(module_path, module_rules)]
+            for module_path in module_utils.get_module_paths(
+                host_cfg, stats=stats)]
+        cat_dict = deployer.build_cats(
+            rule_lists, Templater(modot_path, host_cfg))
+        deployer.check_cats(cat_dict, stats)
+        context_key = (host_key, *_context_key(target, host_cfg))
+        context_index = contexts.setdefault(context_key, len(contexts))
+        plans.append(_Plan(target, list(cat_dict.values()), context_index))
+    return plans
+
+
+def _module_rules(module_path: Path,
+                  module_rules: Dict[Path, List[Rule]]) -> List[Rule]:
+    '''Return the rules of a module, parsing it only the first time.'''
+    if module_path not in module_rules:
+        module_rules[module_path] = module_utils.get_rules(module_path)
+    return module_rules[module_path]
+
+
+def _context_key(target: BatchTarget,
+                 host_cfg: hostconfig.HostConfig) -> Tuple[Path, Path]:
+    '''Return the theme and color files a target renders with.'''
+    theme = target.theme or host_cfg.default_theme
+    color = target.color or host_cfg.default_color
+    if not theme or not color:
+        raise BatchTargetError(
+            f'no theme or color given for {target.host_path}')
+    theme_path = host_cfg.themes_path / f'{theme}.yaml'
+    color_path = host_cfg.colors_path / f'{color}.yaml'
+    for path in (theme_path, color_path):
+        if not path.is_file():
+            raise BatchTargetError(f'could not find {path}')
+    return theme_path.resolve(), color_path.resolve()
+
+
+def _render_all(needed: Dict[Path, Set[int]], raw_srcs: Set[Path],
+                contexts: List[dict], modot_path: Path,
+                jobs: int) -> Dict[Path, Union[Rendered, Exception]]:
+    '''Render each source once per context it is needed in.
+
+    Rendering is CPU-bound, so at most one process per CPU is used however
+    many jobs are allowed.
+    '''
+    tasks = [(str(src), sorted(indexes), src in raw_srcs)
+             for src, indexes in needed.items()]
+    workers = min(jobs, os.cpu_count() or 1)
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=(contexts, modot_path)) as executor:
+            results = list(executor.map(
+                _render_source, tasks,
+                chunksize=max(1, len(tasks) // (workers * 4))))
+    else:
+        _init_worker(contexts, modot_path)
+        results = [_render_source(task) for task in tasks]
+    return dict(zip(needed, results))
+
+
+def _init_worker(contexts: List[dict], modot_path: Path):
+    '''Give a render worker a templater for each context.'''
+    global _worker_templaters  # pylint: disable=global-statement
+    _worker_templaters = [StaticTemplater(modot_path, context)
+                          for context in contexts]
+    for templater in _worker_templaters[1:]:
+        templater.template_cache = _worker_templaters[0].template_cache
+
+
+def _render_source(
+        task: Tuple[str, List[int], bool]) -> Union[Rendered, Exception]:
+    '''Read a source and render it under each requested context.'''
+    src_str, context_indexes, raw = task
+    try:
+        if raw or is_binary(src_str):
+            with open(src_str, 'rb') as stream:
+                return {None: stream.read()}
+        with open(src_str) as stream:
+            src_text = stream.read()
+        if '{{' not in src_text:
+            return {None: src_text}
+        return {index: _worker_templaters[index].render_text(src_text)
+                for index in context_indexes}
+    except Exception as error:  # pylint: disable=broad-except
+        return error
+
+
+def _write_all(plans: List[_Plan],
+               rendered: Dict[Path, Union[Rendered, Exception]],
+               jobs: int) -> int:
+    '''Write every target's cats, returning how many outputs changed.'''
+    cats = [(plan.context_index, cat) for plan in plans for cat in plan.cats]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(
+            lambda job: _write_cat(job[1], job[0], rendered), cats))
+    fsync_dirs(cat.out.parent
+               for (_, cat), result in zip(cats, results) if result is True)
+    failures = [(str(cat.out), result)
+                for (_, cat), result in zip(cats, results)
+                if isinstance(result, Exception)]
+    if failures:
+        raise deployer.DeployError(failures)
+    return sum(1 for result in results if result is True)
+
+
+def _write_cat(cat: Cat, context_index: int,
+               rendered: Dict[Path, Union[Rendered, Exception]]
+               ) -> Union[bool, Exception]:
+    '''Write one target's cat from the rendered sources.'''
+    try:
+        out_path = cat.out
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        if cat.flags & MIRROR:
+            return mirror_tree(cat.rules[0].src, out_path,
+                               bool(cat.flags & EXECUTABLE),
+                               bool(cat.flags & FORCE_REWRITE))
+        parts = []
+        for rule in cat.rules:
+            src_rendered = rendered[rule.src]
+            if isinstance(src_rendered, Exception):
+                raise src_rendered
+            parts.append(src_rendered.get(
+                None, src_rendered.get(context_index)))
+        return write_output(
+            out_path, _join(parts), cat.mode(),
+            bool(cat.flags & FORCE_REWRITE))
+    except Exception as error:  # pylint: disable=broad-except
+        return error
+
+
+def _join(parts: List[Union[str, bytes]]) -> Union[str, bytes]:
+    '''Join rendered sources, as bytes if any of them are raw.'''
+    if not any(isinstance(part, bytes) for part in parts):
+        return join_parts(parts)
+    encoding = locale.getpreferredencoding(False)
+    return b'\n'.join(
+        part if isinstance(part, bytes) else part.encode(encoding)
+        for part in parts if part)
+
+
+class BatchTargetError(Exception):
+    '''Raised when a batch target's theme or color can't be resolved.'''
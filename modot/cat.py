@@ -1,74 +1,393 @@
 '''An object representing a single concatenation operation.'''
-from typing import List
+import errno
+import hashlib
+import locale
+import os
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
 
-from modot.rule import Rule
+from modot import profiling
+from modot.fileio import (CHUNK_SIZE, AtomicWriter, atomic_write, fsync_dirs,
+                          hash_file)
+from modot.object_store import ObjectStore
+from modot.rule import EXECUTABLE, FINAL, FORCE_REWRITE, MIRROR, Rule
+from modot.stat_cache import StatCache
 from modot.templater import Templater
 
 
+# Cats whose sources add up to more than this are streamed, not joined
+STREAM_THRESHOLD_BYTES = 1 << 20
+# Sources with a NUL byte this near the start are copied without templating
+BINARY_SNIFF_BYTES = 8192
+
+
 class Cat():
-    '''Represents a concatenation operation.'''
-    rules: List[Rule]
+    '''Represents a concatenation operation.
+
+    The union of the rules' flags, and whether they all share an output,
+    are kept up to date as rules are added rather than rescanned.
+    '''
+    __slots__ = ('templater', 'flags', '_rules', '_rules_view',
+                 '_mixed_outs')
 
     def __init__(self, templater: Templater):
         '''Create an empty concatenation.'''
-        self.rules = []
         self.templater = templater
+        self.rules = ()
+
+    @property
+    def rules(self) -> Tuple[Rule, ...]:
+        '''The rules of this cat, in concatenation order.'''
+        if self._rules_view is None:
+            self._rules_view = tuple(self._rules)
+        return self._rules_view
+
+    @rules.setter
+    def rules(self, rules: Iterable[Rule]):
+        '''Replace the rules of this cat.'''
+        self._rules: List[Rule] = []
+        self._rules_view: Optional[Tuple[Rule, ...]] = None
+        self._mixed_outs = False
+        self.flags = 0
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule: Rule):
+        '''Append a rule to this cat.'''
+        if self._rules and rule.out_str != self._rules[0].out_str:
+            self._mixed_outs = True
+        self._rules.append(rule)
+        self._rules_view = None
+        self.flags |= rule.flags
+
+    @property
+    def out(self) -> Optional[Path]:
+        '''The output of the first rule, or None if there are none.'''
+        return self._rules[0].out if self._rules else None
 
     def __str__(self) -> str:
         '''Return a string representation of this concat.'''
         flag_strs = []
-        if any(rule.final for rule in self.rules):
+        if self.flags & FINAL:
             flag_strs.append('final')
-        if any(rule.executable for rule in self.rules):
+        if self.flags & EXECUTABLE:
             flag_strs.append('executable')
-        if any(rule.force_rewrite for rule in self.rules):
+        if self.flags & FORCE_REWRITE:
             flag_strs.append('force_rewrite')
         flag_str = ', '.join(flag_strs)
-        out = self.rules[0].out if self.rules else 'EMPTY'
-        src_str = '\n'.join(f'    {rule.src}' for rule in self.rules)
+        out = self.out or 'EMPTY'
+        src_str = '\n'.join(f'    {rule.src_str}' for rule in self._rules)
         return f"Cat [{flag_str}]: {out}\n{src_str}"
 
     def __bool__(self) -> bool:
         '''Return true if this cat has any rules.'''
-        return bool(self.rules)
+        return bool(self._rules)
 
-    def check(self) -> bool:
+    def check(self, stats: Optional[StatCache] = None) -> bool:
         '''Check if this concatenation can be run successfully.'''
-        src_paths = [rule.src for rule in self.rules]
-        out_set = {rule.out for rule in self.rules}
-        final = any(rule.final for rule in self.rules)
-        if len(out_set) > 1:
+        stats = stats or StatCache()
+        if self._mixed_outs:
             return False
-        if final and len(self.rules) > 1:
+        if self.flags & (FINAL | MIRROR) and len(self._rules) > 1:
             return False
-        if self.rules[0].out.is_dir():
+        if self.flags & MIRROR:
+            return (stats.is_dir(self._rules[0].src_str)
+                    and not stats.is_file(self._rules[0].out))
+        if stats.is_dir(self._rules[0].out):
             return False
-        for src_path in src_paths:
-            if not src_path.is_file():
+        for rule in self._rules:
+            if not stats.is_file(rule.src_str):
                 return False
         return True
 
-    def deploy(self):
-        '''Concatenate the configured source paths to write the target.'''
-        if not self.rules:
-            return
+    @profiling.timed('Cat.deploy', item=lambda cat: cat.out)
+    def deploy(self, stats: Optional[StatCache] = None,
+               store: Optional[ObjectStore] = None) -> bool:
+        '''Concatenate the configured source paths to write the target.
+
+        The target is replaced atomically, and only if its content would
+        change (or force_rewrite is set). Returns true if it was replaced.
+        Stats already taken during the check can be reused through stats.
+        With a store, the rendered output is kept there by hash and the
+        target linked to it. Raw and binary sources are copied byte-for-byte
+        without being decoded or templated.
+        '''
+        if not self._rules:
+            return False
         # Should be caught by the checks, but check again for safety
-        if not all(rule.out == self.rules[0].out for rule in self.rules):
+        if self._mixed_outs:
             raise ImproperOutpathError
-        out_strs = []
-        for rule in self.rules:
-            out_strs.append(self.templater.template(rule.src.read_text()))
-        out_str = '\n'.join(out_str for out_str in out_strs if out_str)
-        out_path = self.rules[0].out
-        old_out_text = None
-        force_rewrite = any(rule.force_rewrite for rule in self.rules)
-        if out_path.exists():
-            out_path.chmod(0o644)
-            old_out_text = out_path.read_text()
-        if out_str != old_out_text or force_rewrite:
-            out_path.write_text(out_str)
-        executable = any(rule.executable for rule in self.rules)
-        out_path.chmod(0o544 if executable else 0o444)
+        out_path = self._rules[0].out
+        force_rewrite = bool(self.flags & FORCE_REWRITE)
+        if self.flags & MIRROR:
+            return mirror_tree(self._rules[0].src, out_path,
+                               bool(self.flags & EXECUTABLE), force_rewrite)
+        mode = self.mode()
+        stats = stats or StatCache()
+        src_size = sum(_src_stat(stats, rule.src_str).st_size
+                       for rule in self.rules)
+        profiling.count('bytes_read', src_size)
+        # Large cats are streamed, sniffing for binary sources as they go
+        raw = (None if src_size > STREAM_THRESHOLD_BYTES
+               else [is_raw(rule) for rule in self._rules])
+        if raw is None or any(raw):
+            return self._deploy_streaming(
+                out_path, mode, force_rewrite, stats, raw)
+        if store is not None:
+            if store.place(store.put(self.render_bytes(raw), mode),
+                           out_path, force_rewrite):
+                return True
+            profiling.count('outputs_unchanged')
+            return False
+        return write_output(out_path, self.render(), mode, force_rewrite,
+                            stats)
+
+    def render(self) -> str:
+        '''Return the output this cat would write, rendered in memory.'''
+        return join_parts(self.templater.render_source(rule.src_str)
+                          for rule in self.rules)
+
+    def render_bytes(self, raw: Optional[List[bool]] = None) -> bytes:
+        '''Return the output this cat would write as bytes, in memory.
+
+        Raw and binary sources (or those of the rules flagged in raw) are
+        included verbatim; the rest are templated and encoded.
+        '''
+        encoding = locale.getpreferredencoding(False)
+        if raw is None:
+            raw = [is_raw(rule) for rule in self._rules]
+        parts = (
+            _read_bytes(rule.src_str) if rule_raw
+            else self.templater.render_source(rule.src_str).encode(encoding)
+            for rule, rule_raw in zip(self._rules, raw))
+        return b'\n'.join(part for part in parts if part)
+
+    def mode(self) -> int:
+        '''Return the permissions the output should be deployed with.'''
+        if self.flags & EXECUTABLE:
+            return 0o544
+        return 0o444
+
+    # pylint: disable-next=too-many-arguments
+    def _deploy_streaming(self, out_path: Path, mode: int,
+                          force_rewrite: bool, stats: StatCache,
+                          raw: Optional[List[bool]] = None) -> bool:
+        '''Deploy without holding the whole output in memory.
+
+        The output's hash is worked out first, so nothing is written when
+        the existing output already matches. Sources without tags, and raw
+        or binary ones, are hashed as they are (sniffed for binary in the
+        same read, unless raw says); templated sources are rendered one at
+        a time. Only then is the replacement written, copying the plain
+        sources kernel-side.
+        '''
+        out_hash, plain = self._stream_hash(stats, raw)
+        if (not force_rewrite and hash_file(out_path, hashlib.blake2b)
+                == out_hash):
+            _fix_mode(out_path, mode, stats)
+            profiling.count('outputs_unchanged')
+            return False
+        encoding = locale.getpreferredencoding(False)
+        with AtomicWriter(out_path, mode) as writer:
+            for rule, rule_plain in zip(self.rules, plain):
+                sep = b'\n' if writer.size else b''
+                if rule_plain:
+                    if _src_stat(stats, rule.src_str).st_size:
+                        writer.write(sep)
+                        writer.copy_from(rule.src_str)
+                    continue
+                rendered = self.templater.render_source(rule.src_str)
+                if rendered:
+                    writer.write(sep + rendered.encode(encoding))
+            writer.commit()
+        return True
+
+    def _stream_hash(self, stats: StatCache,
+                     raw: Optional[List[bool]]) -> Tuple[bytes, List[bool]]:
+        '''Return the streamed output's hash and which sources are plain.
+
+        Plain sources are those copied verbatim rather than rendered.
+        '''
+        encoding = locale.getpreferredencoding(False)
+        out_hash = hashlib.blake2b()
+        plain = []
+        size = 0
+        for rule, rule_raw in zip(self.rules,
+                                  raw or [None] * len(self.rules)):
+            sep = b'\n' if size else b''
+            plain_hash = out_hash.copy()
+            plain_hash.update(sep)
+            plain.append(_hash_if_plain(rule.src_str, plain_hash,
+                                        rule.raw or rule_raw))
+            if plain[-1]:
+                src_size = _src_stat(stats, rule.src_str).st_size
+                if src_size:
+                    out_hash = plain_hash
+                    size += len(sep) + src_size
+                continue
+            rendered = self.templater.render_source(rule.src_str)
+            if rendered:
+                part = sep + rendered.encode(encoding)
+                out_hash.update(part)
+                size += len(part)
+        return out_hash.digest(), plain
+
+
+def mirror_tree(src_path: Path, out_path: Path, executable: bool = False,
+                force_rewrite: bool = False, dryrun: bool = False) -> bool:
+    '''Copy a directory tree verbatim, returning true if anything changed.
+
+    Files are copied kernel-side and made readonly, keeping their owner's
+    executable bit (or all made executable). A copied output takes its
+    source's mtime, so files whose output still has the source's size and
+    mtime are skipped without being read. Files in out_path with no source
+    are left in place. With dryrun, nothing is written and the walk stops
+    at the first file that would be copied.
+    '''
+    changed = False
+    with os.scandir(src_path) as entries:
+        subdirs = []
+        if not dryrun:
+            out_path.mkdir(parents=True, exist_ok=True)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif entry.is_file() and _mirror_file(
+                    entry, out_path / entry.name, executable,
+                    force_rewrite, dryrun):
+                if dryrun:
+                    return True
+                changed = True
+    if changed:
+        fsync_dirs([out_path])
+    for name in subdirs:
+        changed |= mirror_tree(src_path / name, out_path / name, executable,
+                               force_rewrite, dryrun)
+        if changed and dryrun:
+            return True
+    return changed
+
+
+def is_raw(rule: Rule) -> bool:
+    '''Return true if a rule's source must be copied rather than templated.
+
+    That is if the rule is marked raw or its source looks binary.
+    '''
+    return rule.raw or is_binary(rule.src_str)
+
+
+def is_binary(src_path: Path) -> bool:
+    '''Return true if a file has a NUL byte near its start.'''
+    with open(src_path, 'rb') as stream:
+        return b'\0' in stream.read(BINARY_SNIFF_BYTES)
+
+
+def join_parts(parts: Iterable[str]) -> str:
+    '''Join rendered sources into an output, skipping empty ones.'''
+    return '\n'.join(part for part in parts if part)
+
+
+def write_output(out_path: Path, output: Union[str, bytes], mode: int,
+                 force_rewrite: bool = False,
+                 stats: Optional[StatCache] = None) -> bool:
+    '''Atomically replace out_path with output unless it already matches.
+
+    output is written as text, or verbatim if it is bytes. An unchanged
+    output only has its mode corrected. Returns true if the output was
+    replaced.
+    '''
+    binary = isinstance(output, bytes)
+    if not force_rewrite and _read_existing(out_path, binary) == output:
+        _fix_mode(out_path, mode, stats or StatCache())
+        profiling.count('outputs_unchanged')
+        return False
+    if binary:
+        with AtomicWriter(out_path, mode) as writer:
+            writer.write(output)
+            writer.commit()
+    else:
+        atomic_write(out_path, output, mode)
+    return True
+
+
+def _mirror_file(entry: os.DirEntry, out_path: Path, executable: bool,
+                 force_rewrite: bool, dryrun: bool) -> bool:
+    '''Copy one mirrored file unless its output is already up to date.'''
+    src_stat = entry.stat()
+    mode = 0o544 if executable or src_stat.st_mode & 0o100 else 0o444
+    try:
+        out_stat = os.stat(out_path)
+    except FileNotFoundError:
+        out_stat = None
+    if (not force_rewrite and out_stat is not None
+            and out_stat.st_size == src_stat.st_size
+            and out_stat.st_mtime_ns == src_stat.st_mtime_ns):
+        if dryrun:
+            return False
+        if out_stat.st_mode & 0o7777 != mode:
+            out_path.chmod(mode)
+        profiling.count('outputs_unchanged')
+        return False
+    if dryrun:
+        return True
+    with AtomicWriter(out_path, mode) as writer:
+        writer.clone_from(Path(entry.path))
+        writer.set_times(src_stat.st_atime_ns, src_stat.st_mtime_ns)
+        writer.commit()
+    return True
+
+
+def _fix_mode(out_path: Path, mode: int, stats: StatCache):
+    '''Set the mode of an unchanged output if it drifted.'''
+    out_stat = stats.stat(out_path)
+    if out_stat is None or out_stat.st_mode & 0o7777 != mode:
+        out_path.chmod(mode)
+
+
+def _src_stat(stats: StatCache, src_path: Path) -> os.stat_result:
+    '''Return the stat of a source, raising if it has gone missing.'''
+    src_stat = stats.stat(src_path)
+    if src_stat is None:
+        raise FileNotFoundError(errno.ENOENT, 'No such source file',
+                                str(src_path))
+    return src_stat
+
+
+def _hash_if_plain(src_path: Path, hasher,
+                   raw: Optional[bool] = False) -> bool:
+    '''Feed src_path to hasher if it can be copied verbatim.
+
+    Unless the source is raw, returns false as soon as a chunk holds a tag
+    opener or a carriage return (which reading as text would translate),
+    leaving hasher partially fed. With raw None, a source is taken as raw
+    if its first chunk looks binary.
+    '''
+    tail = b''
+    with open(src_path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            if raw is None:
+                raw = b'\0' in chunk[:BINARY_SNIFF_BYTES]
+            if not raw and (b'{{' in tail + chunk[:1] or b'{{' in chunk
+                            or b'\r' in chunk):
+                return False
+            hasher.update(chunk)
+            tail = chunk[-1:]
+    return True
+
+
+def _read_bytes(src_path: Path) -> bytes:
+    '''Return the contents of a source, given as a path or string.'''
+    with open(src_path, 'rb') as stream:
+        return stream.read()
+
+
+def _read_existing(out_path, binary: bool = False) -> Union[str, bytes, None]:
+    '''Return the current text (or bytes) of an output, if it can be read.'''
+    try:
+        with open(out_path, 'rb' if binary else 'r') as stream:
+            return stream.read()
+    except (FileNotFoundError, PermissionError, UnicodeDecodeError):
+        return None
 
 
 class ImproperOutpathError(Exception):
@@ -1,28 +1,66 @@
-'''CLI for modot command (MOdular DOTfiles).'''
+'''CLI for modot command (MOdular DOTfiles).
+
+Commands import the modules they deploy with where they use them, so that
+the read-only ones (e.g. theme/color get) don't pay for importing them.
+'''
+# pylint: disable=import-outside-toplevel
 from pathlib import Path
+import signal
 import sys
+from typing import TYPE_CHECKING, Any, Callable, Iterable, List
 
 import click
 
-from modot.cat import Cat
 from modot import hostconfig
-from modot import module_utils
+from modot import ipc
+from modot import profiling
+from modot.stat_cache import StatCache
 from modot.templater import Templater
 
+if TYPE_CHECKING:
+    from modot.cat import Cat
+    from modot.object_store import ObjectStore
+    from modot.snapshot import ConfigSnapshot
+
 
 MODOT_PATH = Path('~/.local/share/modot').expanduser()
 ACTIVE_HOST_PATH = MODOT_PATH / 'config.yaml'
 
 
+def _jobs_option(func):
+    '''Add the --jobs option to a command that deploys.'''
+    return click.option(
+        '--jobs', '-j', type=click.IntRange(min=1),
+        default=_default_jobs, show_default='CPUs + 4, at most 32',
+        help='Number of outputs to deploy concurrently.')(func)
+
+
+def _default_jobs() -> int:
+    '''Return the deployer's default number of jobs.'''
+    from modot import deployer
+    return deployer.DEFAULT_JOBS
+
+
 @click.group(invoke_without_command=True)
 @click.version_option()
+@click.option('--profile', 'profile_summary', is_flag=True, default=False,
+              help='Print phase timings and counters to stderr on exit.')
+@click.option('--profile-json', type=click.Path(dir_okay=False),
+              help='Write phase timings and counters to a JSON file.')
+@click.option('--cprofile', 'cprofile_path', type=click.Path(dir_okay=False),
+              help='Dump cProfile stats of the main thread to a file.')
 @click.pass_context
-def cli(ctx: click.Context):
+def cli(ctx: click.Context, profile_summary: bool, profile_json: str,
+        cprofile_path: str):
     '''Modular dotfile manager.
 
     Run without a command for a summary of current state.
     '''
     MODOT_PATH.mkdir(exist_ok=True, parents=True)
+    if profile_summary or profile_json:
+        _start_profile(ctx, profile_summary, profile_json)
+    if cprofile_path:
+        _start_cprofile(ctx, cprofile_path)
     if ctx.invoked_subcommand is None:
         host = hostconfig.get_deployed_host(ACTIVE_HOST_PATH)
         print(f'Deployed: {str(host)}' if host else 'No deployed host config')
@@ -42,8 +80,14 @@ def cli(ctx: click.Context):
 @click.option('color_flag', '-c', '--color')
 @click.option('--interactive/--non-interactive', default=True)
 @click.option('--dryrun', is_flag=True, default=False)
-def deploy(host: str, theme_flag: str, color_flag: str,
-           interactive: bool, dryrun: bool):
+@click.option('--from-plan', is_flag=True, default=False,
+              help='Place the renders saved by modot plan where still valid.')
+@click.option('--prune', is_flag=True, default=False,
+              help='Remove outputs no module produces any more.')
+@_jobs_option
+# pylint: disable-next=too-many-arguments
+def deploy(host: str, theme_flag: str, color_flag: str, interactive: bool,
+           dryrun: bool, from_plan: bool, prune: bool, jobs: int):
     '''Configure and deploy dotfiles using configuration from HOST.'''
     host_path = Path(host)
     deployed_host_tgt = hostconfig.get_deployed_host(ACTIVE_HOST_PATH)
@@ -57,7 +101,8 @@ def deploy(host: str, theme_flag: str, color_flag: str,
     else:
         print('Deploying host config: ' + str(host_path))
         ACTIVE_HOST_PATH.symlink_to(host_path)
-    host_cfg = hostconfig.from_file(ACTIVE_HOST_PATH)
+    config = _load_config()
+    host_cfg = config.host_config()
     templater = Templater(MODOT_PATH, host_cfg)
     if interactive:
         theme_name = _pick_theme_interactive(templater, host_cfg, theme_flag)
@@ -69,15 +114,22 @@ def deploy(host: str, theme_flag: str, color_flag: str,
             templater, host_cfg, color_flag)
     templater.set_theme(theme_name)
     templater.set_color(color_name)
-    _check_and_deploy(host_cfg, templater, dryrun)
+    _check_and_deploy(config, templater, dryrun, jobs, from_plan)
+    if prune and not dryrun:
+        _clean(config, templater, dryrun=False)
+    if not dryrun:
+        _forward_to_daemon({'command': 'adopt'})
 
 
 @cli.command()
-def reload():
+@_jobs_option
+def reload(jobs: int):
     '''Redeploy dotfiles from the previously deployed configuration.'''
-    host_cfg = hostconfig.from_file(ACTIVE_HOST_PATH)
-    templater = Templater(MODOT_PATH, host_cfg)
-    _check_and_deploy(host_cfg, templater, dryrun=False)
+    if _forward_to_daemon({'command': 'reload'}):
+        return
+    config = _load_config()
+    templater = Templater(MODOT_PATH, config.host_config())
+    _check_and_deploy(config, templater, dryrun=False, jobs=jobs)
 
 
 @cli.group()
@@ -99,21 +151,26 @@ def get_theme():
 def list_themes():
     '''List all themes found in the themes directory.'''
     templater = Templater(MODOT_PATH,
-                          hostconfig.from_file(ACTIVE_HOST_PATH))
+                          _load_config().host_config())
     for name in templater.list_themes():
         print(name)
 
 
 @theme.command('set')
 @click.argument('name')
-def set_theme(name: str):
+@_jobs_option
+def set_theme(name: str, jobs: int):
     '''Set the theme to NAME and redeploy.'''
-    host_cfg = hostconfig.from_file(ACTIVE_HOST_PATH)
+    if _forward_to_daemon({'command': 'set_theme', 'name': name}):
+        return
+    config = _load_config()
+    host_cfg = config.host_config()
     templater = Templater(MODOT_PATH, host_cfg)
     if name not in templater.list_themes():
         sys.exit(f'Could not find specified theme {name}')
     templater.set_theme(name)
-    _check_and_deploy(host_cfg, templater, dryrun=False)
+    if not _deploy_prerendered(config, templater):
+        _check_and_deploy(config, templater, dryrun=False, jobs=jobs)
 
 
 @cli.group()
@@ -135,42 +192,317 @@ def get_color():
 def list_colors():
     '''List all colors found in the colors directory.'''
     templater = Templater(MODOT_PATH,
-                          hostconfig.from_file(ACTIVE_HOST_PATH))
+                          _load_config().host_config())
     for name in templater.list_colors():
         print(name)
 
 
 @color.command('set')
 @click.argument('name')
-def set_color(name: str):
+@_jobs_option
+def set_color(name: str, jobs: int):
     '''Set the color to NAME and redeploy.'''
-    host_cfg = hostconfig.from_file(ACTIVE_HOST_PATH)
+    if _forward_to_daemon({'command': 'set_color', 'name': name}):
+        return
+    config = _load_config()
+    host_cfg = config.host_config()
     templater = Templater(MODOT_PATH, host_cfg)
     if name not in templater.list_colors():
         sys.exit(f'Could not find specified color {name}')
     templater.set_color(name)
-    _check_and_deploy(host_cfg, templater, dryrun=False)
+    if not _deploy_prerendered(config, templater):
+        _check_and_deploy(config, templater, dryrun=False, jobs=jobs)
+
+
+@cli.command('prerender')
+def run_prerender():
+    '''Render every theme/color combination of the deployed host ahead of time.
+
+    Until a source, theme or color changes, theme set and color set then
+    just link each output to its prebuilt render. Identical renders are
+    stored once.
+    '''
+    from modot import deployer, prerender
+    config = _load_config()
+    templater = Templater(MODOT_PATH, config.host_config())
+    cat_dict = deployer.build_cats(config.module_rules().values(), templater)
+    try:
+        deployer.check_cats(cat_dict)
+        renders = prerender.prerender(
+            list(cat_dict.values()), templater, _object_store(),
+            MODOT_PATH / prerender.PRERENDER_FILENAME)
+    except _deploy_errors() as error:
+        sys.exit(str(error))
+    print(f'Prerendered {renders} outputs')
+
+
+@cli.command('plan')
+@click.option('--diff', 'show_diff', is_flag=True, default=False,
+              help='Show a unified diff of each output that would change.')
+@_jobs_option
+def run_plan(show_diff: bool, jobs: int):
+    '''Show what a reload would change, without writing any outputs.
+
+    Lists the outputs that would be created or modified, and those deployed
+    before that no module produces any more. The renders are kept so that
+    deploy --from-plan can apply them without rendering again.
+    '''
+    from modot import deployer, outputs, plan
+    config = _load_config()
+    templater = Templater(MODOT_PATH, config.host_config())
+    cat_dict = deployer.build_cats(config.module_rules().values(), templater)
+    store = _object_store()
+    try:
+        stats = StatCache()
+        deployer.check_cats(cat_dict, stats)
+        deploy_plan = plan.make_plan(
+            list(cat_dict.values()), templater, _manifest_path(),
+            MODOT_PATH / outputs.OUTPUTS_FILENAME, store, jobs, stats,
+            show_diff)
+    except _deploy_errors() as error:
+        sys.exit(str(error))
+    deploy_plan.save(MODOT_PATH / plan.PLAN_FILENAME)
+    _prune_store(store)
+    templater.template_cache.prune()
+    for out, entry in sorted(deploy_plan.entries.items()):
+        if entry.status != plan.UNCHANGED:
+            print(f'{entry.status:<9} {out}')
+        if entry.diff:
+            print(entry.diff, end='')
+    counts = deploy_plan.counts()
+    print(', '.join(f'{counts[status]} {status}'
+                    for status in plan.STATUSES))
+
+
+@cli.command()
+@click.option('--dryrun', is_flag=True, default=False,
+              help='List the stale outputs without removing them.')
+def clean(dryrun: bool):
+    '''Remove deployed outputs that no module produces any more.
+
+    Only outputs recorded by earlier deploys are considered, so nothing
+    else is scanned or touched.
+    '''
+    config = _load_config()
+    _clean(config, Templater(MODOT_PATH, config.host_config()), dryrun)
+
+
+@cli.command('batch')
+@click.argument('batch_file', type=click.Path(exists=True, dir_okay=False))
+@_jobs_option
+def batch_deploy(batch_file: str, jobs: int):
+    '''Deploy several host configs into target roots from BATCH_FILE.
+
+    BATCH_FILE is a YAML list of mappings with a host config path, a root
+    to deploy into and optionally a theme and color (defaulting to the
+    host's). Outputs under your home directory are placed under each root.
+    Shared modules are parsed, and sources rendered, only once.
+    '''
+    from modot import batch
+    targets = batch.load_targets(Path(batch_file))
+    try:
+        written = batch.batch_deploy(targets, MODOT_PATH, jobs)
+    except (batch.BatchTargetError, *_deploy_errors()) as error:
+        sys.exit(str(error))
+    print(f'{written} outputs written across {len(targets)} targets')
+
+
+@cli.command('daemon')
+@_jobs_option
+@click.option('--poll', is_flag=True, default=False,
+              help='Poll for changes instead of using inotify.')
+def run_daemon(jobs: int, poll: bool):
+    '''Keep the deployed config loaded and redeploy when it changes.
+
+    While running, reload and theme/color set are forwarded to the daemon.
+    '''
+    from modot import daemon
+    modot_daemon = daemon.Daemon(MODOT_PATH, ACTIVE_HOST_PATH, jobs)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        modot_daemon.deploy()
+        modot_daemon.serve(MODOT_PATH / ipc.DAEMON_SOCKET_FILENAME, poll)
+    except _deploy_errors() as error:
+        sys.exit(str(error))
+    except daemon.DaemonRunningError:
+        sys.exit('A modot daemon is already running')
+    except KeyboardInterrupt:
+        pass
+
+
+def _start_profile(ctx: click.Context, summary: bool, json_path: str):
+    '''Record timings and counters, reporting them when the command ends.'''
+    profile = profiling.enable()
+
+    def report():
+        profiling.disable()
+        if summary:
+            print(profile.summary(), file=sys.stderr)
+        if json_path:
+            import json
+            with open(json_path, 'w') as stream:
+                json.dump(profile.to_dict(), stream, indent=2)
+    ctx.call_on_close(report)
+
+
+def _start_cprofile(ctx: click.Context, dump_path: str):
+    '''Run the command under cProfile, dumping its stats when it ends.'''
+    import cProfile
+    profiler = cProfile.Profile()
+
+    def dump():
+        profiler.disable()
+        profiler.dump_stats(dump_path)
+    ctx.call_on_close(dump)
+    profiler.enable()
+
+
+def _forward_to_daemon(request: dict) -> bool:
+    '''Send a request to a running daemon, returning false if there is none.'''
+    response = ipc.send_request(MODOT_PATH / ipc.DAEMON_SOCKET_FILENAME,
+                                request)
+    if response is None:
+        return False
+    if response.get('error'):
+        sys.exit(response['error'])
+    return True
+
+
+def _deploy_prerendered(config: 'ConfigSnapshot',
+                        templater: Templater) -> bool:
+    '''Deploy prebuilt outputs for the active theme/color, if still valid.'''
+    from modot import deployer, prerender
+    prerender_path = MODOT_PATH / prerender.PRERENDER_FILENAME
+    if not prerender_path.exists():
+        return False
+    cat_dict = deployer.build_cats(config.module_rules().values(), templater)
+    stats = StatCache()
+    try:
+        deployer.check_cats(cat_dict, stats)
+        deployed = _recording_outputs(
+            cat_dict.values(), lambda: prerender.deploy_prerendered(
+                list(cat_dict.values()), templater, _object_store(),
+                prerender_path, _manifest_path(), stats))
+    except _deploy_errors() as error:
+        sys.exit(str(error))
+    return deployed
+
+
+def _recording_outputs(cats: Iterable['Cat'], deploy_cats: Callable[[], Any]):
+    '''Run deploy_cats, then record the outputs of cats it deployed.
+
+    Nothing is recorded if it returns False (it deployed nothing), and
+    outputs that failed to deploy are left out.
+    '''
+    from modot import deployer, outputs
+    outputs_path = MODOT_PATH / outputs.OUTPUTS_FILENAME
+    try:
+        result = deploy_cats()
+    except deployer.DeployError as error:
+        outputs.record(outputs_path, cats,
+                       (out for out, _ in error.failures))
+        raise
+    if result is not False:
+        outputs.record(outputs_path, cats)
+    return result
+
+
+def _deploy_errors() -> tuple:
+    '''Return the errors a deploy reports to the user instead of raising.'''
+    from modot.deployer import CatCheckError, DeployError
+    from modot.palette import PaletteError
+    return (CatCheckError, DeployError, PaletteError)
+
+
+def _manifest_path() -> Path:
+    '''Return the path of the deploy manifest.'''
+    from modot.manifest import MANIFEST_FILENAME
+    return MODOT_PATH / MANIFEST_FILENAME
+
+
+def _object_store() -> 'ObjectStore':
+    '''Return the store of rendered outputs.'''
+    from modot.object_store import STORE_DIRNAME, ObjectStore
+    return ObjectStore(MODOT_PATH / STORE_DIRNAME)
+
+
+def _load_config() -> 'ConfigSnapshot':
+    '''Return the deployed host config, backed by the config snapshot.'''
+    from modot.snapshot import SNAPSHOT_FILENAME, ConfigSnapshot
+    return ConfigSnapshot(ACTIVE_HOST_PATH, MODOT_PATH / SNAPSHOT_FILENAME)
 
 
 def _check_and_deploy(
-        host_cfg: hostconfig.HostConfig, templater: Templater,
-        dryrun: bool = True):
-    '''Parse the modules, check rules, and deploy files.'''
-    cat_dict = {}
-    for module_path in module_utils.get_module_paths(host_cfg):
-        for rule in module_utils.get_rules(module_path):
-            if rule.out not in cat_dict:
-                cat_dict[rule.out] = Cat(templater)
-            cat_dict[rule.out].rules.append(rule)
+        config: 'ConfigSnapshot', templater: Templater,
+        dryrun: bool = True, jobs: int = 1, from_plan: bool = False):
+    '''Parse the modules, check rules, and deploy files.
+
+    With from_plan, cats still covered by the saved plan are deployed from
+    its renders, and the plan is used up.
+    '''
+    from modot import deployer, plan
+    cat_dict = deployer.build_cats(
+        config.module_rules().values(), templater)
     for cat in cat_dict.values():
         if dryrun:
             print(cat)
-    for outpath, cat in cat_dict.items():
-        if not cat.check():
-            sys.exit(f'cat checks failed for outpath: {outpath}')
-    for cat in cat_dict.values():
+    store = (_object_store()
+             if templater.host_cfg and templater.host_cfg.object_store
+             else None)
+    try:
+        stats = StatCache()
+        deployer.check_cats(cat_dict, stats)
         if not dryrun:
-            cat.deploy()
+            cats = list(cat_dict.values())
+            if from_plan:
+                cats = _planned_cats(cats, templater, stats)
+            written = _recording_outputs(
+                cat_dict.values(), lambda: deployer.deploy_all(
+                    cats, templater, _manifest_path(), jobs, stats, store))
+            if from_plan:
+                (MODOT_PATH / plan.PLAN_FILENAME).unlink()
+            if (store and written) or from_plan:
+                _prune_store(_object_store())
+    except _deploy_errors() as error:
+        sys.exit(str(error))
+
+
+def _clean(config: 'ConfigSnapshot', templater: Templater, dryrun: bool):
+    '''Remove, or with dryrun list, the stale outputs.'''
+    from modot import deployer, outputs
+    outputs_path = MODOT_PATH / outputs.OUTPUTS_FILENAME
+    cats = deployer.build_cats(
+        config.module_rules().values(), templater).values()
+    if dryrun:
+        for out in outputs.stale(outputs_path, cats):
+            print(out)
+        return
+    removed, changed = outputs.clean(outputs_path, cats)
+    for out in removed:
+        print(f'Removed {out}')
+    for out in changed:
+        print(f'Kept {out}: changed since it was deployed')
+    print(f'Removed {len(removed)} stale outputs')
+
+
+def _planned_cats(cats: List['Cat'], templater: Templater,
+                  stats: StatCache) -> List['Cat']:
+    '''Swap in the saved plan's renders for the cats it still covers.'''
+    from modot import plan
+    deploy_plan = plan.Plan.load(MODOT_PATH / plan.PLAN_FILENAME)
+    if deploy_plan is None:
+        sys.exit('No plan to deploy from, run modot plan first')
+    return plan.planned_cats(deploy_plan, cats, templater, _object_store(),
+                             stats)
+
+
+def _prune_store(store: 'ObjectStore'):
+    '''Remove stored renders no output, prerender or plan refers to.'''
+    from modot import plan, prerender
+    deploy_plan = plan.Plan.load(MODOT_PATH / plan.PLAN_FILENAME)
+    store.prune(
+        prerender.indexed_keys(MODOT_PATH / prerender.PRERENDER_FILENAME)
+        | (deploy_plan.keys() if deploy_plan else set()))
 
 
 def _pick_theme_noninteractive(
@@ -0,0 +1,128 @@
+'''Build the template context from its layers, cached on disk.
+
+The context is layered: an optional base file, then the color, then the
+theme, then overrides from the host config, each layer's values replacing
+the last's and nested mappings merged key by key. A dotted key such as
+`bg.dim` sets `dim` inside `bg`. The merged palette_exprs are then
+expanded into the palette's colors (see modot.palette).
+'''
+# json and the palette are imported lazily so that creating a templater
+# stays cheap
+# pylint: disable=import-outside-toplevel
+import os
+from pathlib import Path
+import pickle
+from typing import Iterable, List, Optional, Tuple
+
+from modot import yaml_utils
+
+
+CONTEXT_CACHE_FILENAME = 'context.pickle'
+CONTEXT_CACHE_VERSION = 4
+# Contexts kept on disk, most recently used first
+CONTEXT_CACHE_ENTRIES = 8
+
+
+def merge_layers(layers: Iterable[dict]) -> dict:
+    '''Merge context layers in order, later layers taking priority.'''
+    merged: dict = {}
+    for layer in layers:
+        for key, value in (layer or {}).items():
+            path = str(key).split('.') if isinstance(key, str) else [key]
+            _merge_into(merged, path, value)
+    return merged
+
+
+def load_cached(cache_path: Path, layer_paths: List[Path],
+                overrides: Optional[dict] = None) -> dict:
+    '''Return the context for layer files and overrides.
+
+    Recently built contexts are kept in the cache file at cache_path, keyed
+    by the resolved path, mtime and size of every layer file and by the
+    overrides, so switching back to a recent theme or color skips parsing
+    and merging entirely.
+    '''
+    key = _cache_key(layer_paths, overrides or {})
+    entries = _read_cache(cache_path)
+    for idx, (entry_key, context) in enumerate(entries):
+        if entry_key == key:
+            if idx:
+                entries.insert(0, entries.pop(idx))
+                _write_cache(cache_path, entries)
+            return context
+    context = build(layer_paths, overrides)
+    entries.insert(0, (key, context))
+    _write_cache(cache_path, entries[:CONTEXT_CACHE_ENTRIES])
+    return context
+
+
+def build(layer_paths: List[Path],
+          overrides: Optional[dict] = None) -> dict:
+    '''Parse and merge layer files and overrides into a context.
+
+    Raises PaletteError if the palette can't be expanded.
+    '''
+    from modot import palette
+    layers = []
+    for path in layer_paths:
+        with open(path, 'r') as stream:
+            layers.append(yaml_utils.safe_load(stream))
+    return palette.expand(merge_layers([*layers, overrides or {}]))
+
+
+def _merge_into(target: dict, path: list, value):
+    '''Set value at path in target, merging into existing mappings.'''
+    for key in path[:-1]:
+        if not isinstance(target.get(key), dict):
+            target[key] = {}
+        target = target[key]
+    key = path[-1]
+    if isinstance(value, dict):
+        if not isinstance(target.get(key), dict):
+            target[key] = {}
+        for child_key, child in value.items():
+            child_path = (str(child_key).split('.')
+                          if isinstance(child_key, str) else [child_key])
+            _merge_into(target[key], child_path, child)
+    else:
+        target[key] = value
+
+
+def _read_cache(cache_path: Path) -> List[Tuple[tuple, dict]]:
+    '''Load the cached entries, or none if missing or unusable.'''
+    try:
+        with open(cache_path, 'rb') as stream:
+            cache = pickle.load(stream)
+    except Exception:  # pylint: disable=broad-except
+        return []
+    if (not isinstance(cache, dict)
+            or cache.get('version') != CONTEXT_CACHE_VERSION):
+        return []
+    return cache['entries']
+
+
+def _write_cache(cache_path: Path, entries: List[Tuple[tuple, dict]]):
+    '''Atomically persist the cached entries, if they can be pickled.'''
+    tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as stream:
+            pickle.dump({'version': CONTEXT_CACHE_VERSION,
+                         'entries': entries},
+                        stream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except (OSError, pickle.PicklingError):
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _cache_key(paths: List[Path], overrides: dict) -> tuple:
+    '''Return what identifies a context built from paths and overrides.'''
+    import json
+    signature = []
+    for path in paths:
+        resolved = os.path.realpath(path)
+        path_stat = os.stat(resolved)
+        signature.append(
+            (resolved, path_stat.st_mtime_ns, path_stat.st_size))
+    return (tuple(signature),
+            json.dumps(overrides, sort_keys=True, default=str))
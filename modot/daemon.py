@@ -0,0 +1,222 @@
+'''Long-running daemon that keeps config loaded and redeploys on changes.'''
+import json
+import os
+from pathlib import Path
+import socketserver
+import sys
+import threading
+from typing import Dict, List, Set, Tuple
+
+from modot import deployer
+from modot import hostconfig
+from modot.ipc import send_request
+from modot import module_utils
+from modot import outputs
+from modot import prerender
+from modot.manifest import MANIFEST_FILENAME
+from modot.object_store import STORE_DIRNAME, ObjectStore
+from modot.rule import Rule
+from modot.stat_cache import StatCache
+from modot.templater import Templater
+
+
+# How often the watch loop wakes to notice a reload changed its roots
+ROOTS_CHECK_SECONDS = 1.0
+
+
+class Daemon():
+    '''Holds the parsed host config, rules and templater between deploys.'''
+    def __init__(self, modot_path: Path, host_path: Path,
+                 jobs: int = deployer.DEFAULT_JOBS):
+        '''Parse the host config and every module it enables.'''
+        self.modot_path = modot_path
+        self.host_path = host_path
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        self.host_cfg, self.templater, self.module_rules = self._parse()
+
+    def load(self):
+        '''Re-read the host config and every module from scratch.'''
+        self.host_cfg, self.templater, self.module_rules = self._parse()
+
+    def watch_roots(self) -> List[Path]:
+        '''Return the directories whose contents affect the deploy.'''
+        base = self.host_cfg.context_base
+        return [*self.host_cfg.domains, self.host_cfg.themes_path,
+                self.host_cfg.colors_path, *([base.parent] if base else [])]
+
+    def deploy(self):
+        '''Check and deploy every cat, skipping those that are current.'''
+        cat_dict = deployer.build_cats(
+            self.module_rules.values(), self.templater)
+        stats = StatCache()
+        deployer.check_cats(cat_dict, stats)
+        store = (ObjectStore(self.modot_path / STORE_DIRNAME)
+                 if self.host_cfg.object_store else None)
+        outputs_path = self.modot_path / outputs.OUTPUTS_FILENAME
+        try:
+            written = deployer.deploy_all(
+                list(cat_dict.values()), self.templater,
+                self.modot_path / MANIFEST_FILENAME, self.jobs, stats, store)
+        except deployer.DeployError as error:
+            outputs.record(outputs_path, cat_dict.values(),
+                           (out for out, _ in error.failures))
+            raise
+        outputs.record(outputs_path, cat_dict.values())
+        if store and written:
+            store.prune(prerender.indexed_keys(
+                self.modot_path / prerender.PRERENDER_FILENAME))
+
+    def apply_changes(self, changed: Set[Path]):
+        '''Update in-memory state for the changed paths and redeploy.
+
+        Theme/color (or base context) changes drop the cached context;
+        module changes reparse only the modules whose config or file listing
+        changed. The manifest then limits the redeploy to the cats actually
+        affected.
+        '''
+        themecolor_roots = [self.host_cfg.themes_path,
+                            self.host_cfg.colors_path]
+        if self.host_cfg.context_base:
+            themecolor_roots.append(self.host_cfg.context_base)
+        if any(_is_under(path, root)
+               for path in changed for root in themecolor_roots):
+            self.templater.invalidate()
+        if any(_is_under(path, root)
+               for path in changed for root in self.host_cfg.domains):
+            module_rules = {}
+            for module_path in module_utils.get_module_paths(self.host_cfg):
+                rules = self.module_rules.get(module_path)
+                if rules is None or _needs_reparse(
+                        module_path, rules, changed):
+                    rules = module_utils.get_rules(module_path)
+                module_rules[module_path] = rules
+            self.module_rules = module_rules
+        self.deploy()
+
+    def handle(self, request: dict) -> dict:
+        '''Serve a single client request, returning the response.
+
+        'adopt' re-reads the state a CLI deploy has just written without
+        deploying again.
+        '''
+        command = request.get('command')
+        with self.lock:
+            try:
+                if command in ('reload', 'adopt'):
+                    self.load()
+                elif command == 'set_theme':
+                    if request['name'] not in self.templater.list_themes():
+                        return {'error': 'Could not find specified theme '
+                                         f'{request["name"]}'}
+                    self.templater.set_theme(request['name'])
+                elif command == 'set_color':
+                    if request['name'] not in self.templater.list_colors():
+                        return {'error': 'Could not find specified color '
+                                         f'{request["name"]}'}
+                    self.templater.set_color(request['name'])
+                elif command != 'ping':
+                    return {'error': f'Unknown daemon command: {command}'}
+                if command not in ('ping', 'adopt'):
+                    self.deploy()
+            except Exception as error:  # pylint: disable=broad-except
+                return {'error': str(error)}
+        return {}
+
+    def serve(self, socket_path: Path, poll: bool = False):
+        '''Serve requests on socket_path and redeploy on changes forever.'''
+        # Only the daemon itself needs the watchers (and ctypes)
+        # pylint: disable-next=import-outside-toplevel
+        from modot.watch import make_watcher
+        if send_request(socket_path, {'command': 'ping'}) is not None:
+            raise DaemonRunningError(socket_path)
+        if socket_path.exists() or socket_path.is_symlink():
+            socket_path.unlink()
+        server = _Server(socket_path, self)
+        os.chmod(socket_path, 0o600)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        watcher = make_watcher(self.watch_roots(), poll)
+        try:
+            while True:
+                changed = watcher.wait(ROOTS_CHECK_SECONDS)
+                with self.lock:
+                    if changed:
+                        self._apply_changes_logged(changed)
+                    if watcher.roots != self.watch_roots():
+                        watcher.close()
+                        watcher = make_watcher(self.watch_roots(), poll)
+        finally:
+            watcher.close()
+            server.shutdown()
+            server.server_close()
+            socket_path.unlink()
+
+    def _parse(self) -> Tuple[hostconfig.HostConfig, Templater,
+                              Dict[Path, List[Rule]]]:
+        '''Parse the host config and every module it enables.'''
+        host_cfg = hostconfig.from_file(self.host_path)
+        module_rules = {
+            module_path: module_utils.get_rules(module_path)
+            for module_path in module_utils.get_module_paths(host_cfg)}
+        return host_cfg, Templater(self.modot_path, host_cfg), module_rules
+
+    def _apply_changes_logged(self, changed: Set[Path]):
+        '''Apply changes, reporting failures without stopping the daemon.'''
+        try:
+            self.apply_changes(changed)
+        except Exception as error:  # pylint: disable=broad-except
+            print(error, file=sys.stderr)
+
+
+def _is_under(path: Path, root: Path) -> bool:
+    '''Return true if path is root or inside it.'''
+    return path == root or root in path.parents
+
+
+def _needs_reparse(module_path: Path, rules: List[Rule],
+                   changed: Set[Path]) -> bool:
+    '''Return true if a change could alter the rules parsed from a module.
+
+    Edits to known sources only change content, which the deploy picks up
+    without reparsing; anything else under the module might add, remove or
+    reconfigure rules. Changes inside mirrored trees are copied by the
+    deploy itself.
+    '''
+    sources = {rule.src for rule in rules}
+    mirrored = [rule.src for rule in rules if rule.mirror]
+    for path in changed:
+        if not _is_under(path, module_path) or path == module_path:
+            continue
+        if any(_is_under(path, src) for src in mirrored):
+            continue
+        if (path.name == module_utils.MODULE_CONF_FILENAME
+                or path not in sources or not path.exists()):
+            return True
+    return False
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    '''Reads one JSON request line and writes one JSON response line.'''
+    def handle(self):
+        '''Dispatch the request to the daemon.'''
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            response = {'error': 'Malformed daemon request'}
+        else:
+            response = self.server.modot_daemon.handle(request)
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''Unix socket server handing requests to the daemon.'''
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, modot_daemon: Daemon):
+        '''Bind the socket and save the daemon.'''
+        self.modot_daemon = modot_daemon
+        super().__init__(str(socket_path), _RequestHandler)
+
+
+class DaemonRunningError(Exception):
+    '''Raised when starting a daemon while another is serving the socket.'''
@@ -0,0 +1,261 @@
+'''Deploy a set of independent cats, optionally through a pipeline.'''
+import locale
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from modot import cat as cat_module
+from modot import pipeline, profiling
+from modot.cat import Cat, join_parts, write_output
+from modot.fileio import fsync_dirs
+from modot.manifest import Manifest, context_digests
+from modot.object_store import ObjectStore
+from modot.rule import FORCE_REWRITE, MIRROR, RAW, Rule
+from modot.stat_cache import StatCache
+from modot.templater import Templater
+
+
+DEFAULT_JOBS = min(32, (os.cpu_count() or 1) + 4)
+
+
+class _Result(NamedTuple):
+    '''Outcome of deploying a single cat.'''
+    sources: Optional[List[list]]
+    deployed: bool
+    wrote: bool
+    error: Optional[Exception]
+
+
+class _Job(NamedTuple):
+    '''A cat on its way through the deploy pipeline.
+
+    A cat without texts is not rendered in memory, and one without an
+    output is left to deploy itself.
+    '''
+    cat: Cat
+    sources: List[list]
+    texts: Optional[List[str]] = None
+    output: Optional[str] = None
+
+
+def build_cats(rule_lists: Iterable[List[Rule]],
+               templater: Templater) -> Dict[Path, Cat]:
+    '''Group rules from each module into cats keyed by output path.'''
+    cats_by_out: Dict[str, Cat] = {}
+    for rules in rule_lists:
+        for rule in rules:
+            cat = cats_by_out.get(rule.out_str)
+            if cat is None:
+                cat = cats_by_out[rule.out_str] = Cat(templater)
+            cat.add(rule)
+    return {Path(out_str): cat for out_str, cat in cats_by_out.items()}
+
+
+def check_cats(cat_dict: Dict[Path, Cat],
+               stats: Optional[StatCache] = None):
+    '''Raise CatCheckError for the first cat that fails its checks.'''
+    stats = stats or StatCache()
+    for outpath, cat in cat_dict.items():
+        if not cat.check(stats):
+            raise CatCheckError(outpath)
+
+
+@profiling.timed('deploy_all')
+# pylint: disable-next=too-many-arguments
+def deploy_all(cats: List[Cat], templater: Templater, manifest_path: Path,
+               jobs: int = DEFAULT_JOBS, stats: Optional[StatCache] = None,
+               store: Optional[ObjectStore] = None) -> int:
+    '''Deploy checked cats, skipping any the manifest shows are current.
+
+    Only outputs whose sources or referenced context values changed are
+    rendered and written; the rest cost a stat of their sources and output,
+    which the check phase has usually already taken into stats. Returns how
+    many outputs were written. The on-disk template cache is pruned after.
+    '''
+    manifest = Manifest.load(manifest_path)
+    context = context_digests(templater.context())
+    try:
+        return deploy_cats(cats, manifest, context, jobs, stats, store)
+    finally:
+        manifest.save(context)
+        templater.template_cache.prune()
+
+
+# pylint: disable-next=too-many-arguments
+def deploy_cats(cats: List[Cat], manifest: Manifest,
+                context: Dict[str, str], jobs: int = DEFAULT_JOBS,
+                stats: Optional[StatCache] = None,
+                store: Optional[ObjectStore] = None) -> int:
+    '''Deploy every cat that is not current and record it in the manifest.
+
+    Cats write to distinct outputs so they are deployed concurrently, through
+    a pipeline, when jobs > 1. Every cat is attempted; failures are collected
+    and raised together, in cat order, once all deploys have finished. The
+    directories of replaced outputs are synced once each at the end. Returns
+    how many outputs were written.
+    '''
+    stats = stats or StatCache()
+    if jobs > 1 and len(cats) > 1:
+        results = _deploy_pipelined(cats, manifest, context, jobs, stats,
+                                    store)
+    else:
+        results = [_deploy_one(cat, manifest, context, stats, store)
+                   for cat in cats]
+    fsync_dirs(cat.out.parent
+               for cat, result in zip(cats, results) if result.wrote)
+    failures = []
+    for cat, result in zip(cats, results):
+        if result.error:
+            failures.append((str(cat.out), result.error))
+        elif result.deployed:
+            manifest.record(cat, result.sources)
+        else:
+            manifest.keep(cat, result.sources)
+    if failures:
+        raise DeployError(failures)
+    return sum(1 for result in results if result.wrote)
+
+
+def _deploy_one(cat: Cat, manifest: Manifest, context: Dict[str, str],
+                stats: StatCache, store: Optional[ObjectStore]) -> _Result:
+    '''Deploy a cat unless the manifest shows it is current.'''
+    sources = None
+    try:
+        sources = manifest.fingerprint(cat, stats)
+        if manifest.is_current(cat, sources, context, stats):
+            profiling.count('outputs_current')
+            return _Result(sources, False, False, None)
+        wrote = cat.deploy(stats, store)
+    except Exception as error:  # pylint: disable=broad-except
+        return _Result(sources, False, False, error)
+    return _Result(sources, True, wrote, None)
+
+
+# pylint: disable-next=too-many-arguments
+def _deploy_pipelined(cats: List[Cat], manifest: Manifest,
+                      context: Dict[str, str], jobs: int, stats: StatCache,
+                      store: Optional[ObjectStore]) -> List[_Result]:
+    '''Deploy cats through overlapping read, render and write stages.
+
+    Each source is read once, however many cats use it, and dropped once
+    they all have it. Bounded queues between the stages keep only a few
+    cats' sources and outputs in memory at a time. Cats that can't be
+    rendered in memory (mirrors, raw or binary sources, outputs past the
+    streaming threshold) deploy themselves in the write stage.
+    '''
+    reader = pipeline.SourceReader(
+        rule.src_str for cat in cats if _in_memory(cat) for rule in cat.rules)
+
+    def read(cat: Cat):
+        sources = None
+        # Uses of cat's sources not yet handed to _read_sources
+        held = _in_memory(cat)
+        try:
+            sources = manifest.fingerprint(cat, stats)
+            if manifest.is_current(cat, sources, context, stats):
+                profiling.count('outputs_current')
+                return pipeline.Finished(_Result(sources, False, False, None))
+            held = False
+            return _Job(cat, sources, _read_sources(cat, reader, stats))
+        except Exception as error:  # pylint: disable=broad-except
+            return pipeline.Finished(_Result(sources, False, False, error))
+        finally:
+            if held:
+                for rule in cat.rules:
+                    reader.skip(rule.src_str)
+
+    def render(job: _Job):
+        if job.texts is None:
+            return job
+        try:
+            return job._replace(texts=None, output=join_parts(
+                job.cat.templater.render_text(text) for text in job.texts))
+        except Exception as error:  # pylint: disable=broad-except
+            return pipeline.Finished(_Result(job.sources, False, False, error))
+
+    def write(job: _Job) -> _Result:
+        try:
+            if job.output is None:
+                wrote = job.cat.deploy(stats, store)
+            else:
+                wrote = _write_rendered(job.cat, job.output, stats, store)
+        except Exception as error:  # pylint: disable=broad-except
+            return _Result(job.sources, False, False, error)
+        return _Result(job.sources, True, wrote, None)
+    return pipeline.run(cats, [(read, jobs),
+                               (render, min(jobs, os.cpu_count() or 1)),
+                               (write, jobs)])
+
+
+def _in_memory(cat: Cat) -> bool:
+    '''Return true if the pipeline may render cat itself.
+
+    Cats overriding deploy (such as planned cats) are left to use it.
+    '''
+    return (type(cat).deploy is Cat.deploy and bool(cat)
+            and not cat.flags & (MIRROR | RAW))
+
+
+def _read_sources(cat: Cat, reader: pipeline.SourceReader,
+                  stats: StatCache) -> Optional[List[str]]:
+    '''Return the text of each of cat's sources, if it renders in memory.
+
+    Returns None for cats that must deploy themselves, such as those with a
+    binary source.
+    '''
+    if not _in_memory(cat):
+        return None
+    consumed = 0
+    try:
+        src_stats = [stats.stat(rule.src_str) for rule in cat.rules]
+        src_size = sum(src_stat.st_size for src_stat in src_stats
+                       if src_stat is not None)
+        if src_size > cat_module.STREAM_THRESHOLD_BYTES:
+            return None
+        texts = []
+        for rule in cat.rules:
+            consumed += 1
+            text = reader.read(rule.src_str)
+            if text is None:
+                return None
+            texts.append(text)
+        profiling.count('bytes_read', src_size)
+        return texts
+    finally:
+        for rule in cat.rules[consumed:]:
+            reader.skip(rule.src_str)
+
+
+def _write_rendered(cat: Cat, output: str, stats: StatCache,
+                    store: Optional[ObjectStore]) -> bool:
+    '''Write a cat's rendered output as Cat.deploy would.'''
+    out_path = cat.rules[0].out
+    mode = cat.mode()
+    force_rewrite = bool(cat.flags & FORCE_REWRITE)
+    if store is None:
+        return write_output(out_path, output, mode, force_rewrite, stats)
+    if store.place(store.put(output.encode(locale.getpreferredencoding(False)),
+                             mode), out_path, force_rewrite):
+        return True
+    profiling.count('outputs_unchanged')
+    return False
+
+
+class CatCheckError(Exception):
+    '''Raised when a cat fails its checks before deploying.'''
+    def __str__(self) -> str:
+        '''Name the output whose cat failed.'''
+        return f'cat checks failed for outpath: {self.args[0]}'
+
+
+class DeployError(Exception):
+    '''Raised when one or more cats failed to deploy.'''
+    def __init__(self, failures: List[Tuple[str, Exception]]):
+        '''Save the failures, in deploy order.'''
+        super().__init__(failures)
+        self.failures = failures
+
+    def __str__(self) -> str:
+        '''List each failed output and its error.'''
+        return '\n'.join(f'deploy failed for outpath: {out}: {error!r}'
+                         for out, error in self.failures)
@@ -0,0 +1,209 @@
+'''Helpers for atomically replacing output files.'''
+import errno
+import fcntl
+import locale
+import os
+from pathlib import Path
+import tempfile
+import threading
+from typing import Callable, Iterable, Optional
+
+from modot import profiling
+
+
+CHUNK_SIZE = 1 << 16
+# ioctl sharing one file's extents with another (btrfs, xfs), see linux/fs.h
+FICLONE = 0x40049409
+# Errors meaning a kernel-side copy isn't supported between these files
+_COPY_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                     errno.ENOTSUP, errno.EBADF, errno.ETXTBSY)
+
+
+class AtomicWriter():
+    '''Builds a replacement for a file in a temp file in the same directory.
+
+    The temp file has its final mode set up front. Nothing is visible at the
+    destination until commit() syncs its data and renames it over path;
+    leaving the context without committing removes it. If path is a
+    symlink, the file it points to is replaced and the link kept. The
+    directory entry is not synced here; callers batch that with fsync_dirs
+    once all writes finish.
+    '''
+    def __init__(self, path: Path, mode: int):
+        '''Create the temp file next to path, or next to its target.'''
+        if os.path.islink(path):
+            path = Path(os.path.realpath(path))
+        self.path = path
+        self.size = 0
+        self._fd, self._tmp_name = tempfile.mkstemp(
+            dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+        self._done = False
+        try:
+            os.fchmod(self._fd, mode)
+        except BaseException:
+            self.discard()
+            raise
+
+    def __enter__(self) -> 'AtomicWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self._done:
+            self.discard()
+
+    def write(self, data: bytes):
+        '''Append data to the replacement.'''
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+        self.size += len(data)
+
+    def copy_from(self, src_path: Path):
+        '''Append the contents of src_path, copying kernel-side if possible.'''
+        with open(src_path, 'rb') as src:
+            self.size += _copy_fd(src.fileno(), self._fd,
+                                  os.fstat(src.fileno()).st_size)
+
+    def clone_from(self, src_path: Path):
+        '''Make the replacement a copy of src_path, reflinked if possible.'''
+        with open(src_path, 'rb') as src:
+            try:
+                fcntl.ioctl(self._fd, FICLONE, src.fileno())
+            except OSError as error:
+                if error.errno not in _COPY_UNSUPPORTED + (errno.ENOTTY,):
+                    raise
+                self.copy_from(src_path)
+                return
+            self.size = os.fstat(src.fileno()).st_size
+
+    def set_times(self, atime_ns: int, mtime_ns: int):
+        '''Set the access and modification times of the replacement.'''
+        os.utime(self._fd, ns=(atime_ns, mtime_ns))
+
+    def commit(self):
+        '''Atomically replace path with the written contents.
+
+        The contents are synced first, so that once the rename is synced
+        path can't be left pointing to unwritten blocks by a crash.
+        '''
+        self._done = True
+        try:
+            try:
+                _sync_data(self._fd)
+            finally:
+                os.close(self._fd)
+            os.replace(self._tmp_name, self.path)
+        except BaseException:
+            os.unlink(self._tmp_name)
+            raise
+        profiling.count('outputs_written')
+        profiling.count('bytes_written', self.size)
+
+    def discard(self):
+        '''Throw away the written contents, leaving path untouched.'''
+        os.close(self._fd)
+        self._done = True
+        os.unlink(self._tmp_name)
+
+
+def _sync_data(fd: int):
+    '''Flush the data written to fd to disk, skipping metadata if possible.'''
+    getattr(os, 'fdatasync', os.fsync)(fd)
+
+
+def atomic_write(path: Path, text: str, mode: int):
+    '''Replace path with text so readers never see a partial file.'''
+    with AtomicWriter(path, mode) as writer:
+        writer.write(text.encode(locale.getpreferredencoding(False)))
+        writer.commit()
+
+
+def atomic_link(src_path: Path, path: Path) -> bool:
+    '''Replace path with a hardlink to src_path.
+
+    Returns false, leaving path untouched, if the filesystem can't link the
+    two (e.g. they are on different devices).
+    '''
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.'
+                              f'{threading.get_ident()}.tmp')
+    try:
+        os.link(src_path, tmp_path)
+    except OSError as error:
+        if error.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                           errno.EOPNOTSUPP):
+            return False
+        raise
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    profiling.count('outputs_linked')
+    return True
+
+
+def hash_file(path: Path, hasher_factory: Callable) -> Optional[bytes]:
+    '''Return the digest of a file read in chunks, None if unreadable.'''
+    hasher = hasher_factory()
+    try:
+        with open(path, 'rb') as stream:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+    except (FileNotFoundError, PermissionError, IsADirectoryError):
+        return None
+    return hasher.digest()
+
+
+def fsync_dirs(dir_paths: Iterable[Path]):
+    '''Flush the directory entries of each directory to disk, once each.'''
+    for dir_path in set(dir_paths):
+        dir_fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def _copy_fd(src_fd: int, dst_fd: int, count: int) -> int:
+    '''Copy count bytes between file offsets, preferring kernel-side copies.
+
+    Tries copy_file_range, then sendfile, then a plain read/write loop,
+    moving on whenever the kernel says a method isn't supported here.
+    '''
+    copied = 0
+    for copy_chunk in _COPY_METHODS:
+        try:
+            while copied < count:
+                chunk_copied = copy_chunk(src_fd, dst_fd, count - copied)
+                if not chunk_copied:
+                    return copied
+                copied += chunk_copied
+            return copied
+        except OSError as error:
+            if error.errno not in _COPY_UNSUPPORTED:
+                raise
+    return copied
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, count: int) -> int:
+    '''Copy with copy_file_range, which may share extents on some fs.'''
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'copy_file_range is unavailable')
+    return os.copy_file_range(src_fd, dst_fd, count)
+
+
+def _sendfile(src_fd: int, dst_fd: int, count: int) -> int:
+    '''Copy with sendfile, which avoids copying through userspace.'''
+    return os.sendfile(dst_fd, src_fd, None, count)
+
+
+def _read_write(src_fd: int, dst_fd: int, count: int) -> int:
+    '''Copy one chunk through userspace.'''
+    data = os.read(src_fd, min(count, CHUNK_SIZE))
+    view = memoryview(data)
+    while view:
+        view = view[os.write(dst_fd, view):]
+    return len(data)
+
+
+_COPY_METHODS = (_copy_file_range, _sendfile, _read_write)
@@ -1,13 +1,13 @@
 '''Object for parsing and containing the host configuration.'''
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
-import yaml
+from modot import yaml_utils
 
 
 @dataclass
-class HostConfig():
+class HostConfig():  # pylint: disable=too-many-instance-attributes
     '''Stores values parsed from the host configuration.'''
     themes_path: Path
     colors_path: Path
@@ -15,12 +15,15 @@ class HostConfig():
     default_color: str = ''
     domains: List[Path] = field(default_factory=list)
     modules: List[str] = field(default_factory=list)
+    object_store: bool = False
+    context_base: Optional[Path] = None
+    context: Dict[str, Any] = field(default_factory=dict)
 
 
 def from_file(host_path: Path) -> HostConfig:
     '''Gets a host configuration from the file at the given path.'''
     with open(host_path, 'r') as stream:
-        host_dict = yaml.safe_load(stream)
+        host_dict = yaml_utils.safe_load(stream)
     host_cfg = HostConfig(
         Path(host_dict['themes']).expanduser(),
         Path(host_dict['colors']).expanduser())
@@ -29,6 +32,10 @@ def from_file(host_path: Path) -> HostConfig:
     host_cfg.domains = [
         Path(dom).expanduser() for dom in host_dict.get('domains', [])]
     host_cfg.modules = host_dict.get('modules', [])
+    host_cfg.object_store = bool(host_dict.get('object_store', False))
+    if host_dict.get('context_base'):
+        host_cfg.context_base = Path(host_dict['context_base']).expanduser()
+    host_cfg.context = host_dict.get('context') or {}
     return host_cfg
 
 
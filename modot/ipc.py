@@ -0,0 +1,30 @@
+'''Client side of the daemon socket, kept free of the daemon's imports.
+
+Every command that changes the deploy checks for a daemon first, so json
+and socket are only imported once there is a socket to talk to.
+'''
+# pylint: disable=import-outside-toplevel
+from pathlib import Path
+from typing import Optional
+
+
+DAEMON_SOCKET_FILENAME = 'daemon.sock'
+
+
+def send_request(socket_path: Path, request: dict) -> Optional[dict]:
+    '''Send a request to a running daemon, or return None if none is up.'''
+    if not socket_path.exists():
+        return None
+    import json
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as stream:
+            line = stream.readline()
+    if not line:
+        return {'error': 'Daemon closed the connection'}
+    return json.loads(line)
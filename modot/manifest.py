@@ -0,0 +1,163 @@
+'''Persistent record of deployed outputs, used to skip unchanged cats.'''
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from modot import profiling
+from modot.cat import BINARY_SNIFF_BYTES, Cat
+from modot.rule import FORCE_REWRITE, MIRROR
+from modot.stat_cache import StatCache
+
+
+MANIFEST_FILENAME = 'manifest.json'
+MANIFEST_VERSION = 2
+
+
+class Manifest():
+    '''Records the sources, context and output state of each deployed cat.
+
+    An entry is keyed by output path and holds a fingerprint of every source
+    (path, mtime, size, content hash and the context keys it references)
+    along with the stat of the output as it was left after deploying. The
+    manifest also keeps a digest of each context value, so a cat can be
+    skipped without rendering if its sources and output are unchanged and
+    none of the context keys its sources reference have changed value.
+    '''
+    def __init__(self, path: Path):
+        '''Create an empty manifest that will be saved to path.'''
+        self.path = path
+        self.context: Dict[str, str] = {}
+        self.entries: Dict[str, dict] = {}
+        self._new_entries: Dict[str, dict] = {}
+
+    @classmethod
+    def load(cls, path: Path) -> 'Manifest':
+        '''Load the manifest at path, or an empty one if missing/unreadable.'''
+        manifest = cls(path)
+        try:
+            with open(path, 'r') as stream:
+                manifest_dict = json.load(stream)
+        except (OSError, ValueError):
+            return manifest
+        if manifest_dict.get('version') != MANIFEST_VERSION:
+            return manifest
+        manifest.context = manifest_dict.get('context', {})
+        manifest.entries = manifest_dict.get('entries', {})
+        return manifest
+
+    def save(self, context: Dict[str, str]):
+        '''Atomically write the entries recorded during this run.'''
+        manifest_dict = {
+            'version': MANIFEST_VERSION,
+            'context': context,
+            'entries': self._new_entries,
+        }
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as stream:
+            json.dump(manifest_dict, stream, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    @profiling.timed('Manifest.fingerprint')
+    def fingerprint(self, cat: Cat,
+                    stats: Optional[StatCache] = None) -> List[list]:
+        '''Fingerprint the sources of a cat.
+
+        Sources whose stat matches the recorded entry reuse the recorded
+        hash and keys, so only sources that have been touched are read.
+        Mirrored trees have no fingerprint; they check their own files.
+        '''
+        if cat.flags & MIRROR:
+            return []
+        stats = stats or StatCache()
+        old_sources = {}
+        entry = self.entries.get(cat.rules[0].out_str)
+        if entry:
+            old_sources = {src[0]: src for src in entry['sources']}
+        sources = []
+        for rule in cat.rules:
+            src_str = rule.src_str
+            src_stat = stats.stat(src_str)
+            if src_stat is None:
+                src_stat = os.stat(src_str)
+            old = old_sources.get(src_str)
+            if (old and old[1] == src_stat.st_mtime_ns
+                    and old[2] == src_stat.st_size):
+                digest, keys = old[3], old[4]
+            else:
+                with open(src_str, 'rb') as stream:
+                    src_bytes = stream.read()
+                digest = hashlib.sha256(src_bytes).hexdigest()
+                if rule.raw or b'\0' in src_bytes[:BINARY_SNIFF_BYTES]:
+                    keys = []
+                else:
+                    keys = cat.templater.keys(
+                        src_bytes.decode(errors='replace'))
+                    keys = None if keys is None else sorted(keys)
+            sources.append([src_str, src_stat.st_mtime_ns, src_stat.st_size,
+                            digest, keys])
+        return sources
+
+    def is_current(self, cat: Cat, sources: List[list],
+                   context: Dict[str, str],
+                   stats: Optional[StatCache] = None) -> bool:
+        '''Return true if the deployed output of cat is still up to date.'''
+        if cat.flags & (FORCE_REWRITE | MIRROR):
+            return False
+        entry = self.entries.get(cat.rules[0].out_str)
+        if not entry:
+            return False
+        old_sources = [(src[0], src[3]) for src in entry['sources']]
+        if old_sources != [(src[0], src[3]) for src in sources]:
+            return False
+        if any(self.context.get(key) != context.get(key)
+               for key in _referenced_keys(sources, context, self.context)):
+            return False
+        return entry['out'] == _out_stat(cat, stats)
+
+    def keep(self, cat: Cat, sources: List[list]):
+        '''Carry the entry for a skipped cat over, refreshing source stats.'''
+        out_str = cat.rules[0].out_str
+        self._new_entries[out_str] = {
+            'sources': sources, 'out': self.entries[out_str]['out']}
+
+    def record(self, cat: Cat, sources: List[list]):
+        '''Record a freshly deployed cat.'''
+        self._new_entries[cat.rules[0].out_str] = {
+            'sources': sources, 'out': _out_stat(cat)}
+
+
+def context_digests(context: dict) -> Dict[str, str]:
+    '''Return a digest of each top-level value in a template context.'''
+    return {
+        str(key): hashlib.sha256(json.dumps(
+            value, sort_keys=True, default=str).encode()).hexdigest()
+        for key, value in context.items()}
+
+
+def _referenced_keys(sources: List[list], *contexts: Dict[str, str]):
+    '''Return the context keys any source references.'''
+    keys = set()
+    for src in sources:
+        if src[4] is None:
+            return set().union(*contexts)
+        keys.update(src[4])
+    return keys
+
+
+def _out_stat(cat: Cat, stats: Optional[StatCache] = None) -> Optional[list]:
+    '''Return the identifying stat of a cat's output, if it exists.
+
+    Only pass stats from before the output was last written.
+    '''
+    if stats is not None:
+        out_stat = stats.stat(cat.out)
+    else:
+        try:
+            out_stat = os.stat(cat.out)
+        except FileNotFoundError:
+            out_stat = None
+    if out_stat is None:
+        return None
+    return [out_stat.st_mtime_ns, out_stat.st_size, out_stat.st_mode]
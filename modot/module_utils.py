@@ -1,60 +1,120 @@
 '''Build generators for retrieving modules and rules from filesystem.'''
+from fnmatch import fnmatchcase
+import os
 from pathlib import Path
-from typing import Generator, List
-
-import yaml
+from typing import Generator, Iterator, List, Optional, Sequence
 
+from modot import profiling
 from modot.hostconfig import HostConfig
 from modot.rule import Rule
+from modot.stat_cache import StatCache
+from modot import yaml_utils
 
 
 MODULE_CONF_FILENAME = 'module.yaml'
 
 
-def get_module_paths(host_cfg: HostConfig) -> Generator[Path, None, None]:
-    '''Search for modules based on host_cfg and yield them in order.'''
+@profiling.timed('get_module_paths')
+def get_module_paths(
+        host_cfg: HostConfig, deps: Optional[List[Path]] = None,
+        stats: Optional[StatCache] = None) -> Generator[Path, None, None]:
+    '''Search for modules based on host_cfg and yield them in order.
+
+    If deps is given, the domain directories searched are appended to it.
+    Each domain is listed once, through stats if one is shared.
+    '''
+    stats = stats or StatCache()
     encountered_domains = set()
     for domain_path in host_cfg.domains:
         if domain_path in encountered_domains:
             raise DuplicateDomainError
         encountered_domains.add(domain_path)
-        if not domain_path.exists():
+        if deps is not None:
+            deps.append(domain_path)
+        if not stats.exists(domain_path):
             raise FileNotFoundError
-        if not domain_path.is_dir():
+        if not stats.is_dir(domain_path):
             raise NotADirectoryError
         for module in host_cfg.modules:
             module_path = domain_path / module
-            if not module_path.exists():
+            if not stats.exists(module_path):
                 continue
-            if not module_path.is_dir():
+            if not stats.is_dir(module_path):
                 raise NotADirectoryError
             yield module_path
 
 
-def get_rules(module_path: Path) -> List[Rule]:
-    '''Parse the concat rules from a module.'''
+@profiling.timed('get_rules')
+def get_rules(module_path: Path,
+              deps: Optional[List[Path]] = None) -> List[Rule]:
+    '''Parse the concat rules from a module.
+
+    A dir_contents entry gives a rule per entry of its directory, or with
+    recursive set, per file anywhere below it, walking each directory once
+    with scandir. include and exclude globs filter what is expanded: a glob
+    with a slash matches the path relative to the entry's directory, one
+    without matches the name, and an excluded directory isn't descended
+    into. A mirror entry gives a single rule copying its whole directory
+    verbatim. If deps is given, the module config and every directory
+    listed are appended to it.
+    '''
     module_conf_path = module_path / MODULE_CONF_FILENAME
     with open(module_conf_path, 'r') as stream:
-        module_config = yaml.safe_load(stream)
+        module_config = yaml_utils.safe_load(stream)
+    if deps is not None:
+        deps.append(module_conf_path)
     rules = []
     for src_str, conf_dict in module_config.items():
         src_path = (module_path/src_str).expanduser()
         out_path = Path(conf_dict['out']).expanduser()
         if conf_dict.get('dir_contents', False):
-            for sub_path in src_path.iterdir():
-                sub_name = sub_path.name
-                rules.append(
-                    _rule_from_yaml(sub_path, out_path/sub_name, conf_dict))
+            rules.extend(
+                _rule_from_yaml(src_path/rel_path, out_path/rel_path,
+                                conf_dict)
+                for rel_path in _walk(
+                    str(src_path), '', conf_dict.get('recursive', False),
+                    conf_dict.get('include', ()),
+                    conf_dict.get('exclude', ()), deps))
         else:
             rules.append(_rule_from_yaml(src_path, out_path, conf_dict))
     return rules
 
 
+# pylint: disable-next=too-many-arguments
+def _walk(dir_path: str, rel_dir: str, recursive: bool,
+          include: Sequence[str], exclude: Sequence[str],
+          deps: Optional[List[Path]]) -> Iterator[str]:
+    '''Yield the paths below dir_path, relative to the walk's root.'''
+    if deps is not None:
+        deps.append(Path(dir_path))
+    with os.scandir(dir_path) as entries:
+        subdirs = []
+        for entry in entries:
+            rel_path = f'{rel_dir}{entry.name}'
+            if _matches_any(rel_path, entry.name, exclude):
+                continue
+            if recursive and entry.is_dir(follow_symlinks=False):
+                subdirs.append((entry.path, rel_path))
+            elif not include or _matches_any(rel_path, entry.name, include):
+                yield rel_path
+    for sub_path, rel_path in subdirs:
+        yield from _walk(sub_path, f'{rel_path}/', recursive, include,
+                         exclude, deps)
+
+
+def _matches_any(rel_path: str, name: str, patterns: Sequence[str]) -> bool:
+    '''Return true if a path matches any of a dir_contents entry's globs.'''
+    return any(fnmatchcase(rel_path if '/' in pattern else name, pattern)
+               for pattern in patterns)
+
+
 def _rule_from_yaml(src: Path, out: Path, conf_dict: dict) -> Rule:
     return Rule(src, out,
                 executable=conf_dict.get('exec', False),
                 final=conf_dict.get('final', False),
-                force_rewrite=conf_dict.get('force_rewrite', False))
+                force_rewrite=conf_dict.get('force_rewrite', False),
+                mirror=conf_dict.get('mirror', False),
+                raw=conf_dict.get('raw', False))
 
 
 class DuplicateDomainError(Exception):
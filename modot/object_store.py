@@ -0,0 +1,102 @@
+'''Content-addressed store of rendered outputs, deployed by linking.'''
+import hashlib
+import os
+from pathlib import Path
+from typing import Iterable
+
+from modot.fileio import AtomicWriter, atomic_link, hash_file
+
+
+STORE_DIRNAME = 'store'
+
+
+class ObjectStore():
+    '''Keeps each distinct rendered output once, keyed by content and mode.
+
+    Objects are read-only and carry the mode their outputs are deployed
+    with, so the same content deployed executable and not is stored twice.
+    Outputs are placed as hardlinks to their object where possible, then as
+    reflinks, and as plain copies otherwise.
+    '''
+    def __init__(self, path: Path):
+        '''Use the store rooted at path, creating it as needed.'''
+        self.path = path
+
+    @staticmethod
+    def key(data: bytes, mode: int) -> str:
+        '''Return the key data deployed with mode is stored under.'''
+        return f'{hashlib.sha256(data).hexdigest()}.{mode:o}'
+
+    def object_path(self, key: str) -> Path:
+        '''Return where the object with key is stored.'''
+        return self.path / 'objects' / key[:2] / key[2:]
+
+    def put(self, data: bytes, mode: int) -> str:
+        '''Store data unless an identical object exists, returning its key.'''
+        key = self.key(data, mode)
+        object_path = self.object_path(key)
+        if not object_path.exists():
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            with AtomicWriter(object_path, mode) as writer:
+                writer.write(data)
+                writer.commit()
+        return key
+
+    def place(self, key: str, out_path: Path, force: bool = False,
+              link: bool = True) -> bool:
+        '''Atomically make out_path the object with key.
+
+        Unless force is set, returns false without replacing out_path if it
+        already has the object's content: either it is a link to the object
+        or (when it had to be copied) its hash matches the key. The mode of
+        a matching copy is still corrected. Without link, out_path is always
+        a copy.
+        '''
+        object_path = self.object_path(key)
+        digest, mode_str = key.rsplit('.', 1)
+        mode = int(mode_str, 8)
+        if not force and self._matches(object_path, out_path, digest, mode):
+            return False
+        if link and atomic_link(object_path, out_path):
+            return True
+        with AtomicWriter(out_path, mode) as writer:
+            writer.clone_from(object_path)
+            writer.commit()
+        return True
+
+    @staticmethod
+    def _matches(object_path: Path, out_path: Path, digest: str,
+                 mode: int) -> bool:
+        '''Return true if out_path already has the object's content.'''
+        try:
+            out_stat = os.stat(out_path)
+            object_stat = os.stat(object_path)
+        except FileNotFoundError:
+            return False
+        if os.path.samestat(out_stat, object_stat):
+            return True
+        if out_stat.st_size != object_stat.st_size:
+            return False
+        if hash_file(out_path, hashlib.sha256) != bytes.fromhex(digest):
+            return False
+        if out_stat.st_mode & 0o7777 != mode:
+            out_path.chmod(mode)
+        return True
+
+    def prune(self, keep: Iterable[str]) -> int:
+        '''Remove objects not in keep that no output links to.
+
+        Returns how many objects were removed.
+        '''
+        keep_paths = {self.object_path(key) for key in keep}
+        removed = 0
+        objects_path = self.path / 'objects'
+        if not objects_path.is_dir():
+            return 0
+        for prefix_path in objects_path.iterdir():
+            for object_path in prefix_path.iterdir():
+                if (object_path not in keep_paths
+                        and object_path.stat().st_nlink == 1):
+                    object_path.unlink()
+                    removed += 1
+        return removed
@@ -0,0 +1,111 @@
+'''Remember every output deployed so stale ones can be cleaned up.
+
+The state file lists each output any deploy has produced since the last
+clean, with the identity (inode, size and mtime) it had once deployed.
+Outputs listed there that no cat produces any more are stale: clean()
+removes them directly from the list, without scanning for them, unless they
+were changed or replaced since.
+'''
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from modot.cat import Cat
+from modot.fileio import atomic_write
+
+
+OUTPUTS_FILENAME = 'outputs.json'
+OUTPUTS_VERSION = 2
+
+# An output's inode, size and mtime, or None if it doesn't exist
+Identity = Optional[List[int]]
+
+
+def load(state_path: Path) -> Dict[str, Identity]:
+    '''Return the recorded outputs and their identities.
+
+    Returns none if the state can't be read.
+    '''
+    try:
+        with open(state_path, 'r') as stream:
+            state = json.load(stream)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(state, dict) or state.get('version') != OUTPUTS_VERSION:
+        return {}
+    return state['outputs']
+
+
+def record(state_path: Path, cats: Iterable[Cat],
+           failures: Iterable[str] = ()):
+    '''Add the outputs of cats, as they are now, to the recorded outputs.
+
+    Call this once the cats have been deployed. Outputs in failures didn't
+    deploy, so modot may not have written what is there: they are left as
+    they were recorded, if at all.
+    '''
+    recorded = load(state_path)
+    identities = {out_str: _identity(out_str)
+                  for out_str in _outs(cats) - set(failures)}
+    if not identities.items() <= recorded.items():
+        _save(state_path, {**recorded, **identities})
+
+
+def stale(state_path: Path, cats: Iterable[Cat]) -> List[str]:
+    '''Return the recorded outputs that no cat produces, in order.'''
+    return sorted(load(state_path).keys() - _outs(cats))
+
+
+def clean(state_path: Path,
+          cats: Iterable[Cat]) -> Tuple[List[str], List[str]]:
+    '''Remove stale outputs, returning those removed and those changed.
+
+    Only files and symlinks are removed, and only if they are still as
+    deployed. One changed or replaced since (e.g. by the user) is left and
+    forgotten. A stale directory (left by a mirror) is kept, and stays
+    recorded, for the user to deal with.
+    '''
+    recorded = load(state_path)
+    outs = _outs(cats)
+    removed = []
+    changed = []
+    kept = {out_str: recorded.get(out_str) for out_str in outs}
+    for out_str in sorted(recorded.keys() - outs):
+        if os.path.isdir(out_str) and not os.path.islink(out_str):
+            kept[out_str] = recorded[out_str]
+            continue
+        identity = _identity(out_str)
+        if identity is None:
+            continue
+        if identity != recorded[out_str]:
+            changed.append(out_str)
+            continue
+        try:
+            os.unlink(out_str)
+        except FileNotFoundError:
+            continue
+        removed.append(out_str)
+    _save(state_path, kept)
+    return removed, changed
+
+
+def _outs(cats: Iterable[Cat]) -> Set[str]:
+    '''Return the outputs of cats.'''
+    return {cat.rules[0].out_str for cat in cats}
+
+
+def _identity(out_str: str) -> Identity:
+    '''Return the identity of an output, not following a symlink.'''
+    try:
+        out_stat = os.lstat(out_str)
+    except FileNotFoundError:
+        return None
+    return [out_stat.st_ino, out_stat.st_size, out_stat.st_mtime_ns]
+
+
+def _save(state_path: Path, outs: Dict[str, Identity]):
+    '''Atomically write the recorded outputs.'''
+    atomic_write(state_path, json.dumps(
+        {'version': OUTPUTS_VERSION, 'outputs': outs}, sort_keys=True,
+        separators=(',', ':')), 0o644)
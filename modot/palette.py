@@ -0,0 +1,268 @@
+'''Derive a color scheme's shades, tints and formats from its base colors.
+
+A color file can list its colors under a `palette_exprs` mapping, each
+either a color literal (`#rgb`, `#rgba`, `#rrggbb`, `#rrggbbaa`,
+`0xaarrggbb`) or an expression deriving it from other palette colors:
+
+    palette_exprs:
+      bg: '#282828'
+      fg: '#ebdbb2'
+      bg_soft: lighten(bg, 10%)
+      bg_dim: darken(bg, 5%)
+      selection: mix(bg, fg, 25%)
+      overlay: alpha(bg, 80%)
+      red: rgb(204, 36, 29)
+
+Expressions nest, and may refer to derived colors in any order. Every
+color is expanded once, when the context is built, into a mapping of its
+formats under `palette`, so templates can use e.g.
+`{{palette.overlay.rgba}}`. Contexts without `palette_exprs` are left
+untouched.
+'''
+import colorsys
+import re
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+
+PALETTE_KEY = 'palette'
+PALETTE_EXPRS_KEY = 'palette_exprs'
+
+# Red, green, blue and alpha, each from 0 to 1
+Color = Tuple[float, float, float, float]
+
+_TOKEN_RE = re.compile(r'\s*(?:(#[0-9a-fA-F]+|0x[0-9a-fA-F]{8})'
+                       r'|([A-Za-z_][\w.-]*)|(\d+(?:\.\d+)?%?)|([(),]))')
+_SHORT_HEX_RE = re.compile(r'#([0-9a-fA-F]{3,4})')
+_HEX_RE = re.compile(r'#([0-9a-fA-F]{6}|[0-9a-fA-F]{8})')
+_ARGB_RE = re.compile(r'0x([0-9a-fA-F]{2})([0-9a-fA-F]{6})')
+
+
+def expand(context: dict) -> dict:
+    '''Replace palette_exprs in context by every color's formats, in place.
+
+    The formats are set under palette. Returns context. Raises PaletteError
+    if any color can't be resolved, or if palette is also set.
+    '''
+    palette = context.get(PALETTE_EXPRS_KEY)
+    if palette is None:
+        return context
+    if not isinstance(palette, dict):
+        raise PaletteError(f'{PALETTE_EXPRS_KEY} is not a mapping')
+    if PALETTE_KEY in context:
+        raise PaletteError(
+            f'{PALETTE_KEY} is set alongside {PALETTE_EXPRS_KEY}')
+    colors = resolve(palette)
+    del context[PALETTE_EXPRS_KEY]
+    context[PALETTE_KEY] = {
+        name: formats(color) for name, color in colors.items()}
+    return context
+
+
+def resolve(palette: Dict[str, str]) -> Dict[str, Color]:
+    '''Resolve every palette entry to a color in a single pass.
+
+    Each entry is parsed and evaluated at most once, however many others
+    derive from it.
+    '''
+    palette = {str(name): spec for name, spec in palette.items()}
+    resolved: Dict[str, Color] = {}
+    resolving: List[str] = []
+
+    def lookup(name: str) -> Color:
+        if name in resolved:
+            return resolved[name]
+        if name not in palette:
+            raise PaletteError(f'unknown color: {name}')
+        if name in resolving:
+            raise PaletteError(
+                f'circular color definition: {" -> ".join(resolving)}'
+                f' -> {name}')
+        spec = palette[name]
+        if not isinstance(spec, str):
+            raise PaletteError(f'color {name} is not a string: {spec!r}')
+        resolving.append(name)
+        try:
+            resolved[name] = _evaluate(_parse(spec), lookup)
+        except PaletteError as error:
+            if resolving[0] == name:
+                raise PaletteError(f'{name}: {error}') from None
+            raise
+        finally:
+            resolving.pop()
+        return resolved[name]
+    for name in palette:
+        lookup(name)
+    return resolved
+
+
+def formats(color: Color) -> Dict[str, str]:
+    '''Return color in each format templates can use.'''
+    red, green, blue, opaque = (round(channel * 255) for channel in color)
+    rgb = f'{red:02x}{green:02x}{blue:02x}'
+    opacity = format(round(color[3], 3), 'g')
+    return {
+        'hex': f'#{rgb}',
+        'hexa': f'#{rgb}{opaque:02x}',
+        'rgb': f'rgb({red}, {green}, {blue})',
+        'rgba': f'rgba({red}, {green}, {blue}, {opacity})',
+        'argb': f'0x{opaque:02x}{rgb}',
+    }
+
+
+def parse_color(literal: str) -> Color:
+    '''Parse a #rgb, #rgba, #rrggbb, #rrggbbaa or 0xaarrggbb color.'''
+    short = _SHORT_HEX_RE.fullmatch(literal)
+    full = _HEX_RE.fullmatch(literal)
+    argb = _ARGB_RE.fullmatch(literal)
+    if short:
+        digits = ''.join(digit * 2 for digit in short.group(1))
+    elif full:
+        digits = full.group(1)
+    elif argb:
+        digits = argb.group(2) + argb.group(1)
+    else:
+        raise PaletteError(f'malformed color: {literal}')
+    channels = [int(digits[idx:idx + 2], 16) / 255
+                for idx in range(0, len(digits), 2)]
+    if len(channels) == 3:
+        channels.append(1.0)
+    return (channels[0], channels[1], channels[2], channels[3])
+
+
+def lighten(color: Color, amount: float) -> Color:
+    '''Raise the lightness of color by amount, keeping its hue.'''
+    return _adjust_lightness(color, amount)
+
+
+def darken(color: Color, amount: float) -> Color:
+    '''Lower the lightness of color by amount, keeping its hue.'''
+    return _adjust_lightness(color, -amount)
+
+
+def mix(color: Color, other: Color, amount: float = 0.5) -> Color:
+    '''Blend amount of other into color, alpha included.'''
+    return (color[0] + (other[0] - color[0]) * amount,
+            color[1] + (other[1] - color[1]) * amount,
+            color[2] + (other[2] - color[2]) * amount,
+            color[3] + (other[3] - color[3]) * amount)
+
+
+def alpha(color: Color, amount: float) -> Color:
+    '''Return color with its alpha set to amount.'''
+    return (color[0], color[1], color[2], amount)
+
+
+def _adjust_lightness(color: Color, delta: float) -> Color:
+    '''Shift the HSL lightness of color by delta, clamped.'''
+    hue, lightness, saturation = colorsys.rgb_to_hls(*color[:3])
+    lightness = min(1.0, max(0.0, lightness + delta))
+    red, green, blue = colorsys.hls_to_rgb(hue, lightness, saturation)
+    return (red, green, blue, color[3])
+
+
+# Each function's argument kinds: a color, or an amount with its range
+_FUNCTIONS = {
+    'lighten': (lighten, ('color', 1)),
+    'darken': (darken, ('color', 1)),
+    'mix': (mix, ('color', 'color', 1)),
+    'alpha': (alpha, ('color', 1)),
+    'rgb': (lambda *rgb: (*(value / 255 for value in rgb), 1.0),
+            (255, 255, 255)),
+    'rgba': (lambda *rgba: (*(value / 255 for value in rgba[:3]), rgba[3]),
+             (255, 255, 255, 1)),
+}
+
+
+class _Call(NamedTuple):
+    '''A parsed function call.'''
+    name: str
+    args: list
+
+
+# A parsed expression: a color literal, an amount, a palette name, or a
+# function call
+Expression = Union[Color, float, str, _Call]
+
+
+def _parse(spec: str) -> Expression:
+    '''Parse a palette entry into an expression.'''
+    tokens = _tokenize(spec)
+    expression, idx = _parse_expression(tokens, 0)
+    if idx != len(tokens):
+        raise PaletteError(f'unexpected {tokens[idx][1]!r} in {spec!r}')
+    return expression
+
+
+def _tokenize(spec: str) -> List[Tuple[str, str]]:
+    '''Split spec into (kind, text) tokens.'''
+    tokens = []
+    pos = 0
+    spec = spec.rstrip()
+    while pos < len(spec):
+        match = _TOKEN_RE.match(spec, pos)
+        if not match:
+            raise PaletteError(f'cannot parse {spec!r} at {spec[pos:]!r}')
+        kind = ('color', 'name', 'number', 'punct')[match.lastindex - 1]
+        tokens.append((kind, match.group(match.lastindex)))
+        pos = match.end()
+    return tokens
+
+
+def _parse_expression(tokens: List[Tuple[str, str]],
+                      idx: int) -> Tuple[Expression, int]:
+    '''Parse the expression starting at tokens[idx], and where it ends.'''
+    if idx >= len(tokens):
+        raise PaletteError('unexpected end of expression')
+    kind, text = tokens[idx]
+    if kind == 'color':
+        return parse_color(text), idx + 1
+    if kind == 'number':
+        return (float(text[:-1]) / 100 if text.endswith('%')
+                else float(text)), idx + 1
+    if kind != 'name':
+        raise PaletteError(f'unexpected {text!r}')
+    if idx + 1 >= len(tokens) or tokens[idx + 1][1] != '(':
+        return text, idx + 1
+    args: list = []
+    idx += 2
+    while idx < len(tokens) and tokens[idx][1] != ')':
+        arg, idx = _parse_expression(tokens, idx)
+        args.append(arg)
+        if idx < len(tokens) and tokens[idx][1] == ',':
+            idx += 1
+        elif idx >= len(tokens) or tokens[idx][1] != ')':
+            raise PaletteError(f'expected , or ) in call to {text}')
+    if idx >= len(tokens):
+        raise PaletteError(f'unclosed call to {text}')
+    return _Call(text, args), idx + 1
+
+
+def _evaluate(expression: Expression, lookup) -> Color:
+    '''Evaluate a color expression, resolving names with lookup.'''
+    if isinstance(expression, str):
+        return lookup(expression)
+    if isinstance(expression, float):
+        raise PaletteError(f'expected a color, got {expression:g}')
+    if not isinstance(expression, _Call):
+        return expression
+    name, args = expression
+    if name not in _FUNCTIONS:
+        raise PaletteError(f'unknown function: {name}')
+    function, kinds = _FUNCTIONS[name]
+    optional = 1 if name == 'mix' else 0
+    if not len(kinds) - optional <= len(args) <= len(kinds):
+        raise PaletteError(f'{name} takes {len(kinds)} arguments')
+    values = []
+    for arg, kind in zip(args, kinds):
+        if kind == 'color':
+            values.append(_evaluate(arg, lookup))
+        elif not isinstance(arg, float) or not 0 <= arg <= kind:
+            raise PaletteError(
+                f'{name} expects an amount from 0 to {kind}, got {arg!r}')
+        else:
+            values.append(arg)
+    return function(*values)
+
+
+class PaletteError(Exception):
+    '''Raised when a palette color can't be parsed or resolved.'''
@@ -0,0 +1,133 @@
+'''Run items through stages of threads joined by bounded queues.
+
+Each stage runs on its own threads, so an item can be written while the
+next is rendered and a third read: time spent waiting on the disk is
+overlapped with work on other items. The queues between stages hold at
+most a fixed number of items, so a fast stage blocks rather than running
+ahead and buffering the whole input in memory.
+'''
+from collections import Counter
+from concurrent.futures import Future
+import io
+import locale
+from pathlib import Path
+import threading
+from queue import Queue
+from typing import (Any, Callable, Dict, Iterable, List, NamedTuple, Optional,
+                    Sequence, Tuple)
+
+from modot.cat import BINARY_SNIFF_BYTES
+
+
+# Items waiting between two stages
+QUEUE_DEPTH = 16
+
+_STOP = object()
+
+
+class Finished(NamedTuple):
+    '''Returned by a stage to skip the remaining stages for an item.'''
+    outcome: Any
+
+
+def run(items: Sequence, stages: Sequence[Tuple[Callable, int]],
+        depth: int = QUEUE_DEPTH) -> list:
+    '''Pass every item through stages, returning their outcomes in order.
+
+    Each stage is a function and the number of threads running it. An
+    item's outcome is what the last stage returned for it, what a stage
+    returned wrapped in Finished, or the exception a stage raised.
+    '''
+    outcomes: list = [None] * len(items)
+    queues: List[Queue] = [Queue(maxsize=depth) for _ in stages]
+    running = [workers for _, workers in stages]
+    lock = threading.Lock()
+
+    def work(stage: int):
+        function = stages[stage][0]
+        last = stage == len(stages) - 1
+        while True:
+            entry = queues[stage].get()
+            if entry is _STOP:
+                break
+            idx, value = entry
+            try:
+                value = function(value)
+            except Exception as error:  # pylint: disable=broad-except
+                outcomes[idx] = error
+                continue
+            if isinstance(value, Finished):
+                outcomes[idx] = value.outcome
+            elif last:
+                outcomes[idx] = value
+            else:
+                queues[stage + 1].put((idx, value))
+        with lock:
+            running[stage] -= 1
+            done = not running[stage]
+        if done and not last:
+            for _ in range(stages[stage + 1][1]):
+                queues[stage + 1].put(_STOP)
+
+    threads = [threading.Thread(target=work, args=(stage,), daemon=True)
+               for stage, (_, workers) in enumerate(stages)
+               for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for entry in enumerate(items):
+        queues[0].put(entry)
+    for _ in range(stages[0][1]):
+        queues[0].put(_STOP)
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+class SourceReader():
+    '''Reads each source once, however many outputs it feeds.
+
+    A source's text is kept only until every expected use has taken it (or
+    been skipped), so memory is held for sources still to be rendered, not
+    for every source read. Binary sources read as None.
+    '''
+    def __init__(self, src_strs: Iterable[str]):
+        '''Expect one use of each source per time it is listed.'''
+        self._uses = Counter(src_strs)
+        self._texts: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def read(self, src_str: str) -> Optional[str]:
+        '''Return the text of a source, reading it if no one else has.'''
+        with self._lock:
+            future = self._texts.get(src_str)
+            owner = future is None
+            if owner:
+                future = self._texts[src_str] = Future()
+        if owner:
+            try:
+                future.set_result(_read_text(src_str))
+            except Exception as error:  # pylint: disable=broad-except
+                future.set_exception(error)
+        try:
+            return future.result()
+        finally:
+            self.skip(src_str)
+
+    def skip(self, src_str: str):
+        '''Give up one expected use of a source without reading it.'''
+        with self._lock:
+            self._uses[src_str] -= 1
+            if self._uses[src_str] <= 0:
+                self._texts.pop(src_str, None)
+
+
+def _read_text(src_str: str) -> Optional[str]:
+    '''Read a source as Path.read_text would, or None if it is binary.
+
+    The source is opened and read once, both to sniff it and for its text.
+    '''
+    data = Path(src_str).read_bytes()
+    if b'\0' in data[:BINARY_SNIFF_BYTES]:
+        return None
+    return io.TextIOWrapper(
+        io.BytesIO(data), encoding=locale.getpreferredencoding(False)).read()
@@ -0,0 +1,239 @@
+'''Work out what a deploy would change without writing any outputs.
+
+make_plan() renders, in parallel, every cat the manifest can't show is
+current, keeps each changed render in the object store and compares it
+against the deployed output. Once saved, the plan lets deploy --from-plan
+place those renders instead of rendering again, for every cat whose sources
+and context are still the ones the plan was made from.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import difflib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Union
+
+from modot import deployer
+from modot import outputs
+from modot.cat import Cat, mirror_tree
+from modot.fileio import atomic_write
+from modot.manifest import Manifest, context_digests
+from modot.object_store import ObjectStore
+from modot.rule import EXECUTABLE, FORCE_REWRITE, MIRROR
+from modot.stat_cache import StatCache
+from modot.templater import Templater
+
+
+PLAN_FILENAME = 'plan.json'
+PLAN_VERSION = 1
+
+CREATED = 'created'
+MODIFIED = 'modified'
+UNCHANGED = 'unchanged'
+ORPHANED = 'orphaned'
+STATUSES = (CREATED, MODIFIED, UNCHANGED, ORPHANED)
+
+
+@dataclass
+class PlanEntry():
+    '''What deploying one output would do.
+
+    Created and modified outputs of rendered cats carry the store key of
+    their render and the fingerprint of the sources it was rendered from.
+    The diff is only shown, never saved.
+    '''
+    status: str
+    sources: List[list] = field(default_factory=list)
+    key: Optional[str] = None
+    diff: Optional[str] = None
+
+
+@dataclass
+class Plan():
+    '''The planned change to every output, keyed by output path.'''
+    context: Dict[str, str]
+    entries: Dict[str, PlanEntry]
+
+    def counts(self) -> Dict[str, int]:
+        '''Return how many outputs have each status.'''
+        counts = dict.fromkeys(STATUSES, 0)
+        for entry in self.entries.values():
+            counts[entry.status] += 1
+        return counts
+
+    def keys(self) -> Set[str]:
+        '''Return the keys of every render the plan refers to.'''
+        return {entry.key for entry in self.entries.values() if entry.key}
+
+    def save(self, plan_path: Path):
+        '''Atomically write the plan, without diffs.'''
+        atomic_write(plan_path, json.dumps({
+            'version': PLAN_VERSION,
+            'context': self.context,
+            'entries': {
+                out: [entry.status, entry.sources, entry.key]
+                for out, entry in self.entries.items()},
+        }, separators=(',', ':')), 0o644)
+
+    @classmethod
+    def load(cls, plan_path: Path) -> Optional['Plan']:
+        '''Load a saved plan, or None if missing or unusable.'''
+        try:
+            with open(plan_path, 'r') as stream:
+                plan = json.load(stream)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION:
+            return None
+        return cls(plan['context'], {
+            out: PlanEntry(status, sources, key)
+            for out, (status, sources, key) in plan['entries'].items()})
+
+
+class PlannedCat(Cat):
+    '''A cat deployed by placing the render a plan already stored.'''
+    __slots__ = ('key', 'plan_store')
+
+    def __init__(self, cat: Cat, key: str, plan_store: ObjectStore):
+        '''Wrap cat to deploy the object with key from plan_store.'''
+        super().__init__(cat.templater)
+        self.rules = cat.rules
+        self.key = key
+        self.plan_store = plan_store
+
+    def deploy(self, stats: Optional[StatCache] = None,
+               store: Optional[ObjectStore] = None) -> bool:
+        '''Place the planned render, linked to it only if given a store.'''
+        return self.plan_store.place(
+            self.key, self.rules[0].out, bool(self.flags & FORCE_REWRITE),
+            link=store is not None)
+
+
+# pylint: disable-next=too-many-arguments
+def make_plan(cats: List[Cat], templater: Templater, manifest_path: Path,
+              outputs_path: Path, store: ObjectStore,
+              jobs: int = deployer.DEFAULT_JOBS,
+              stats: Optional[StatCache] = None, diff: bool = False) -> Plan:
+    '''Plan the deploy of checked cats without writing any outputs.
+
+    Outputs recorded by earlier deploys (in the state file at outputs_path,
+    which clean works from too) that no cat produces any more, and that
+    still exist, are reported as orphaned. Raises DeployError listing every
+    cat that failed to render.
+    '''
+    manifest = Manifest.load(manifest_path)
+    context = context_digests(templater.context())
+    stats = stats or StatCache()
+
+    def plan_one(cat: Cat) -> Union[PlanEntry, Exception]:
+        try:
+            return _plan_one(cat, manifest, context, store, stats, diff)
+        except Exception as error:  # pylint: disable=broad-except
+            return error
+    if jobs > 1 and len(cats) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(plan_one, cats))
+    else:
+        results = [plan_one(cat) for cat in cats]
+    failures = [(cat.rules[0].out_str, result)
+                for cat, result in zip(cats, results)
+                if isinstance(result, Exception)]
+    if failures:
+        raise deployer.DeployError(failures)
+    entries = {cat.rules[0].out_str: result
+               for cat, result in zip(cats, results)}
+    entries.update(_orphans(outputs_path, cats))
+    return Plan(context, entries)
+
+
+def planned_cats(plan: Plan, cats: List[Cat], templater: Templater,
+                 store: ObjectStore,
+                 stats: Optional[StatCache] = None) -> List[Cat]:
+    '''Swap in a PlannedCat for every cat the plan still holds a render of.
+
+    A render is only used if the context and the sources' stats are those
+    it was planned with and its object is still in the store; the other
+    cats are returned as they were, to be rendered as usual.
+    '''
+    if context_digests(templater.context()) != plan.context:
+        return cats
+    stats = stats or StatCache()
+    swapped: List[Cat] = []
+    for cat in cats:
+        entry = plan.entries.get(cat.rules[0].out_str)
+        if (entry and entry.key and _sources_match(cat, entry.sources, stats)
+                and store.object_path(entry.key).exists()):
+            cat = PlannedCat(cat, entry.key, store)
+        swapped.append(cat)
+    return swapped
+
+
+def _orphans(outputs_path: Path, cats: List[Cat]) -> Dict[str, PlanEntry]:
+    '''Return an entry for each recorded output no cat produces that exists.'''
+    return {out_str: PlanEntry(ORPHANED)
+            for out_str in outputs.stale(outputs_path, cats)
+            if os.path.lexists(out_str)}
+
+
+# pylint: disable-next=too-many-arguments
+def _plan_one(cat: Cat, manifest: Manifest, context: Dict[str, str],
+              store: ObjectStore, stats: StatCache, diff: bool) -> PlanEntry:
+    '''Plan the deploy of a single cat.'''
+    out_path = cat.rules[0].out
+    exists = os.path.lexists(out_path)
+    if cat.flags & MIRROR:
+        if not mirror_tree(cat.rules[0].src, out_path,
+                           bool(cat.flags & EXECUTABLE), dryrun=True):
+            return PlanEntry(UNCHANGED)
+        return PlanEntry(MODIFIED if exists else CREATED)
+    sources = manifest.fingerprint(cat, stats)
+    if manifest.is_current(cat, sources, context, stats):
+        return PlanEntry(UNCHANGED, sources)
+    rendered = cat.render_bytes()
+    deployed = _read_bytes(out_path) if exists else None
+    if deployed == rendered:
+        return PlanEntry(UNCHANGED, sources)
+    entry = PlanEntry(MODIFIED if exists else CREATED, sources,
+                      store.put(rendered, cat.mode()))
+    if diff:
+        entry.diff = _unified_diff(str(out_path), deployed, rendered)
+    return entry
+
+
+def _sources_match(cat: Cat, sources: List[list], stats: StatCache) -> bool:
+    '''Return true if cat's sources still have their planned stats.'''
+    if [rule.src_str for rule in cat.rules] != [src[0] for src in sources]:
+        return False
+    for src in sources:
+        src_stat = stats.stat(Path(src[0]))
+        if (src_stat is None or src_stat.st_mtime_ns != src[1]
+                or src_stat.st_size != src[2]):
+            return False
+    return True
+
+
+def _read_bytes(out_path: Path) -> Optional[bytes]:
+    '''Return the contents of a deployed output, if it can be read.'''
+    try:
+        return out_path.read_bytes()
+    except OSError:
+        return None
+
+
+def _unified_diff(out_str: str, deployed: Optional[bytes],
+                  rendered: bytes) -> str:
+    '''Return a unified diff from the deployed to the planned output.'''
+    try:
+        old_lines = (deployed or b'').decode().splitlines(keepends=True)
+        new_lines = rendered.decode().splitlines(keepends=True)
+    except UnicodeDecodeError:
+        return f'Binary files differ: {out_str}\n'
+    if b'\0' in (deployed or b'') or b'\0' in rendered:
+        return f'Binary files differ: {out_str}\n'
+    lines = difflib.unified_diff(
+        old_lines, new_lines,
+        fromfile=out_str if deployed is not None else '/dev/null',
+        tofile=out_str)
+    return ''.join(line if line.endswith('\n') else f'{line}\n'
+                   for line in lines)
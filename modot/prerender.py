@@ -0,0 +1,218 @@
+'''Render every theme/color combination ahead of time for instant switching.
+
+prerender() renders each cat under every theme x color pair into the
+object store, where identical renders are kept once, and indexes the keys
+by combination, with the context digests each combination was rendered
+with. deploy_prerendered() then switches theme or color by linking each
+output to its prebuilt object, as long as nothing the index was built from
+(host context overrides included) has changed since.
+'''
+import json
+import locale
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from modot.cat import Cat, is_raw, join_parts
+from modot.deployer import deploy_cats
+from modot.fileio import atomic_write, fsync_dirs
+from modot.manifest import Manifest, context_digests
+from modot.object_store import ObjectStore
+from modot.rule import FORCE_REWRITE, MIRROR
+from modot.stat_cache import StatCache
+from modot.templater import StaticTemplater, Templater, load_context
+
+
+PRERENDER_FILENAME = 'prerender.json'
+PRERENDER_VERSION = 2
+
+
+def prerender(cats: List[Cat], templater: Templater, store: ObjectStore,
+              index_path: Path) -> int:
+    '''Render cats under every theme and color, returning the render count.
+
+    Each source is read once. Objects no longer referenced by the new index
+    are pruned from the store, and the template cache is pruned. Mirrored
+    trees and raw or binary outputs don't depend on the theme or color and
+    are left out.
+    '''
+    cats = _rendered_cats(cats)
+    host_cfg = templater.host_cfg
+    src_texts = _read_sources(cats)
+    renders: Dict[str, Dict[str, str]] = {}
+    contexts: Dict[str, Dict[str, str]] = {}
+    for theme in templater.list_themes():
+        for color in templater.list_colors():
+            context = load_context(_theme_path(templater, theme),
+                                   _color_path(templater, color), host_cfg)
+            contexts[_combo(theme, color)] = context_digests(context)
+            renders[_combo(theme, color)] = _render_combo(
+                cats, templater, context, src_texts, store)
+    deps = [*src_texts, host_cfg.themes_path, host_cfg.colors_path,
+            *host_cfg.themes_path.iterdir(), *host_cfg.colors_path.iterdir(),
+            *([host_cfg.context_base] if host_cfg.context_base else [])]
+    index = {
+        'version': PRERENDER_VERSION,
+        'deps': _signatures(deps, StatCache()),
+        'cats': _cat_sources(cats),
+        'contexts': contexts,
+        'renders': renders,
+    }
+    atomic_write(index_path, json.dumps(index, separators=(',', ':')), 0o644)
+    store.prune(key for outs in renders.values() for key in outs.values())
+    templater.template_cache.prune()
+    return sum(len(outs) for outs in renders.values())
+
+
+# pylint: disable-next=too-many-arguments
+def deploy_prerendered(cats: List[Cat], templater: Templater,
+                       store: ObjectStore, index_path: Path,
+                       manifest_path: Path,
+                       stats: Optional[StatCache] = None) -> bool:
+    '''Link every output to its prebuilt object for the active theme/color.
+
+    Returns false without deploying anything if there is no usable index:
+    none was built, a source, theme or color changed since, the active
+    context differs from the one the renders were made with (e.g. the host
+    overrides changed), or the modules now produce different cats. Cats
+    left out of the index (mirrors and raw copies) are deployed normally.
+    The manifest is updated as if every cat had been deployed normally.
+    '''
+    stats = stats or StatCache()
+    index = _load_index(index_path)
+    if not index:
+        return False
+    # Only cats left out of the index need checking for raw sources
+    cats, others = _split(cats, index['cats'])
+    if (index['cats'] != _cat_sources(cats) or _rendered_cats(others)
+            or _signatures(index['deps'], stats) != index['deps']):
+        return False
+    context = context_digests(templater.context())
+    keys = _combo_keys(index, templater, context)
+    if keys is None:
+        return False
+    manifest = Manifest.load(manifest_path)
+    written = []
+    for cat in cats:
+        out_path = cat.out
+        force_rewrite = bool(cat.flags & FORCE_REWRITE)
+        if store.place(keys[str(out_path)], out_path, force_rewrite):
+            written.append(out_path.parent)
+    fsync_dirs(written)
+    for cat in cats:
+        manifest.record(cat, manifest.fingerprint(cat, stats))
+    try:
+        deploy_cats(others, manifest, context, stats=stats)
+    finally:
+        manifest.save(context)
+        templater.template_cache.prune()
+    return True
+
+
+def indexed_keys(index_path: Path) -> Set[str]:
+    '''Return the keys of every object the prerender index refers to.'''
+    index = _load_index(index_path)
+    if not index:
+        return set()
+    return {key for outs in index['renders'].values()
+            for key in outs.values()}
+
+
+def _read_sources(cats: List[Cat]) -> Dict[str, str]:
+    '''Return the text of every source of cats, reading each once.'''
+    src_texts: Dict[str, str] = {}
+    for cat in cats:
+        for rule in cat.rules:
+            if rule.src_str not in src_texts:
+                with open(rule.src_str) as stream:
+                    src_texts[rule.src_str] = stream.read()
+    return src_texts
+
+
+def _render_combo(cats: List[Cat], templater: Templater, context: dict,
+                  src_texts: Dict[str, str],
+                  store: ObjectStore) -> Dict[str, str]:
+    '''Store each cat rendered with context, returning the keys by output.
+
+    Renders share templater's template cache.
+    '''
+    encoding = locale.getpreferredencoding(False)
+    combo_templater = StaticTemplater(templater.modot_path, context)
+    combo_templater.template_cache = templater.template_cache
+    return {
+        str(cat.out): store.put(
+            join_parts(combo_templater.template(src_texts[rule.src_str])
+                       for rule in cat.rules).encode(encoding),
+            cat.mode())
+        for cat in cats}
+
+
+def _combo_keys(index: dict, templater: Templater,
+                context: Dict[str, str]) -> Optional[Dict[str, str]]:
+    '''Return the indexed keys for the active theme and color, if any.
+
+    None is returned unless they were rendered with the same context.
+    '''
+    combo = _combo(templater.get_theme() or '', templater.get_color() or '')
+    if index['contexts'].get(combo) != context:
+        return None
+    return index['renders'].get(combo)
+
+
+def _rendered_cats(cats: List[Cat]) -> List[Cat]:
+    '''Return the cats whose output depends on the theme and color.'''
+    return [cat for cat in cats if not cat.flags & MIRROR
+            and not any(is_raw(rule) for rule in cat.rules)]
+
+
+def _split(cats: List[Cat],
+           indexed: Dict[str, List[str]]) -> Tuple[List[Cat], List[Cat]]:
+    '''Split cats into those with an output in the index and the rest.'''
+    inside: List[Cat] = []
+    outside: List[Cat] = []
+    for cat in cats:
+        (inside if cat.rules[0].out_str in indexed else outside).append(cat)
+    return inside, outside
+
+
+def _combo(theme: str, color: str) -> str:
+    '''Return the index key of a theme/color combination.'''
+    return f'{theme}/{color}'
+
+
+def _theme_path(templater: Templater, theme: str) -> Path:
+    return templater.host_cfg.themes_path / f'{theme}.yaml'
+
+
+def _color_path(templater: Templater, color: str) -> Path:
+    return templater.host_cfg.colors_path / f'{color}.yaml'
+
+
+def _cat_sources(cats: List[Cat]) -> Dict[str, List[str]]:
+    '''Return the sources of each cat by output.'''
+    return {str(cat.out): [rule.src_str for rule in cat.rules]
+            for cat in cats}
+
+
+def _signatures(paths, stats: StatCache) -> Dict[str, Optional[list]]:
+    '''Return the mtime and size of each path, None if it is missing.'''
+    signatures = {}
+    for path in paths:
+        path_stat = stats.stat(Path(path))
+        signatures[str(path)] = (
+            None if path_stat is None
+            else [path_stat.st_mtime_ns, path_stat.st_size])
+    return signatures
+
+
+def _load_index(index_path: Path) -> Optional[dict]:
+    '''Load the prerender index, or None if missing or unusable.'''
+    try:
+        with open(index_path, 'r') as stream:
+            index = json.load(stream)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(index, dict):
+        return None
+    if index.get('version') != PRERENDER_VERSION:
+        return None
+    return index
@@ -0,0 +1,140 @@
+'''Optional per-phase timings and counters for diagnosing slow deploys.
+
+Instrumented code calls count() and wraps functions in timed(); both do
+nothing beyond a global lookup unless a Profile has been enabled.
+'''
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+# inspect.CO_GENERATOR, without paying to import inspect
+_CO_GENERATOR = 0x20
+# Cats listed individually in the human-readable summary
+SLOWEST_CATS_SHOWN = 10
+
+_active: Optional['Profile'] = None  # pylint: disable=invalid-name
+
+
+class Profile():
+    '''Accumulates phase timings, counters and per-cat deploy times.'''
+    def __init__(self):
+        '''Start with nothing recorded.'''
+        self.phases: Dict[str, List[float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.cats: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, phase: str, seconds: float, item=None):
+        '''Record one call of a phase, and the time of item if given.'''
+        with self._lock:
+            calls_seconds = self.phases.setdefault(phase, [0, 0.0])
+            calls_seconds[0] += 1
+            calls_seconds[1] += seconds
+            if item is not None:
+                self.cats[str(item)] = self.cats.get(str(item), 0.0) + seconds
+
+    def add_count(self, counter: str, amount: int):
+        '''Increase a counter.'''
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def to_dict(self) -> dict:
+        '''Return everything recorded, in a JSON-serializable form.'''
+        return {
+            'phases': {phase: {'calls': calls, 'seconds': seconds}
+                       for phase, (calls, seconds) in self.phases.items()},
+            'counters': dict(self.counters),
+            'cats': dict(self.cats),
+        }
+
+    def summary(self) -> str:
+        '''Return a human-readable table of everything recorded.'''
+        lines = [f'{"phase":<28}{"calls":>8}{"seconds":>12}']
+        for phase, (calls, seconds) in sorted(
+                self.phases.items(), key=lambda item: -item[1][1]):
+            lines.append(f'{phase:<28}{calls:>8}{seconds:>12.4f}')
+        lines.append('')
+        lines.append(f'{"counter":<28}{"value":>20}')
+        for counter, value in sorted(self.counters.items()):
+            lines.append(f'{counter:<28}{value:>20}')
+        if self.cats:
+            lines.append('')
+            lines.append('slowest cats:')
+            slowest = sorted(self.cats.items(), key=lambda item: -item[1])
+            for out, seconds in slowest[:SLOWEST_CATS_SHOWN]:
+                lines.append(f'{seconds:>10.4f}  {out}')
+        return '\n'.join(lines)
+
+
+def enable() -> Profile:
+    '''Start recording into a new profile and return it.'''
+    global _active  # pylint: disable=global-statement
+    _active = Profile()
+    return _active
+
+
+def disable():
+    '''Stop recording.'''
+    global _active  # pylint: disable=global-statement
+    _active = None
+
+
+def count(counter: str, amount: int = 1):
+    '''Increase a counter of the active profile, if any.'''
+    profile = _active
+    if profile is not None:
+        profile.add_count(counter, amount)
+
+
+def timed(phase: str, item: Optional[Callable] = None):
+    '''Decorate a function so calls to it are timed as phase.
+
+    If item is given it is called with the function's first argument (e.g.
+    self) and the time is also recorded against its result (e.g. a cat's
+    output). Time spent inside generators is summed across their
+    iteration.
+    '''
+    def decorator(func):
+        if func.__code__.co_flags & _CO_GENERATOR:
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                if _active is None:
+                    return (yield from func(*args, **kwargs))
+                return (yield from _timed_iter(
+                    phase, func(*args, **kwargs)))
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = _active
+            if profile is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.add_time(phase, time.perf_counter() - start,
+                                 item(args[0]) if item else None)
+        return wrapper
+    return decorator
+
+
+def _timed_iter(phase: str, generator):
+    '''Yield from generator, timing only the time spent inside it.'''
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(generator)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                elapsed += time.perf_counter() - start
+            yield value
+    finally:
+        profile = _active
+        if profile is not None:
+            profile.add_time(phase, elapsed)
@@ -0,0 +1,123 @@
+'''In-memory caches of source texts and their renders, bounded by size.
+
+A source shared by several outputs (a snippet included from many modules,
+or one file expanded by dir_contents) is read once and rendered once per
+context, however many cats include it.
+'''
+# json is imported lazily so that creating a templater stays cheap
+# pylint: disable=import-outside-toplevel
+from collections import OrderedDict
+import hashlib
+import os
+from pathlib import Path
+import threading
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+from modot import profiling
+
+
+# Bytes of source text, and of rendered output, kept at most
+SOURCE_CACHE_BYTES = 32 << 20
+RENDER_CACHE_BYTES = 32 << 20
+
+_Value = TypeVar('_Value')
+
+
+class LRUCache(Generic[_Value]):
+    '''A thread-safe mapping evicting least recently used entries.
+
+    Entries are weighed by the size given when they are put; once the
+    total exceeds max_size the oldest are dropped. An entry larger than
+    max_size on its own is never kept.
+    '''
+    def __init__(self, max_size: int):
+        '''Start empty, keeping entries up to a total of max_size.'''
+        self.max_size = max_size
+        self.size = 0
+        self._entries: 'OrderedDict[Hashable, Tuple[_Value, int]]' = (
+            OrderedDict())
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[_Value]:
+        '''Return the value for key, or None if it isn't cached.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: _Value, size: int):
+        '''Cache value for key, evicting older entries to make room.'''
+        if size > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RenderCache():
+    '''Caches source texts by file and their renders by content and context.
+
+    A source is identified by the device, inode, mtime and size of the
+    file it resolves to, so every path (or symlink) to the same file shares
+    one entry, and a changed file is read again. Renders are keyed by a
+    digest of the source text and of the whole context.
+    '''
+    def __init__(self, source_bytes: int = SOURCE_CACHE_BYTES,
+                 render_bytes: int = RENDER_CACHE_BYTES):
+        '''Start empty, bounding each cache to the given number of bytes.'''
+        self.sources: LRUCache[Tuple[str, bytes]] = LRUCache(source_bytes)
+        self.renders: LRUCache[str] = LRUCache(render_bytes)
+
+    def read(self, src_path: Path) -> Tuple[str, bytes]:
+        '''Return the text of a source and its digest.'''
+        src_stat = os.stat(src_path)
+        key = (src_stat.st_dev, src_stat.st_ino, src_stat.st_mtime_ns,
+               src_stat.st_size)
+        cached = self.sources.get(key)
+        if cached is not None:
+            return cached
+        text = Path(src_path).read_text()
+        cached = (text, text_digest(text))
+        self.sources.put(key, cached, len(text))
+        return cached
+
+    def render(self, text: str, context_key: bytes,
+               template: Callable[[str], str],
+               digest: Optional[bytes] = None) -> str:
+        '''Return template(text), rendering it only if not yet cached.
+
+        Sources without tags render as themselves so are never cached.
+        '''
+        if '{{' not in text:
+            return template(text)
+        key = (digest or text_digest(text), context_key)
+        rendered = self.renders.get(key)
+        if rendered is not None:
+            profiling.count('renders_cached')
+            return rendered
+        rendered = template(text)
+        self.renders.put(key, rendered, len(rendered))
+        return rendered
+
+
+def text_digest(text: str) -> bytes:
+    '''Return a digest identifying a source text.'''
+    return hashlib.sha256(text.encode(errors='surrogatepass')).digest()
+
+
+def context_digest(context: dict) -> bytes:
+    '''Return a digest identifying a whole template context.'''
+    import json
+    return hashlib.sha256(json.dumps(
+        context, sort_keys=True, default=str).encode()).digest()
@@ -0,0 +1,102 @@
+'''Render variable-only mustache templates without going through chevron.
+
+Most sources only substitute plain `{{var}}`, `{{{var}}}` or `{{&var}}`
+tags. Their tokens are compiled once into the literal fragments between
+tags and a slot for each tag, so rendering is a lookup per slot and a
+single join. Values are looked up and escaped exactly as chevron does for
+a top-level scope, and can be memoized per context since they don't
+depend on the template. Templates with sections, inverted sections or
+partials (and so any lambdas) are left to chevron. Templater.template
+is the one place that chooses between the two.
+'''
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Literal fragments, with an empty placeholder for each slot, and each
+# slot's fragment index and (key, html escaped) lookup
+Compiled = Tuple[Tuple[str, ...], Tuple[Tuple[int, Tuple[str, bool]], ...]]
+Tokens = List[Tuple[str, str]]
+
+# Tags that render nothing
+_SILENT_TAGS = ('comment', 'set delimiter')
+
+
+def compile_tokens(tokens: Tokens) -> Optional[Compiled]:
+    '''Compile chevron tokens, or return None if they need chevron.'''
+    fragments: List[str] = []
+    slots = []
+    last_literal = False
+    for tag, key in tokens:
+        if tag == 'literal':
+            if last_literal:
+                fragments[-1] += key
+            else:
+                fragments.append(key)
+            last_literal = True
+        elif tag in ('variable', 'no escape'):
+            slots.append((len(fragments), (key, tag == 'variable')))
+            fragments.append('')
+            last_literal = False
+        elif tag not in _SILENT_TAGS:
+            return None
+    return tuple(fragments), tuple(slots)
+
+
+def render_compiled(compiled: Compiled, context: dict,
+                    values: Optional[Dict[Tuple[str, bool], str]] = None
+                    ) -> str:
+    '''Render a compiled template with context.
+
+    values, if given, memoizes each looked up (and escaped) value; it must
+    only ever be used with the same context.
+    '''
+    fragments, slots = compiled
+    parts = list(fragments)
+    for idx, lookup in slots:
+        value = values.get(lookup) if values is not None else None
+        if value is None:
+            value = str(get_key(lookup[0], context))
+            if lookup[1]:
+                value = html_escape(value)
+            if values is not None:
+                values[lookup] = value
+        parts[idx] = value
+    return ''.join(parts)
+
+
+def get_key(key: str, context: Any) -> Any:
+    '''Look key up in context as chevron does with a single scope.
+
+    A dotted key walks into mappings, then attributes, then sequence
+    indices. Missing keys, and falsy values other than 0 and False, give
+    an empty string.
+    '''
+    if key == '.':
+        return context
+    scope = context
+    try:
+        for child in key.split('.'):
+            try:
+                scope = scope[child]
+            except (TypeError, AttributeError):
+                try:
+                    scope = getattr(scope, child)
+                except (TypeError, AttributeError):
+                    scope = scope[int(child)]
+        if scope in (0, False):
+            return scope
+        try:
+            # pylint: disable-next=protected-access
+            if scope._CHEVRON_return_scope_when_falsy:
+                return scope
+        except AttributeError:
+            return scope or ''
+    except (AttributeError, KeyError, IndexError, ValueError):
+        pass
+    return ''
+
+
+def html_escape(string: str) -> str:
+    '''Escape &, ", < and > as chevron does.'''
+    return (string.replace('&', '&amp;').replace('"', '&quot;')
+            .replace('<', '&lt;').replace('>', '&gt;'))
@@ -1,13 +1,108 @@
 '''Provides a value object to represent a concatenation rule.'''
 from pathlib import Path
-from dataclasses import dataclass
+import sys
+from typing import Union
+
+
+EXECUTABLE = 1
+FINAL = 2
+FORCE_REWRITE = 4
+MIRROR = 8
+RAW = 16
 
 
-@dataclass
 class Rule:
-    '''Represents a single concatenation rule and its flag options.'''
-    src: Path
-    out: Path
-    executable: bool = False
-    final: bool = False
-    force_rewrite: bool = False
+    '''Represents a single concatenation rule and its flag options.
+
+    Rules are immutable and kept compact, since a large dir_contents module
+    can expand to tens of thousands of them: paths are held as interned
+    strings, shared between every rule with the same source or output, and
+    the flags are packed into one int.
+    '''
+    __slots__ = ('src_str', 'out_str', 'flags')
+    src_str: str
+    out_str: str
+    flags: int
+
+    # pylint: disable-next=too-many-arguments
+    def __init__(self, src: Union[Path, str], out: Union[Path, str],
+                 executable: bool = False, final: bool = False,
+                 force_rewrite: bool = False, mirror: bool = False,
+                 raw: bool = False):
+        '''Create a rule copying src into out with the given flags.'''
+        flags = ((EXECUTABLE if executable else 0)
+                 | (FINAL if final else 0)
+                 | (FORCE_REWRITE if force_rewrite else 0)
+                 | (MIRROR if mirror else 0)
+                 | (RAW if raw else 0))
+        object.__setattr__(self, 'src_str', sys.intern(str(Path(src))))
+        object.__setattr__(self, 'out_str', sys.intern(str(Path(out))))
+        object.__setattr__(self, 'flags', flags)
+
+    @property
+    def src(self) -> Path:
+        '''The source file.'''
+        return Path(self.src_str)
+
+    @property
+    def out(self) -> Path:
+        '''The output file this rule contributes to.'''
+        return Path(self.out_str)
+
+    @property
+    def executable(self) -> bool:
+        '''Whether the output should be executable.'''
+        return bool(self.flags & EXECUTABLE)
+
+    @property
+    def final(self) -> bool:
+        '''Whether this must be the only rule for its output.'''
+        return bool(self.flags & FINAL)
+
+    @property
+    def force_rewrite(self) -> bool:
+        '''Whether the output is rewritten even if unchanged.'''
+        return bool(self.flags & FORCE_REWRITE)
+
+    @property
+    def mirror(self) -> bool:
+        '''Whether src is a directory copied verbatim into out.'''
+        return bool(self.flags & MIRROR)
+
+    @property
+    def raw(self) -> bool:
+        '''Whether src is copied byte-for-byte instead of templated.'''
+        return bool(self.flags & RAW)
+
+    def with_out(self, out: Union[Path, str]) -> 'Rule':
+        '''Return a copy of this rule writing to out instead.'''
+        rule = Rule(self.src_str, out)
+        object.__setattr__(rule, 'flags', self.flags)
+        return rule
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'cannot assign to {name}: Rule is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'cannot delete {name}: Rule is immutable')
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Rule):
+            return NotImplemented
+        return ((self.src_str, self.out_str, self.flags)
+                == (other.src_str, other.out_str, other.flags))
+
+    def __hash__(self) -> int:
+        return hash((self.src_str, self.out_str, self.flags))
+
+    def __repr__(self) -> str:
+        return (f'Rule(src={self.src!r}, out={self.out!r}, '
+                f'executable={self.executable}, final={self.final}, '
+                f'force_rewrite={self.force_rewrite}, mirror={self.mirror}, '
+                f'raw={self.raw})')
+
+    def __reduce__(self):
+        '''Pickle as constructor arguments, reinterning the paths on load.'''
+        return (Rule, (self.src_str, self.out_str, self.executable,
+                       self.final, self.force_rewrite, self.mirror,
+                       self.raw))
@@ -0,0 +1,111 @@
+'''Cache the parsed host config and module rules in a pickled snapshot.'''
+import os
+from pathlib import Path
+import pickle
+from typing import Dict, List, Optional, Tuple
+
+from modot import hostconfig
+from modot import module_utils
+from modot.hostconfig import HostConfig
+from modot.rule import Rule
+
+
+SNAPSHOT_FILENAME = 'snapshot.pickle'
+SNAPSHOT_VERSION = 4
+
+Signature = Optional[Tuple[int, int, int]]
+
+
+class ConfigSnapshot():
+    '''Host config and module rules, reused while their files are unchanged.
+
+    The snapshot records a stat signature for every path the parse read: the
+    host config, each domain directory, each module.yaml and each
+    dir_contents directory. If any of them changed, that part is parsed from
+    YAML again and the snapshot is rewritten.
+    '''
+    def __init__(self, host_path: Path, snapshot_path: Path):
+        '''Load the previous snapshot, if any, without validating it.'''
+        self.host_path = host_path
+        self.snapshot_path = snapshot_path
+        self._snapshot = _load(snapshot_path)
+        self._host_cfg: Optional[HostConfig] = None
+        self._module_rules: Optional[Dict[Path, List[Rule]]] = None
+
+    def host_config(self) -> HostConfig:
+        '''Return the host config, parsing it only if it changed.'''
+        if self._host_cfg is not None:
+            return self._host_cfg
+        resolved = str(self.host_path.resolve())
+        host = self._snapshot.get('host')
+        if (host and host['path'] == resolved
+                and _deps_current(host['deps'])):
+            self._host_cfg = host['host_cfg']
+            return self._host_cfg
+        deps = _signatures([resolved])
+        self._host_cfg = hostconfig.from_file(self.host_path)
+        self._snapshot = {'host': {
+            'path': resolved, 'deps': deps, 'host_cfg': self._host_cfg}}
+        self._save()
+        return self._host_cfg
+
+    def module_rules(self) -> Dict[Path, List[Rule]]:
+        '''Return the rules of every enabled module, in module order.'''
+        if self._module_rules is not None:
+            return self._module_rules
+        host_cfg = self.host_config()
+        modules = self._snapshot.get('modules')
+        if modules and _deps_current(modules['deps']):
+            self._module_rules = modules['module_rules']
+            return self._module_rules
+        deps: List[Path] = []
+        self._module_rules = {
+            module_path: module_utils.get_rules(module_path, deps)
+            for module_path in module_utils.get_module_paths(host_cfg, deps)}
+        self._snapshot['modules'] = {
+            'deps': _signatures(deps), 'module_rules': self._module_rules}
+        self._save()
+        return self._module_rules
+
+    def _save(self):
+        '''Atomically write the snapshot.'''
+        tmp_path = self.snapshot_path.with_name(
+            f'{self.snapshot_path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as stream:
+            pickle.dump({**self._snapshot, 'version': SNAPSHOT_VERSION},
+                        stream, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.snapshot_path)
+
+
+def _load(snapshot_path: Path) -> dict:
+    '''Load a snapshot, or return an empty one if missing or unreadable.'''
+    try:
+        with open(snapshot_path, 'rb') as stream:
+            snapshot = pickle.load(stream)
+    except Exception:  # pylint: disable=broad-except
+        return {}
+    if not isinstance(snapshot, dict):
+        return {}
+    if snapshot.pop('version', None) != SNAPSHOT_VERSION:
+        return {}
+    return snapshot
+
+
+def _signature(path: str) -> Signature:
+    '''Return what identifies the current state of a path.'''
+    try:
+        path_stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (path_stat.st_mtime_ns, path_stat.st_size, path_stat.st_ino)
+
+
+def _signatures(paths) -> Dict[str, Signature]:
+    '''Return the signature of each path.'''
+    return {str(path): _signature(str(path)) for path in paths}
+
+
+def _deps_current(deps: Dict[str, Signature]) -> bool:
+    '''Return true if no recorded path has changed.'''
+    return all(_signature(path) == signature
+               for path, signature in deps.items())
@@ -0,0 +1,84 @@
+'''Per-run cache of directory listings and stats.'''
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+
+class StatCache():
+    '''Answers existence, type and stat queries from directory listings.
+
+    Each parent directory is listed once with os.scandir, which gives the
+    type of its entries without a stat per path; full stats are taken
+    lazily and kept on the entry. Paths whose parent can't be listed (or
+    the root) are checked directly. A cache is meant to live for one check
+    and deploy, since it never notices changes made after listing.
+    '''
+    def __init__(self):
+        '''Start with nothing listed.'''
+        self._listings: Dict[str, Optional[Dict[str, os.DirEntry]]] = {}
+
+    def exists(self, path: Union[Path, str]) -> bool:
+        '''Return true if path exists (following symlinks).'''
+        return self.stat(path) is not None
+
+    def is_file(self, path: Union[Path, str]) -> bool:
+        '''Return true if path is a regular file (following symlinks).'''
+        listed, dir_entry = self._entry(path)
+        if not listed:
+            return os.path.isfile(path)
+        try:
+            return dir_entry is not None and dir_entry.is_file()
+        except OSError:
+            return False
+
+    def is_dir(self, path: Union[Path, str]) -> bool:
+        '''Return true if path is a directory (following symlinks).'''
+        listed, dir_entry = self._entry(path)
+        if not listed:
+            return os.path.isdir(path)
+        try:
+            return dir_entry is not None and dir_entry.is_dir()
+        except OSError:
+            return False
+
+    def stat(self, path: Union[Path, str]) -> Optional[os.stat_result]:
+        '''Return the stat of path, or None if it doesn't exist.'''
+        listed, dir_entry = self._entry(path)
+        try:
+            if not listed:
+                return os.stat(path)
+            return None if dir_entry is None else dir_entry.stat()
+        except FileNotFoundError:
+            return None
+
+    def _entry(self, path: Union[Path, str]) -> Tuple[
+            bool, Optional[os.DirEntry]]:
+        '''Return whether path's parent was listed, and its entry if so.
+
+        Paths are split as strings, since rules hand their sources and
+        outputs over that way.
+        '''
+        dir_str, name = os.path.split(os.fspath(path))
+        if not name:
+            return False, None
+        dir_str = dir_str or '.'
+        if dir_str not in self._listings:
+            self._listings[dir_str] = _list_dir(dir_str)
+        listing = self._listings[dir_str]
+        if listing is None:
+            return False, None
+        return True, listing.get(name)
+
+
+def _list_dir(dir_str: str) -> Optional[Dict[str, os.DirEntry]]:
+    '''Return the entries of a directory by name, or None if unlistable.
+
+    A missing parent is listed as empty, since nothing can be inside it.
+    '''
+    try:
+        with os.scandir(dir_str) as entries:
+            return {dir_entry.name: dir_entry for dir_entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        return {}
+    except PermissionError:
+        return None
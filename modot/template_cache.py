@@ -0,0 +1,199 @@
+'''Provides an on-disk cache of tokenized mustache templates.'''
+# chevron is imported lazily so that creating a templater stays cheap
+# pylint: disable=import-outside-toplevel
+import functools
+import hashlib
+import marshal
+import os
+from pathlib import Path
+import threading
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from modot.renderer import Compiled, compile_tokens
+
+
+TEMPLATE_CACHE_DIRNAME = 'templates'
+# Bytes of tokens kept on disk at most
+TEMPLATE_CACHE_BYTES = 8 << 20
+
+Tokens = List[Tuple[str, str]]
+
+# Tags after which a template may read any key in the context
+_OPAQUE_TAGS = ('partial',)
+
+
+class TemplateCache():
+    '''Caches chevron token lists keyed by source hash and chevron version.
+
+    Sources without any mustache tags are cached as None so callers can
+    bypass rendering for them entirely. Alongside its tokens, each template
+    is kept compiled for the fast renderer, if it can be. Entries on disk
+    are touched when loaded, so prune() can drop the least recently used.
+    '''
+    def __init__(self, cache_path: Optional[Path] = None):
+        '''Initialize the cache, persisting entries under cache_path if set.'''
+        self.cache_path = cache_path
+        self._parsed: Dict[
+            str, Tuple[Optional[Tokens], Optional[Compiled]]] = {}
+        self._stored = False
+
+    def tokens(self, src_string: str) -> Optional[Tokens]:
+        '''Return the tokens for src_string, or None if it has no tags.'''
+        return self.parsed(src_string)[0]
+
+    def parsed(self, src_string: str
+               ) -> Tuple[Optional[Tokens], Optional[Compiled]]:
+        '''Return the tokens for src_string and the template compiled.
+
+        The tokens are None if it has no tags; it is only compiled if it has
+        tags and needs nothing beyond variables.
+        '''
+        if '{{' not in src_string:
+            return None, None
+        digest = hashlib.sha256(src_string.encode()).hexdigest()
+        if digest in self._parsed:
+            return self._parsed[digest]
+        tokens = self._load(digest)
+        if tokens is None:
+            from chevron.tokenizer import tokenize  # type: ignore
+            tokens = list(tokenize(src_string))
+            self._store(digest, tokens)
+        # Comments leave no token, but must still be removed
+        if (all(tag == 'literal' for tag, _ in tokens)
+                and ''.join(text for _, text in tokens) == src_string):
+            tokens = None
+        parsed = (tokens, compile_tokens(tokens) if tokens else None)
+        self._parsed[digest] = parsed
+        return parsed
+
+    def keys(self, src_string: str) -> Optional[FrozenSet[str]]:
+        '''Return the top-level context keys that src_string references.
+
+        Returns None if the template may depend on the whole context, e.g.
+        because it uses partials or renders the top-level scope itself.
+        Keys inside sections are included both because they may fall back
+        to the top-level scope and because the section key is included.
+        '''
+        tokens = self.tokens(src_string)
+        if tokens is None:
+            return frozenset()
+        keys = set()
+        depth = 0
+        for tag, key in tokens:
+            if tag in _OPAQUE_TAGS:
+                return None
+            if tag == 'end':
+                depth -= 1
+            elif tag in ('section', 'inverted section'):
+                depth += 1
+            if tag not in ('variable', 'no escape', 'section',
+                           'inverted section'):
+                continue
+            if key == '.':
+                if depth == 0:
+                    return None
+                continue
+            keys.add(key.split('.')[0])
+        return frozenset(keys)
+
+    def prune(self, max_bytes: int = TEMPLATE_CACHE_BYTES) -> int:
+        '''Remove the least recently used entries beyond max_bytes on disk.
+
+        Entries for other chevron versions are all removed. The directory is
+        only scanned if this cache stored new entries since it was last
+        pruned. Returns how many entries were removed.
+        '''
+        if not self.cache_path or not self._stored:
+            return 0
+        self._stored = False
+        return prune(self.cache_path, max_bytes)
+
+    def _load(self, digest: str) -> Optional[Tokens]:
+        '''Load the tokens for a digest from disk, if present.'''
+        if not self.cache_path:
+            return None
+        entry_path = self.cache_path / chevron_version() / digest
+        try:
+            with open(entry_path, 'rb') as stream:
+                tokens = marshal.load(stream)
+            os.utime(entry_path)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return tokens
+
+    def _store(self, digest: str, tokens: Tokens):
+        '''Atomically persist the tokens for a digest.'''
+        if not self.cache_path:
+            return
+        version_path = self.cache_path / chevron_version()
+        version_path.mkdir(parents=True, exist_ok=True)
+        entry_path = version_path / digest
+        tmp_path = entry_path.with_name(
+            f'{digest}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'wb') as stream:
+            marshal.dump(tokens, stream)
+        os.replace(tmp_path, entry_path)
+        self._stored = True
+
+
+@functools.lru_cache(maxsize=None)
+def chevron_version() -> str:
+    '''Return the installed chevron version, which keys the cache.'''
+    from chevron.metadata import version  # type: ignore
+    return version
+
+
+def prune(cache_path: Path, max_bytes: int = TEMPLATE_CACHE_BYTES) -> int:
+    '''Remove the least recently used entries beyond max_bytes on disk.
+
+    Unlike TemplateCache.prune, the directory is always scanned, for when
+    entries were stored by other processes. Returns how many entries were
+    removed.
+    '''
+    if not cache_path.is_dir():
+        return 0
+    entries, stale = _scan(cache_path)
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        stale.append(entry_path)
+        total -= size
+    for entry_path in stale:
+        try:
+            entry_path.unlink()
+        except FileNotFoundError:
+            pass
+    for version_path in cache_path.iterdir():
+        if version_path.name != chevron_version():
+            try:
+                version_path.rmdir()
+            except OSError:
+                pass
+    return len(stale)
+
+
+def _scan(cache_path: Path) -> Tuple[List[Tuple[int, int, Path]], List[Path]]:
+    '''Return the current version's entries, and other versions' paths.
+
+    Each current entry is listed with its mtime and size. Temp files being
+    written, and anything that isn't a version directory, are skipped.
+    '''
+    entries = []
+    stale = []
+    for version_path in cache_path.iterdir():
+        if not version_path.is_dir():
+            continue
+        for entry_path in version_path.iterdir():
+            if entry_path.suffix == '.tmp':
+                continue
+            if version_path.name != chevron_version():
+                stale.append(entry_path)
+                continue
+            try:
+                entry_stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append(
+                (entry_stat.st_mtime_ns, entry_stat.st_size, entry_path))
+    return entries, stale
@@ -1,15 +1,22 @@
-'''Provides an object to handle templating themes/colors.'''
+'''Provides an object to handle templating themes/colors.
+
+chevron is imported where it is used, so that the read-only commands
+(e.g. theme/color get) never pay for importing it.
+'''
+# pylint: disable=import-outside-toplevel
 import os
 from pathlib import Path
-from typing import List, Optional
-
-import chevron  # type: ignore
-import yaml
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
+from modot import context as context_layers
+from modot import profiling, renderer
+from modot.context import CONTEXT_CACHE_FILENAME
 from modot.hostconfig import HostConfig
+from modot.render_cache import RenderCache, context_digest
+from modot.template_cache import TEMPLATE_CACHE_DIRNAME, TemplateCache
 
 
-class Templater:
+class Templater:  # pylint: disable=too-many-instance-attributes
     '''Manages theme/color state and provides a function for templating.'''
     def __init__(
             self, modot_path: Path, host_config: Optional[HostConfig] = None):
@@ -17,6 +24,12 @@ class Templater:
         self.modot_path = modot_path
         self.host_cfg = host_config
         self._themecolor_cache: Optional[dict] = None
+        self._context_key: Optional[bytes] = None
+        self._values: Dict[Tuple[str, bool], str] = {}
+        self.render_cache = RenderCache()
+        self.template_cache = TemplateCache(
+            modot_path / TEMPLATE_CACHE_DIRNAME)
+        self.context_cache_path = modot_path / CONTEXT_CACHE_FILENAME
 
     def get_theme(self) -> Optional[str]:
         '''Return the currently deployed theme or None.'''
@@ -47,7 +60,7 @@ class Templater:
         if active_theme.exists() or active_theme.is_symlink():
             active_theme.unlink()
         active_theme.symlink_to(new_theme_path)
-        self._themecolor_cache = None
+        self.invalidate()
 
     def set_color(self, name: str):
         '''Set the active color.'''
@@ -58,25 +71,72 @@ class Templater:
         if active_color.exists() or active_color.is_symlink():
             active_color.unlink()
         active_color.symlink_to(new_color_path)
-        self._themecolor_cache = None
+        self.invalidate()
 
+    @profiling.timed('Templater.template')
     def template(self, src_string: str) -> str:
-        '''Template the provided string with the active theme and color.'''
+        '''Template the provided string with the active theme and color.
+
+        Templates using only variables are rendered by modot itself, with
+        each value looked up once per context; the rest by chevron.
+        '''
+        tokens, compiled = self.template_cache.parsed(src_string)
+        if tokens is None:
+            return src_string
+        profiling.count('templates_rendered')
+        if compiled is not None:
+            return renderer.render_compiled(compiled, self.context(),
+                                            self._values)
+        profiling.count('templates_chevron')
+        import chevron  # type: ignore
+        return chevron.render(tokens, self.context())
+
+    def render_source(self, src_path: Path) -> str:
+        '''Template the text of a source file, through the render cache.'''
+        text, digest = self.render_cache.read(src_path)
+        return self.render_cache.render(text, self.context_key(),
+                                        self.template, digest)
+
+    def render_text(self, src_string: str) -> str:
+        '''Template src_string, through the render cache.'''
+        return self.render_cache.render(src_string, self.context_key(),
+                                        self.template)
+
+    def context_key(self) -> bytes:
+        '''Return a digest of the whole context, keying cached renders.'''
+        if self._context_key is None:
+            self._context_key = context_digest(self.context())
+        return self._context_key
+
+    def keys(self, src_string: str) -> Optional[FrozenSet[str]]:
+        '''Return the context keys src_string references, None if any.'''
+        return self.template_cache.keys(src_string)
+
+    def context(self) -> dict:
+        '''Return the layered context used for templating.'''
         if self._themecolor_cache is None:
             self._themecolor_cache = self._read_themecolor_config()
-        return chevron.render(src_string, self._themecolor_cache)
+        return self._themecolor_cache
+
+    def invalidate(self):
+        '''Drop the cached theme/color config so it is re-read on next use.'''
+        self._themecolor_cache = None
+        self._context_key = None
+        self._values = {}
 
     def _read_themecolor_config(self) -> dict:
-        '''Read and merge the active theme and color configs.'''
+        '''Load the context layered on the active theme and color.
+
+        Reuses the on-disk context cache while none of the layers changed.
+        '''
         active_theme = self.modot_path/'theme.yaml'
         active_color = self.modot_path/'color.yaml'
         if (not active_theme.exists() or not active_color.exists()):
             raise LinkMalformedError
-        with open(active_theme, 'r') as stream:
-            theme_dict = yaml.safe_load(stream)
-        with open(active_color, 'r') as stream:
-            color_dict = yaml.safe_load(stream)
-        return {**color_dict, **theme_dict}
+        return context_layers.load_cached(
+            self.context_cache_path,
+            layer_paths(active_theme, active_color, self.host_cfg),
+            self.host_cfg.context if self.host_cfg else None)
 
     @staticmethod
     def _retrieve_config_link(active_path: Path):
@@ -96,16 +156,43 @@ class Templater:
         return [cfg_path.stem for cfg_path in dir_path.iterdir()]
 
 
-class FakeTemplater(Templater):
+def layer_paths(theme_path: Path, color_path: Path,
+                host_cfg: Optional[HostConfig] = None) -> List[Path]:
+    '''Return the files a context is layered from, lowest priority first.'''
+    if host_cfg and host_cfg.context_base:
+        return [host_cfg.context_base, color_path, theme_path]
+    return [color_path, theme_path]
+
+
+def load_context(theme_path: Path, color_path: Path,
+                 host_cfg: Optional[HostConfig] = None) -> dict:
+    '''Build the context for a theme and color, bypassing the disk cache.
+
+    Layers the host config's base file and overrides around them, if given.
+    '''
+    return context_layers.build(
+        layer_paths(theme_path, color_path, host_cfg),
+        host_cfg.context if host_cfg else None)
+
+
+class StaticTemplater(Templater):
+    '''Templater rendering with a given context instead of the active one.'''
+    def __init__(self, modot_path: Path, context: dict,
+                 host_config: Optional[HostConfig] = None):
+        '''Save the context to render with.'''
+        super().__init__(modot_path, host_config)
+        self.template_dict = context
+
+    def context(self) -> dict:
+        '''Return the explicitly specified dictionary.'''
+        return self.template_dict
+
+
+class FakeTemplater(StaticTemplater):
     '''Fake templater that takes a dict to use for templating.'''
     def __init__(self, modot_path: Path, template_dict: dict):
         '''Save the fake dict.'''
-        super().__init__(modot_path)
-        self.template_dict = template_dict
-
-    def template(self, src_string: str) -> str:
-        '''Template the string with the explicitly specified dictionary.'''
-        return chevron.render(src_string, self.template_dict)
+        super().__init__(modot_path, template_dict)
 
 
 class LinkMalformedError(Exception):
@@ -0,0 +1,176 @@
+'''Watch directory trees for changes, via inotify or by polling.'''
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import select
+import struct
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+
+# Delay after the first event during which further events are batched
+SETTLE_SECONDS = 0.05
+POLL_INTERVAL_SECONDS = 1.0
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM
+               | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF
+               | _IN_MOVE_SELF)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class PollingWatcher():
+    '''Detects changes by periodically comparing stat snapshots.'''
+    def __init__(self, roots: Iterable[Path],
+                 interval: float = POLL_INTERVAL_SECONDS):
+        '''Take the initial snapshot of every tree under roots.'''
+        self.roots = list(roots)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        '''Block until something changes and return the changed paths.
+
+        Returns an empty set if timeout seconds pass without a change.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._take_snapshot()
+            changed = {
+                Path(path)
+                for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path) != self._snapshot.get(path)}
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            delay = self.interval
+            if deadline is not None:
+                delay = max(0.0, min(delay, deadline - time.monotonic()))
+            time.sleep(delay)
+
+    def close(self):
+        '''Nothing to release for a polling watcher.'''
+
+    def _take_snapshot(self) -> Dict[str, Tuple[int, int]]:
+        '''Return the mtime and size of every entry under the roots.'''
+        snapshot: Dict[str, Tuple[int, int]] = {}
+        for root in self.roots:
+            _scan_into(str(root), snapshot)
+        return snapshot
+
+
+class InotifyWatcher():
+    '''Detects changes using Linux inotify, watching each directory.'''
+    def __init__(self, roots: Iterable[Path]):
+        '''Create the inotify instance and watch every tree under roots.'''
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError('inotify is not available')
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.roots = list(roots)
+        self._watches: Dict[int, Path] = {}
+        for root in self.roots:
+            self._add_tree(root)
+
+    def wait(self, timeout: Optional[float] = None) -> Set[Path]:
+        '''Block until something changes and return the changed paths.
+
+        Events arriving shortly after the first are batched together.
+        Returns an empty set if timeout seconds pass without a change.
+        '''
+        changed: Set[Path] = set()
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        while readable:
+            changed |= self._read_events()
+            readable, _, _ = select.select([self._fd], [], [], SETTLE_SECONDS)
+        return changed
+
+    def close(self):
+        '''Release the inotify file descriptor.'''
+        os.close(self._fd)
+
+    def _add_tree(self, root: Path):
+        '''Watch root and every directory below it.'''
+        for dir_path, _, _ in os.walk(root):
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(dir_path), _WATCH_MASK)
+            if wd >= 0:
+                self._watches[wd] = Path(dir_path)
+
+    def _read_events(self) -> Set[Path]:
+        '''Read pending events, watching any newly created directories.'''
+        changed: Set[Path] = set()
+        buf = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            if mask & _IN_Q_OVERFLOW:
+                changed.update(self.roots)
+                continue
+            if mask & _IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            dir_path = self._watches.get(wd)
+            if dir_path is None:
+                continue
+            path = dir_path / os.fsdecode(name) if name else dir_path
+            changed.add(path)
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._add_tree(path)
+        return changed
+
+
+def make_watcher(roots: Iterable[Path], poll: bool = False):
+    '''Return an inotify watcher for roots, or a polling one as fallback.'''
+    if not poll:
+        try:
+            return InotifyWatcher(roots)
+        except OSError:
+            pass
+    return PollingWatcher(roots)
+
+
+def _scan_into(dir_path: str, snapshot: Dict[str, Tuple[int, int]]):
+    '''Recursively record the stat of every entry under dir_path.'''
+    try:
+        entries = list(os.scandir(dir_path))
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    for entry in entries:
+        try:
+            entry_stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        snapshot[entry.path] = (entry_stat.st_mtime_ns, entry_stat.st_size)
+        if entry.is_dir(follow_symlinks=False):
+            _scan_into(entry.path, snapshot)
+
+
+def _load_libc():
+    '''Return libc if it provides inotify, else None.'''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1  # pylint: disable=pointless-statement
+    except (OSError, AttributeError):
+        return None
+    return libc
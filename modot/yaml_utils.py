@@ -0,0 +1,14 @@
+'''Load YAML with the fastest available safe loader.'''
+from modot import profiling
+
+
+@profiling.timed('yaml_load')
+def safe_load(stream):
+    '''Safely load YAML, using libyaml's CSafeLoader when it is available.
+
+    yaml is imported here rather than at module load so that commands which
+    never parse config don't pay for importing it.
+    '''
+    import yaml  # pylint: disable=import-outside-toplevel
+    return yaml.load(
+        stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
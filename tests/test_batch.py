@@ -0,0 +1,140 @@
+'''Test deploying several host configs into target roots.'''
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from modot import batch
+from modot.batch import BatchTarget, BatchTargetError
+from modot.deployer import CatCheckError
+from modot import module_utils
+from modot.template_cache import TEMPLATE_CACHE_DIRNAME
+from modot.templater import Templater
+
+
+class TestBatch(unittest.TestCase):
+    '''Test batch deploys sharing one domain between targets.'''
+    def setUp(self):
+        '''Set up a domain, themes, colors and a host config.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.home = self.tmpdir / 'home'
+        module_path = self.tmpdir / 'dom' / 'mod'
+        module_path.mkdir(parents=True)
+        (module_path / 'a.conf').write_text('font={{font}} bg={{bg}}')
+        (module_path / 'b.conf').write_text('plain')
+        (module_path / 'c.bin').write_bytes(b'\0{{font}}\xff')
+        (module_path / 'module.yaml').write_text(
+            f'a.conf:\n  out: {self.home}/.config/a.conf\n'
+            f'b.conf:\n  out: {self.home}/b.conf\n  exec: true\n'
+            f'c.bin:\n  out: {self.home}/c.bin\n')
+        for kind, key, names in (('themes', 'font', ('t1', 't2')),
+                                 ('colors', 'bg', ('c1', 'c2'))):
+            (self.tmpdir / kind).mkdir()
+            for name in names:
+                (self.tmpdir / kind / f'{name}.yaml').write_text(
+                    f'{key}: {name}')
+        self.host_path = self.tmpdir / 'host.yaml'
+        self.host_path.write_text(
+            f'themes: {self.tmpdir}/themes\n'
+            f'colors: {self.tmpdir}/colors\n'
+            'default_theme: t1\n'
+            'default_color: c1\n'
+            f'domains: [{self.tmpdir}/dom]\n'
+            'modules: [mod]\n')
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def _deploy(self, targets, jobs=1) -> int:
+        return batch.batch_deploy(targets, self.tmpdir / 'modot', jobs,
+                                  self.home)
+
+    def _targets(self):
+        return [BatchTarget(self.host_path, self.tmpdir / 'alice'),
+                BatchTarget(self.host_path, self.tmpdir / 'bob', 't2', 'c2')]
+
+    def test_rebase(self):
+        '''Outputs under home move under root, others under root from /.'''
+        self.assertEqual(
+            batch.rebase(Path('/h/.bashrc'), Path('/r'), Path('/h')),
+            Path('/r/.bashrc'))
+        self.assertEqual(
+            batch.rebase(Path('/etc/motd'), Path('/r'), Path('/h')),
+            Path('/r/etc/motd'))
+
+    def test_load_targets(self):
+        '''Targets should be read from a YAML list.'''
+        batch_path = self.tmpdir / 'batch.yaml'
+        batch_path.write_text(
+            f'- host: {self.host_path}\n  root: /r1\n'
+            f'- host: {self.host_path}\n  root: /r2\n  color: c2\n')
+        self.assertEqual(batch.load_targets(batch_path), [
+            BatchTarget(self.host_path, Path('/r1')),
+            BatchTarget(self.host_path, Path('/r2'), color='c2')])
+
+    def test_deploy_targets(self):
+        '''Each target should get its own rendering under its root.'''
+        self.assertEqual(self._deploy(self._targets()), 6)
+        alice, bob = self.tmpdir / 'alice', self.tmpdir / 'bob'
+        self.assertEqual((alice / '.config' / 'a.conf').read_text(),
+                         'font=t1 bg=c1')
+        self.assertEqual((bob / '.config' / 'a.conf').read_text(),
+                         'font=t2 bg=c2')
+        self.assertEqual((bob / 'b.conf').read_text(), 'plain')
+        self.assertEqual((bob / 'b.conf').stat().st_mode, 0o100544)
+        self.assertEqual((bob / 'c.bin').read_bytes(), b'\0{{font}}\xff')
+        self.assertEqual(self._deploy(self._targets()), 0)
+
+    def test_deploy_process_pool(self):
+        '''Rendering across processes should give the same outputs.'''
+        self.assertEqual(self._deploy(self._targets(), jobs=2), 6)
+        self.assertEqual(
+            (self.tmpdir / 'bob' / '.config' / 'a.conf').read_text(),
+            'font=t2 bg=c2')
+
+    def test_process_pool_bounded_by_cpus(self):
+        '''No more render processes than CPUs should be started.'''
+        with patch('modot.batch.os.cpu_count', return_value=2), \
+                patch('modot.batch.ProcessPoolExecutor',
+                      side_effect=batch.ProcessPoolExecutor) as executor:
+            self.assertEqual(self._deploy(self._targets(), jobs=32), 6)
+        self.assertEqual(executor.call_args[1]['max_workers'], 2)
+
+    def test_renders_through_templater(self):
+        '''Workers should render with Templater.template, once per context.'''
+        with patch.object(Templater, 'template', autospec=True,
+                          side_effect=Templater.template) as template:
+            self._deploy(self._targets())
+        self.assertEqual(sorted(call.args[1] for call in template.mock_calls),
+                         ['font={{font}} bg={{bg}}'] * 2)
+
+    def test_template_cache_pruned(self):
+        '''Templates stored by render workers should be pruned after.'''
+        with patch('modot.batch.template_cache.prune') as prune:
+            self._deploy(self._targets(), jobs=2)
+        prune.assert_called_once_with(
+            self.tmpdir / 'modot' / TEMPLATE_CACHE_DIRNAME)
+
+    def test_modules_parsed_once(self):
+        '''A module shared by several targets should be parsed once.'''
+        with patch('modot.batch.module_utils.get_rules',
+                   side_effect=module_utils.get_rules) as get_rules:
+            self._deploy(self._targets())
+        get_rules.assert_called_once()
+
+    def test_missing_theme_raises(self):
+        '''A target naming a theme that doesn't exist should fail.'''
+        with self.assertRaises(BatchTargetError):
+            self._deploy([BatchTarget(self.host_path, self.tmpdir / 'r',
+                                      theme='dne')])
+
+    def test_check_failure_writes_nothing(self):
+        '''If any target fails its checks, no target should be written.'''
+        bad_root = self.tmpdir / 'bad'
+        (bad_root / 'b.conf').mkdir(parents=True)
+        with self.assertRaises(CatCheckError):
+            self._deploy([*self._targets(),
+                          BatchTarget(self.host_path, bad_root)])
+        self.assertFalse((self.tmpdir / 'alice').exists())
@@ -2,9 +2,11 @@
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from modot.cat import Cat, ImproperOutpathError
+from modot.fileio import CHUNK_SIZE, AtomicWriter
+from modot.object_store import ObjectStore
 from modot.rule import Rule
 from modot.templater import FakeTemplater, Templater
 
@@ -83,6 +85,20 @@ class TestCat(unittest.TestCase):
             Rule(self.srcfile2, self.tmpdir)]
         self.assertFalse(cat.check())
 
+    def test_add_aggregates_flags(self):
+        '''Adding rules should update the cat's flags and output checks.'''
+        cat = Cat(Mock(spec=Templater))
+        cat.add(Rule(self.srcfile1, self.tmpdir / 'outdne'))
+        self.assertEqual(cat.mode(), 0o444)
+        cat.add(Rule(self.srcfile2, self.tmpdir / 'outdne', executable=True))
+        self.assertEqual(cat.mode(), 0o544)
+        self.assertTrue(cat.check())
+        cat.add(Rule(self.srcfile2, self.tmpdir / 'other'))
+        self.assertFalse(cat.check())
+        cat.rules = cat.rules[:1]
+        self.assertEqual(cat.mode(), 0o444)
+        self.assertTrue(cat.check())
+
     def test_check_final_single_rule_succeeds(self):
         '''A cat with one final rule should pass checks.'''
         cat = Cat(Mock(spec=Templater))
@@ -181,32 +197,42 @@ class TestCatDeploy(unittest.TestCase):
             'something cool\nnewline')
 
     def test_deploy_equal_files_no_write(self):
-        '''A cat that would not change the outfile shouldn't open it.'''
+        '''A cat that would not change the outfile shouldn't replace it.'''
         cat = Cat(FakeTemplater(
             self.tmpdir,
             {'theme': 'cooltheme', 'colorfg': 'white', 'colorbg': 'blue'}))
-        outpathspy = Mock(wraps=self.outfile)
-        cat.rules = [Rule(self.srcfile1, outpathspy)]
+        cat.rules = [Rule(self.srcfile1, self.outfile)]
         self.srcfile1.write_text('theme: {{theme}}\nforeground: {{colorfg}}')
         self.outfile.write_text('theme: cooltheme\nforeground: white')
-        cat.deploy()
-        # This is implementation-dependent -- look for a better option
-        outpathspy.write_text.assert_not_called()
+        old_inode = self.outfile.stat().st_ino
+        self.assertFalse(cat.deploy())
+        self.assertEqual(self.outfile.stat().st_ino, old_inode)
 
     def test_deploy_equal_files_flag_force_write(self):
         '''force_rewrite flag with equal output still writes the outfile.'''
         cat = Cat(FakeTemplater(
             self.tmpdir,
             {'theme': 'cooltheme', 'colorfg': 'white', 'colorbg': 'blue'}))
-        outpathspy = Mock(wraps=self.outfile)
         cat.rules = [
-            Rule(self.srcfile1, outpathspy),
-            Rule(self.srcfile2, outpathspy, force_rewrite=True)]
+            Rule(self.srcfile1, self.outfile),
+            Rule(self.srcfile2, self.outfile, force_rewrite=True)]
         self.srcfile1.write_text('theme: {{theme}}\nforeground: {{colorfg}}')
         self.outfile.write_text('theme: cooltheme\nforeground: white')
+        old_inode = self.outfile.stat().st_ino
+        self.assertTrue(cat.deploy())
+        self.assertNotEqual(self.outfile.stat().st_ino, old_inode)
+
+    def test_deploy_replaces_atomically(self):
+        '''A write should leave only the finished outfile, already readonly.'''
+        cat = Cat(FakeTemplater(self.tmpdir, {'theme': 'cooltheme'}))
+        outdir = self.tmpdir/'outdir'
+        outdir.mkdir()
+        cat.rules = [Rule(self.srcfile1, outdir/'newoutfile')]
+        self.srcfile1.write_text('theme: {{theme}}')
         cat.deploy()
-        # This is implementation-dependent -- look for a better option
-        outpathspy.write_text.assert_called()
+        self.assertEqual([path.name for path in outdir.iterdir()],
+                         ['newoutfile'])
+        self.assertEqual(0o100444, (outdir/'newoutfile').stat().st_mode)
 
     def test_deploy_differing_outpaths_raises(self):
         '''If deploying rules with differing outpaths, raise an error.'''
@@ -246,3 +272,208 @@ class TestCatDeploy(unittest.TestCase):
         self.outfile.chmod(0o000)
         cat.deploy()
         self.assertEqual(0o100544, self.outfile.stat().st_mode)
+
+    def test_deploy_store_links(self):
+        '''With a store, the output should be linked to its stored render.'''
+        store = ObjectStore(self.tmpdir / 'store')
+        cat = Cat(FakeTemplater(self.tmpdir, {'theme': 'cooltheme'}))
+        cat.rules = [Rule(self.srcfile1, self.outfile)]
+        self.srcfile1.write_text('theme: {{theme}}')
+        self.assertTrue(cat.deploy(store=store))
+        self.assertEqual(self.outfile.read_text(), 'theme: cooltheme')
+        self.assertEqual(0o100444, self.outfile.stat().st_mode)
+        self.assertEqual(self.outfile.stat().st_nlink, 2)
+        self.assertFalse(cat.deploy(store=store))
+
+
+@patch('modot.cat.STREAM_THRESHOLD_BYTES', 0)
+class TestCatStreaming(unittest.TestCase):
+    '''Test deploying cats large enough to be streamed.'''
+    def setUp(self):
+        '''Set up sources for a plain, a templated and an empty rule.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.outfile = self.tmpdir/'outdir'/'out'
+        self.outfile.parent.mkdir()
+        self.plain = self.tmpdir/'plain'
+        self.plain.write_text('plain text\n' * 10000)
+        self.templated = self.tmpdir/'templated'
+        self.templated.write_text('theme: {{theme}}')
+        self.empty = self.tmpdir/'empty'
+        self.empty.write_text('')
+        self.cat = Cat(FakeTemplater(self.tmpdir, {'theme': 'cooltheme'}))
+        self.cat.rules = [Rule(self.plain, self.outfile),
+                          Rule(self.empty, self.outfile),
+                          Rule(self.templated, self.outfile),
+                          Rule(self.plain, self.outfile)]
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def _joined(self) -> str:
+        '''Return what the in-memory deploy would have written.'''
+        with patch('modot.cat.STREAM_THRESHOLD_BYTES', 1 << 62):
+            self.cat.deploy()
+        joined = self.outfile.read_text()
+        self.outfile.unlink()
+        return joined
+
+    def test_streamed_matches_joined(self):
+        '''Streaming should write exactly what joining in memory would.'''
+        expected = self._joined()
+        self.assertTrue(self.cat.deploy())
+        self.assertEqual(self.outfile.read_text(), expected)
+        self.assertEqual([path.name for path in self.outfile.parent.iterdir()],
+                         ['out'])
+        self.assertEqual(0o100444, self.outfile.stat().st_mode)
+
+    def test_tag_across_chunks_templated(self):
+        '''A tag split over a chunk boundary should still be rendered.'''
+        self.plain.write_text('x' * (CHUNK_SIZE - 1) + '{{theme}}')
+        self.cat.rules = [Rule(self.plain, self.outfile)]
+        self.cat.deploy()
+        self.assertEqual(self.outfile.read_text(),
+                         'x' * (CHUNK_SIZE - 1) + 'cooltheme')
+
+    def test_carriage_returns_match_joined(self):
+        '''Sources read as text should have their line endings translated.'''
+        self.plain.write_bytes(b'windows\r\nlines\r\n')
+        expected = self._joined()
+        self.cat.deploy()
+        self.assertEqual(self.outfile.read_bytes(), expected.encode())
+
+    def test_equal_output_no_write(self):
+        '''An output whose hash already matches should be left in place.'''
+        self.cat.deploy()
+        inode = self.outfile.stat().st_ino
+        self.outfile.chmod(0o644)
+        self.assertFalse(self.cat.deploy())
+        self.assertEqual(self.outfile.stat().st_ino, inode)
+        self.assertEqual(0o100444, self.outfile.stat().st_mode)
+        self.assertEqual([path.name for path in self.outfile.parent.iterdir()],
+                         ['out'])
+
+    def test_equal_output_not_rewritten(self):
+        '''No replacement should be written for an output that matches.'''
+        self.cat.deploy()
+        with patch('modot.cat.AtomicWriter',
+                   side_effect=AtomicWriter) as writer:
+            self.assertFalse(self.cat.deploy())
+        writer.assert_not_called()
+
+    def test_binary_copied_verbatim(self):
+        '''A streamed binary source should be copied byte-for-byte.'''
+        self.plain.write_bytes(b'\0\xff{{theme}}\r\n\xfe')
+        self.cat.rules = [Rule(self.plain, self.outfile),
+                          Rule(self.templated, self.outfile)]
+        self.assertTrue(self.cat.deploy())
+        self.assertEqual(self.outfile.read_bytes(),
+                         b'\0\xff{{theme}}\r\n\xfe\ntheme: cooltheme')
+        self.assertFalse(self.cat.deploy())
+
+    def test_changed_output_write(self):
+        '''An output whose hash differs should be replaced.'''
+        self.cat.deploy()
+        self.templated.write_text('theme: {{theme}}!')
+        self.assertTrue(self.cat.deploy())
+        self.assertIn('theme: cooltheme!\n', self.outfile.read_text())
+
+    def test_force_rewrite_write(self):
+        '''force_rewrite should replace even an identical output.'''
+        self.cat.deploy()
+        self.cat.add(
+            Rule(self.empty, self.outfile, force_rewrite=True))
+        self.assertTrue(self.cat.deploy())
+
+
+class TestCatMirror(unittest.TestCase):
+    '''Test deploying a mirrored directory tree.'''
+    def setUp(self):
+        '''Set up a source tree and a mirror cat for it.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.src = self.tmpdir / 'src'
+        self.out = self.tmpdir / 'out'
+        (self.src / 'sub').mkdir(parents=True)
+        (self.src / 'plain').write_text('{{not templated}}')
+        (self.src / 'sub' / 'script').write_text('#!/bin/sh')
+        (self.src / 'sub' / 'script').chmod(0o755)
+        self.cat = Cat(Mock(spec=Templater))
+        self.cat.rules = [Rule(self.src, self.out, mirror=True)]
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def test_check(self):
+        '''A mirror must be alone and copy a directory onto a non-file.'''
+        self.assertTrue(self.cat.check())
+        self.out.touch()
+        self.assertFalse(self.cat.check())
+        self.out.unlink()
+        self.cat.add(Rule(self.src / 'plain', self.out))
+        self.assertFalse(self.cat.check())
+
+    def test_deploy_copies_tree(self):
+        '''The tree should be copied verbatim and made readonly.'''
+        self.assertTrue(self.cat.deploy())
+        self.assertEqual((self.out / 'plain').read_text(),
+                         '{{not templated}}')
+        self.assertEqual((self.out / 'plain').stat().st_mode, 0o100444)
+        self.assertEqual((self.out / 'sub' / 'script').stat().st_mode,
+                         0o100544)
+        self.cat.templater.template.assert_not_called()
+
+    def test_deploy_creates_parents(self):
+        '''Missing directories above the mirror's output should be made.'''
+        out = self.tmpdir / 'missing' / 'out'
+        self.cat.rules = [Rule(self.src, out, mirror=True)]
+        self.assertTrue(self.cat.deploy())
+        self.assertEqual((out / 'plain').read_text(), '{{not templated}}')
+
+    def test_redeploy_copies_only_changed(self):
+        '''Files with an unchanged size and mtime should not be copied.'''
+        self.cat.deploy()
+        self.assertFalse(self.cat.deploy())
+        (self.src / 'sub' / 'script').write_text('#!/bin/bash')
+        with patch('modot.cat.AtomicWriter',
+                   side_effect=AtomicWriter) as writer:
+            self.assertTrue(self.cat.deploy())
+        writer.assert_called_once_with(self.out / 'sub' / 'script', 0o544)
+        self.assertEqual((self.out / 'sub' / 'script').read_text(),
+                         '#!/bin/bash')
+
+
+class TestCatRaw(unittest.TestCase):
+    '''Test copying raw and binary sources without templating.'''
+    def setUp(self):
+        '''Set up a binary source, a text source and an output path.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.binary = self.tmpdir / 'font.ttf'
+        self.binary.write_bytes(b'\0\xff{{theme}}\r\n\xfe')
+        self.text = self.tmpdir / 'text'
+        self.text.write_text('theme: {{theme}}')
+        self.out = self.tmpdir / 'out'
+        self.cat = Cat(FakeTemplater(self.tmpdir, {'theme': 'cooltheme'}))
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def test_binary_copied_verbatim(self):
+        '''A source with a NUL byte should be copied byte-for-byte.'''
+        self.cat.rules = [Rule(self.binary, self.out)]
+        self.assertTrue(self.cat.deploy())
+        self.assertEqual(self.out.read_bytes(), self.binary.read_bytes())
+        self.assertEqual(self.out.stat().st_mode, 0o100444)
+        self.assertFalse(self.cat.deploy())
+
+    def test_raw_not_templated(self):
+        '''A raw rule should keep its tags, next to templated rules.'''
+        self.cat.rules = [Rule(self.text, self.out, raw=True),
+                          Rule(self.text, self.out)]
+        self.assertTrue(self.cat.deploy())
+        self.assertEqual(self.out.read_text(),
+                         'theme: {{theme}}\ntheme: cooltheme')
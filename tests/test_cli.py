@@ -0,0 +1,66 @@
+'''Test the modot commands end to end.'''
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+from modot import cli
+
+
+class TestCli(unittest.TestCase):
+    '''Test commands against a host config in a temp directory.'''
+    def setUp(self):
+        '''Set up a host with a templated and a raw output.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        for name in ('themes', 'colors', 'dom/mod', 'out'):
+            (self.tmpdir / name).mkdir(parents=True)
+        (self.tmpdir / 'themes' / 't1.yaml').write_text('font: mono')
+        (self.tmpdir / 'colors' / 'c1.yaml').write_text('bg: black')
+        (self.tmpdir / 'colors' / 'c2.yaml').write_text('bg: white')
+        (self.tmpdir / 'dom' / 'mod' / 'a').write_text('{{font}} {{bg}}')
+        (self.tmpdir / 'dom' / 'mod' / 'r').write_text('{{raw}}')
+        self.module_path = self.tmpdir / 'dom' / 'mod' / 'module.yaml'
+        self.module_path.write_text(
+            f'a: {{out: {self.tmpdir}/out/a}}\n'
+            f'r: {{out: {self.tmpdir}/out/r, raw: true}}\n')
+        self.host_path = self.tmpdir / 'host.yaml'
+        self.host_path.write_text(
+            f'themes: {self.tmpdir}/themes\n'
+            f'colors: {self.tmpdir}/colors\n'
+            f'domains: [{self.tmpdir}/dom]\n'
+            'modules: [mod]\n')
+        modot_path = self.tmpdir / 'modot'
+        for name, path in (('MODOT_PATH', modot_path),
+                           ('ACTIVE_HOST_PATH', modot_path / 'config.yaml')):
+            patcher = patch.object(cli, name, path)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def _run(self, *args) -> str:
+        '''Run a modot command, returning its output.'''
+        result = CliRunner().invoke(cli.cli, args, catch_exceptions=False)
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    def test_prune_after_prerendered_deploy(self):
+        '''Outputs placed from prerenders should be pruned like any other.'''
+        self._run('deploy', str(self.host_path), '--non-interactive',
+                  '-t', 't1', '-c', 'c1')
+        self._run('prerender')
+        (self.tmpdir / 'out' / 'r').unlink()
+        self._run('color', 'set', 'c2')
+        self.assertEqual((self.tmpdir / 'out' / 'a').read_text(),
+                         'mono white')
+        self.assertEqual((self.tmpdir / 'out' / 'r').read_text(), '{{raw}}')
+        self.module_path.write_text(f'a: {{out: {self.tmpdir}/out/a}}\n')
+        output = self._run('deploy', str(self.host_path),
+                           '--non-interactive', '--prune')
+        self.assertIn(f'Removed {self.tmpdir}/out/r', output)
+        self.assertTrue((self.tmpdir / 'out' / 'a').exists())
@@ -0,0 +1,97 @@
+'''Test layering the template context and caching it on disk.'''
+import os
+import pickle
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from modot import context
+
+
+class TestMergeLayers(unittest.TestCase):
+    '''Test merging context layers.'''
+    def test_later_layers_win(self):
+        '''Later layers should replace values, merging nested mappings.'''
+        merged = context.merge_layers([
+            {'a': 1, 'bg': {'main': 'black', 'dim': 'grey'}},
+            {'a': 2, 'bg': {'main': 'navy'}},
+            None])
+        self.assertEqual(merged,
+                         {'a': 2, 'bg': {'main': 'navy', 'dim': 'grey'}})
+
+    def test_dotted_keys(self):
+        '''A dotted key should set a value inside nested mappings.'''
+        merged = context.merge_layers([
+            {'bg': {'main': 'black'}},
+            {'bg.dim': 'grey', 'fg.main': 'white', 3: 'three'}])
+        self.assertEqual(merged, {'bg': {'main': 'black', 'dim': 'grey'},
+                                  'fg': {'main': 'white'}, 3: 'three'})
+
+    def test_scalar_replaced_by_mapping(self):
+        '''A mapping should replace a scalar under the same key.'''
+        merged = context.merge_layers([{'bg': 'black'}, {'bg.dim': 'grey'}])
+        self.assertEqual(merged, {'bg': {'dim': 'grey'}})
+
+
+class TestLoadCached(unittest.TestCase):
+    '''Test the on-disk context cache.'''
+    def setUp(self):
+        '''Write a color and a theme layer.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.cache_path = self.tmpdir / context.CONTEXT_CACHE_FILENAME
+        self.color = self.tmpdir / 'color.yaml'
+        self.theme = self.tmpdir / 'theme.yaml'
+        self.color.write_text('fg: white')
+        self.theme.write_text('font: mono')
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def _load(self, overrides=None):
+        return context.load_cached(self.cache_path, [self.color, self.theme],
+                                   overrides)
+
+    def _entries(self):
+        with open(self.cache_path, 'rb') as stream:
+            return pickle.load(stream)['entries']
+
+    def test_hit_skips_build(self):
+        '''An unchanged set of layers should be loaded from the cache.'''
+        built = self._load({'fg': 'ivory'})
+        self.assertEqual(built, {'fg': 'ivory', 'font': 'mono'})
+        with patch.object(context, 'build') as build:
+            self.assertEqual(self._load({'fg': 'ivory'}), built)
+        build.assert_not_called()
+
+    def test_changed_layer_rebuilds(self):
+        '''Changing a layer or the overrides should build again.'''
+        self._load()
+        self.theme.write_text('font: serif, sans')
+        self.assertEqual(self._load()['font'], 'serif, sans')
+        self.assertEqual(self._load({'font': 'x'})['font'], 'x')
+
+    def test_entries_bounded(self):
+        '''Only the most recently used contexts should be kept.'''
+        for idx in range(context.CONTEXT_CACHE_ENTRIES + 2):
+            self._load({'n': idx})
+        self.assertEqual(len(self._entries()),
+                         context.CONTEXT_CACHE_ENTRIES)
+
+    def test_corrupt_cache_ignored(self):
+        '''An unreadable cache file should be rebuilt.'''
+        self.cache_path.write_bytes(b'garbage')
+        self.assertEqual(self._load(), {'fg': 'white', 'font': 'mono'})
+        self.assertEqual(len(self._entries()), 1)
+        self.assertFalse(any(name.endswith('.tmp')
+                             for name in os.listdir(self.tmpdir)))
+
+    def test_palette_expanded(self):
+        '''The merged palette should be expanded into its formats.'''
+        self.color.write_text(
+            "palette_exprs: {bg: '#000', dim: 'alpha(bg, 50%)'}")
+        palette = self._load({'palette_exprs.bg': '#fff'})['palette']
+        self.assertEqual(palette['dim']['hexa'], '#ffffff80')
+        self.assertEqual(palette['bg']['hex'], '#ffffff')
@@ -0,0 +1,112 @@
+'''Test the long-running deploy daemon.'''
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import threading
+import unittest
+
+from modot import daemon
+from modot.daemon import Daemon
+from modot.ipc import DAEMON_SOCKET_FILENAME, send_request
+
+
+class TestDaemon(unittest.TestCase):
+    '''Test daemon requests and change handling.'''
+    def setUp(self):
+        '''Set up a host config with one module, a theme and two colors.'''
+        self.root_handle = TemporaryDirectory()
+        self.root = Path(self.root_handle.name)
+        self.modot_path = self.root / 'modot'
+        self.module_path = self.root / 'dom' / 'mod'
+        for path in (self.modot_path, self.module_path,
+                     self.root / 'themes', self.root / 'colors'):
+            path.mkdir(parents=True)
+        (self.root / 'themes' / 'main.yaml').write_text('font: mono')
+        (self.root / 'colors' / 'dark.yaml').write_text('bg: black')
+        (self.root / 'colors' / 'light.yaml').write_text('bg: white')
+        (self.module_path / 'conf').write_text('{{bg}} {{font}}')
+        (self.module_path / 'module.yaml').write_text(
+            f'conf:\n  out: {self.root}/out')
+        self.host_path = self.root / 'host.yaml'
+        self.host_path.write_text(
+            f'themes: {self.root}/themes\n'
+            f'colors: {self.root}/colors\n'
+            f'domains: [{self.root}/dom]\n'
+            'modules: [mod]')
+        (self.modot_path / 'theme.yaml').symlink_to(
+            self.root / 'themes' / 'main.yaml')
+        (self.modot_path / 'color.yaml').symlink_to(
+            self.root / 'colors' / 'dark.yaml')
+        self.daemon = Daemon(self.modot_path, self.host_path, jobs=1)
+        self.daemon.deploy()
+
+    def tearDown(self):
+        self.root_handle.cleanup()
+
+    def test_deploy(self):
+        '''The initial deploy should write the output.'''
+        self.assertEqual((self.root / 'out').read_text(), 'black mono')
+
+    def test_set_color(self):
+        '''A set_color request should switch color and redeploy.'''
+        response = self.daemon.handle(
+            {'command': 'set_color', 'name': 'light'})
+        self.assertEqual(response, {})
+        self.assertEqual((self.root / 'out').read_text(), 'white mono')
+
+    def test_set_color_unknown_errors(self):
+        '''Setting a color that does not exist should return an error.'''
+        response = self.daemon.handle({'command': 'set_color', 'name': 'dne'})
+        self.assertIn('error', response)
+
+    def test_adopt_does_not_deploy(self):
+        '''An adopt request should re-read the config without deploying.'''
+        (self.root / 'out').unlink()
+        conf_path = self.module_path / 'module.yaml'
+        conf_path.write_text(f'conf:\n  out: {self.root}/moved')
+        self.assertEqual(self.daemon.handle({'command': 'adopt'}), {})
+        self.assertFalse((self.root / 'out').exists())
+        self.assertFalse((self.root / 'moved').exists())
+        rules, = self.daemon.module_rules.values()
+        self.assertEqual([str(rule.out) for rule in rules],
+                         [f'{self.root}/moved'])
+
+    def test_unknown_command_errors(self):
+        '''An unknown command should return an error.'''
+        self.assertIn('error', self.daemon.handle({'command': 'explode'}))
+
+    def test_theme_change_redeploys(self):
+        '''Editing the active theme file should redeploy with the new value.'''
+        theme_path = self.root / 'themes' / 'main.yaml'
+        theme_path.write_text('font: sans')
+        self.daemon.apply_changes({theme_path})
+        self.assertEqual((self.root / 'out').read_text(), 'black sans')
+
+    def test_module_change_reparses(self):
+        '''Adding a rule to a module config should deploy the new output.'''
+        (self.module_path / 'new').write_text('new')
+        conf_path = self.module_path / 'module.yaml'
+        conf_path.write_text(
+            f'conf:\n  out: {self.root}/out\nnew:\n  out: {self.root}/new')
+        self.daemon.apply_changes({conf_path, self.module_path / 'new'})
+        self.assertEqual((self.root / 'new').read_text(), 'new')
+
+    def test_socket_round_trip(self):
+        '''Requests sent over the socket should reach the daemon.'''
+        socket_path = self.modot_path / DAEMON_SOCKET_FILENAME
+        server = daemon._Server(  # pylint: disable=protected-access
+            socket_path, self.daemon)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            response = send_request(
+                socket_path, {'command': 'set_color', 'name': 'light'})
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.assertEqual(response, {})
+        self.assertEqual((self.root / 'out').read_text(), 'white mono')
+
+    def test_send_request_no_daemon(self):
+        '''Sending to a socket nobody listens on should return None.'''
+        self.assertIsNone(send_request(self.modot_path / 'dne.sock', {}))
@@ -0,0 +1,110 @@
+'''Test deploying sets of cats.'''
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from modot.cat import Cat
+from modot.deployer import DeployError, deploy_cats
+from modot.manifest import Manifest
+from modot.object_store import ObjectStore
+from modot.pipeline import SourceReader
+from modot.rule import Rule
+from modot.templater import FakeTemplater
+
+
+class TestDeployCats(unittest.TestCase):
+    '''Test serial and concurrent deploys.'''
+    def setUp(self):
+        '''Set up a tempdir with a handful of source files.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.templater = FakeTemplater(self.tmpdir, {'color': 'blue'})
+        self.manifest = Manifest(self.tmpdir / 'manifest.json')
+        self.cats = []
+        for idx in range(8):
+            src_path = self.tmpdir / f'src{idx}'
+            src_path.write_text(f'{idx}: {{{{color}}}}')
+            cat = Cat(self.templater)
+            cat.rules = [Rule(src_path, self.tmpdir / f'out{idx}')]
+            self.cats.append(cat)
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def test_deploy_serial(self):
+        '''Every cat should be deployed with a single job.'''
+        deploy_cats(self.cats, self.manifest, {}, jobs=1)
+        for idx in range(8):
+            self.assertEqual(
+                (self.tmpdir / f'out{idx}').read_text(), f'{idx}: blue')
+
+    def test_deploy_parallel(self):
+        '''Every cat should be deployed with several jobs.'''
+        deploy_cats(self.cats, self.manifest, {}, jobs=4)
+        for idx in range(8):
+            self.assertEqual(
+                (self.tmpdir / f'out{idx}').read_text(), f'{idx}: blue')
+
+    def test_deploy_parallel_errors_in_order(self):
+        '''Failures should be raised together, in cat order.'''
+        (self.tmpdir / 'src5').unlink()
+        (self.tmpdir / 'src2').unlink()
+        with self.assertRaises(DeployError) as context:
+            deploy_cats(self.cats, self.manifest, {}, jobs=4)
+        self.assertEqual(
+            [out for out, _ in context.exception.failures],
+            [str(self.tmpdir / 'out2'), str(self.tmpdir / 'out5')])
+        self.assertEqual((self.tmpdir / 'out7').read_text(), '7: blue')
+
+    def test_deploy_records_manifest(self):
+        '''Deployed cats should be current in the saved manifest.'''
+        deploy_cats(self.cats, self.manifest, {}, jobs=4)
+        self.manifest.save({})
+        manifest = Manifest.load(self.tmpdir / 'manifest.json')
+        for cat in self.cats:
+            self.assertTrue(
+                manifest.is_current(cat, manifest.fingerprint(cat), {}))
+
+    def test_failed_fingerprint_releases_sources(self):
+        '''A cat failing before its sources are read should release them.'''
+        for cat in self.cats:
+            cat.add(Rule(self.tmpdir / 'src0', cat.out))
+        readers = []
+
+        def make_reader(src_strs):
+            readers.append(SourceReader(src_strs))
+            return readers[-1]
+
+        def fingerprint(cat, stats=None):
+            if cat is self.cats[1]:
+                raise OSError('unreadable')
+            return Manifest.fingerprint(self.manifest, cat, stats)
+        with patch('modot.deployer.pipeline.SourceReader',
+                   side_effect=make_reader), \
+                patch.object(self.manifest, 'fingerprint',
+                             side_effect=fingerprint):
+            with self.assertRaises(DeployError):
+                deploy_cats(self.cats, self.manifest, {}, jobs=4)
+        self.assertEqual(len(readers), 1)
+        # pylint: disable-next=protected-access
+        self.assertEqual(readers[0]._texts, {})
+
+    def test_deploy_parallel_shared_and_binary(self):
+        '''Shared, binary and stored sources should deploy in parallel.'''
+        binary = self.tmpdir / 'binary'
+        binary.write_bytes(b'\0{{color}}')
+        for idx, cat in enumerate(self.cats):
+            cat.add(Rule(binary if idx == 3 else self.tmpdir / 'src0',
+                         cat.out))
+        store = ObjectStore(self.tmpdir / 'store')
+        self.assertEqual(
+            deploy_cats(self.cats, self.manifest, {}, jobs=4, store=store), 8)
+        self.assertEqual((self.tmpdir / 'out3').read_bytes(),
+                         b'3: blue\n\0{{color}}')
+        for idx in (0, 1, 7):
+            self.assertEqual((self.tmpdir / f'out{idx}').read_text(),
+                             f'{idx}: blue\n0: blue')
+        self.assertEqual(
+            deploy_cats(self.cats, self.manifest, {}, jobs=4, store=store), 0)
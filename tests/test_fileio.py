@@ -0,0 +1,133 @@
+'''Test the atomic output file helpers.'''
+import errno
+import hashlib
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from modot.fileio import AtomicWriter, atomic_write, fsync_dirs, hash_file
+
+
+class TestAtomicWrite(unittest.TestCase):
+    '''Test replacing files atomically.'''
+    def setUp(self):
+        '''Set up a temp directory to write into.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+
+    def tearDown(self):
+        self.tmpdir_handle.cleanup()
+
+    def test_write_new_file(self):
+        '''Writing a new file should create it with the given mode.'''
+        atomic_write(self.tmpdir / 'out', 'content', 0o544)
+        self.assertEqual((self.tmpdir / 'out').read_text(), 'content')
+        self.assertEqual((self.tmpdir / 'out').stat().st_mode, 0o100544)
+
+    def test_replace_readonly_file(self):
+        '''Writing over a readonly file should replace it.'''
+        (self.tmpdir / 'out').write_text('old')
+        (self.tmpdir / 'out').chmod(0o444)
+        atomic_write(self.tmpdir / 'out', 'new', 0o444)
+        self.assertEqual((self.tmpdir / 'out').read_text(), 'new')
+
+    def test_failed_write_leaves_original(self):
+        '''A failure while writing should keep the original and no temp.'''
+        (self.tmpdir / 'out').write_text('old')
+        with patch('modot.fileio.os.replace', side_effect=OSError):
+            with self.assertRaises(OSError):
+                atomic_write(self.tmpdir / 'out', 'new', 0o444)
+        self.assertEqual((self.tmpdir / 'out').read_text(), 'old')
+        self.assertEqual(list(self.tmpdir.iterdir()), [self.tmpdir / 'out'])
+
+    def test_data_synced_before_replace(self):
+        '''The new contents should be synced before replacing the file.'''
+        (self.tmpdir / 'out').write_text('old')
+        synced = []
+        with patch('modot.fileio.os.fdatasync', create=True,
+                   side_effect=lambda fd: synced.append(
+                       (self.tmpdir / 'out').read_text())):
+            atomic_write(self.tmpdir / 'out', 'new', 0o644)
+        self.assertEqual(synced, ['old'])
+        self.assertEqual((self.tmpdir / 'out').read_text(), 'new')
+
+    def test_failed_sync_leaves_original(self):
+        '''A failure to sync should keep the original and no temp.'''
+        (self.tmpdir / 'out').write_text('old')
+        with patch('modot.fileio.os.fdatasync', create=True,
+                   side_effect=OSError):
+            with self.assertRaises(OSError):
+                atomic_write(self.tmpdir / 'out', 'new', 0o444)
+        self.assertEqual((self.tmpdir / 'out').read_text(), 'old')
+        self.assertEqual(list(self.tmpdir.iterdir()), [self.tmpdir / 'out'])
+
+    def test_symlinked_output_followed(self):
+        '''Writing through a symlink should replace its target, not it.'''
+        (self.tmpdir / 'target').write_text('old')
+        (self.tmpdir / 'out').symlink_to(self.tmpdir / 'target')
+        atomic_write(self.tmpdir / 'out', 'new', 0o444)
+        self.assertTrue((self.tmpdir / 'out').is_symlink())
+        self.assertEqual((self.tmpdir / 'target').read_text(), 'new')
+
+    def test_failed_chmod_leaves_no_temp(self):
+        '''A failure to set the mode should close and remove the temp.'''
+        with patch('modot.fileio.os.fchmod', side_effect=OSError), \
+                patch('modot.fileio.os.close',
+                      side_effect=os.close) as close:
+            with self.assertRaises(OSError):
+                atomic_write(self.tmpdir / 'out', 'new', 0o444)
+        close.assert_called_once()
+        self.assertEqual(list(self.tmpdir.iterdir()), [])
+
+    def test_fsync_dirs(self):
+        '''Syncing directories, including duplicates, should succeed.'''
+        fsync_dirs([self.tmpdir, self.tmpdir])
+
+
+class TestAtomicWriter(unittest.TestCase):
+    '''Test building replacements by writing and copying.'''
+    def setUp(self):
+        '''Set up a temp directory with a source to copy.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.src = self.tmpdir / 'src'
+        self.src.write_bytes(b'0123456789' * 20000)
+
+    def tearDown(self):
+        self.tmpdir_handle.cleanup()
+
+    def _write_and_copy(self):
+        with AtomicWriter(self.tmpdir / 'out', 0o444) as writer:
+            writer.write(b'head\n')
+            writer.copy_from(self.src)
+            writer.write(b'\ntail')
+            writer.commit()
+        self.assertEqual(writer.size, len(b'head\n\ntail') + 200000)
+        self.assertEqual((self.tmpdir / 'out').read_bytes(),
+                         b'head\n' + self.src.read_bytes() + b'\ntail')
+
+    def test_write_and_copy(self):
+        '''Written and copied parts should be appended in order.'''
+        self._write_and_copy()
+
+    def test_copy_fallbacks(self):
+        '''Unsupported kernel copies should fall back to read/write.'''
+        unsupported = OSError(errno.EXDEV, 'cross-device')
+        with patch('modot.fileio.os.copy_file_range', create=True,
+                   side_effect=unsupported), \
+                patch('modot.fileio.os.sendfile', side_effect=unsupported):
+            self._write_and_copy()
+
+    def test_exit_without_commit_discards(self):
+        '''Leaving the context without committing should leave no files.'''
+        with AtomicWriter(self.tmpdir / 'out', 0o444) as writer:
+            writer.write(b'partial')
+        self.assertEqual(list(self.tmpdir.iterdir()), [self.src])
+
+    def test_hash_file(self):
+        '''Hashing a file should match hashing its bytes at once.'''
+        self.assertEqual(hash_file(self.src, hashlib.blake2b),
+                         hashlib.blake2b(self.src.read_bytes()).digest())
+        self.assertIsNone(hash_file(self.tmpdir / 'dne', hashlib.blake2b))
@@ -0,0 +1,68 @@
+'''Test that the read-only commands stay cheap to start.'''
+import os
+from pathlib import Path
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+import unittest
+
+
+# Modules that only commands which parse config, render or deploy may import
+HEAVY_MODULES = ('yaml', 'chevron', 'json', 'difflib', 'concurrent',
+                 'multiprocessing', 'socket', 'socketserver', 'tempfile',
+                 'modot.deployer', 'modot.palette')
+
+
+def _imported_modules(code: str, home: Path) -> set:
+    '''Run code under -X importtime and return the modules it imported.'''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        env={**os.environ, 'HOME': str(home)},
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=False)
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            modules.add(line.rsplit('|', 1)[1].strip())
+    return modules
+
+
+class TestImportTime(unittest.TestCase):
+    '''Check with -X importtime that getters never import heavy modules.'''
+    def setUp(self):
+        '''Set up a home directory with a deployed theme and color.'''
+        self.home_handle = TemporaryDirectory()
+        self.home = Path(self.home_handle.name)
+        modot_path = self.home / '.local' / 'share' / 'modot'
+        modot_path.mkdir(parents=True)
+        for name in ('theme', 'color'):
+            (self.home / f'cool{name}.yaml').touch()
+            (modot_path / f'{name}.yaml').symlink_to(
+                self.home / f'cool{name}.yaml')
+
+    def tearDown(self):
+        '''Ensure the home directory is destroyed.'''
+        self.home_handle.cleanup()
+
+    def _assert_light(self, code: str):
+        '''Assert that running code imports the CLI but no heavy modules.'''
+        modules = _imported_modules(code, self.home)
+        self.assertIn('modot.cli', modules)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, modules)
+
+    def test_import_cli(self):
+        '''Importing the CLI should not import heavy modules.'''
+        self._assert_light('import modot.cli')
+
+    def test_theme_get(self):
+        '''theme get should not import heavy modules.'''
+        self._assert_light("from modot.cli import cli; cli(['theme', 'get'])")
+
+    def test_color_get(self):
+        '''color get should not import heavy modules.'''
+        self._assert_light("from modot.cli import cli; cli(['color', 'get'])")
+
+    def test_summary(self):
+        '''Running without a command should not import heavy modules.'''
+        self._assert_light('from modot.cli import cli; cli([])')
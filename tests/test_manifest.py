@@ -0,0 +1,116 @@
+'''Test the deploy manifest used to skip unchanged outputs.'''
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+from modot.cat import Cat
+from modot.manifest import Manifest, context_digests
+from modot.rule import Rule
+from modot.templater import FakeTemplater
+
+
+class TestManifest(unittest.TestCase):
+    '''Test recording, reloading and checking manifest entries.'''
+    def setUp(self):
+        '''Set up a deployed cat and a manifest recording it.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.srcfile = self.tmpdir / 'src'
+        self.outfile = self.tmpdir / 'out'
+        self.manifest_path = self.tmpdir / 'manifest.json'
+        self.srcfile.write_text('theme: {{theme}}')
+        self.context = context_digests({'theme': 'cooltheme', 'bg': 'blue'})
+        self.cat = Cat(FakeTemplater(
+            self.tmpdir, {'theme': 'cooltheme', 'bg': 'blue'}))
+        self.cat.rules = [Rule(self.srcfile, self.outfile)]
+        self._deploy_and_record()
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def _deploy_and_record(self):
+        manifest = Manifest.load(self.manifest_path)
+        sources = manifest.fingerprint(self.cat)
+        self.cat.deploy()
+        manifest.record(self.cat, sources)
+        manifest.save(self.context)
+
+    def _is_current(self, context=None) -> bool:
+        manifest = Manifest.load(self.manifest_path)
+        sources = manifest.fingerprint(self.cat)
+        return manifest.is_current(self.cat, sources, context or self.context)
+
+    def test_load_missing_is_empty(self):
+        '''Loading a manifest that does not exist should give no entries.'''
+        manifest = Manifest.load(self.tmpdir / 'dne.json')
+        self.assertEqual(manifest.entries, {})
+
+    def test_load_corrupt_is_empty(self):
+        '''Loading an unparseable manifest should give no entries.'''
+        self.manifest_path.write_text('{not json')
+        manifest = Manifest.load(self.manifest_path)
+        self.assertEqual(manifest.entries, {})
+
+    def test_unchanged_is_current(self):
+        '''A cat with unchanged sources, context and output is current.'''
+        self.assertTrue(self._is_current())
+
+    def test_source_changed_not_current(self):
+        '''Changing a source's content should invalidate the entry.'''
+        self.srcfile.write_text('theme: {{theme}} changed')
+        self.assertFalse(self._is_current())
+
+    def test_source_touched_is_current(self):
+        '''Touching a source without changing its content is still current.'''
+        src_stat = self.srcfile.stat()
+        os.utime(self.srcfile, ns=(src_stat.st_atime_ns,
+                                   src_stat.st_mtime_ns + 10**9))
+        self.assertTrue(self._is_current())
+
+    def test_referenced_key_changed_not_current(self):
+        '''Changing a referenced context value should invalidate the entry.'''
+        self.assertFalse(self._is_current(
+            context_digests({'theme': 'othertheme', 'bg': 'blue'})))
+
+    def test_unreferenced_key_changed_is_current(self):
+        '''Changing a context value no source references is still current.'''
+        self.assertTrue(self._is_current(
+            context_digests({'theme': 'cooltheme', 'bg': 'red'})))
+
+    def test_opaque_source_context_changed_not_current(self):
+        '''A source that may read any key is invalidated by any change.'''
+        self.srcfile.write_text('{{> partial}}')
+        self._deploy_and_record()
+        self.assertTrue(self._is_current())
+        self.assertFalse(self._is_current(
+            context_digests({'theme': 'cooltheme', 'bg': 'red'})))
+
+    def test_fingerprint_records_keys(self):
+        '''The fingerprint should index the keys each source references.'''
+        self.srcfile.write_text('{{#colors}}{{bg}}{{/colors}} {{font.name}}')
+        manifest = Manifest.load(self.manifest_path)
+        self.assertEqual(manifest.fingerprint(self.cat)[0][4],
+                         ['bg', 'colors', 'font'])
+
+    def test_output_removed_not_current(self):
+        '''Removing the output should invalidate the entry.'''
+        self.outfile.unlink()
+        self.assertFalse(self._is_current())
+
+    def test_output_mode_changed_not_current(self):
+        '''Changing the output permissions should invalidate the entry.'''
+        self.outfile.chmod(0o644)
+        self.assertFalse(self._is_current())
+
+    def test_force_rewrite_not_current(self):
+        '''A cat with force_rewrite set is never current.'''
+        self.cat.rules = [Rule(self.srcfile, self.outfile, force_rewrite=True)]
+        self.assertFalse(self._is_current())
+
+    def test_save_drops_unseen_entries(self):
+        '''Saving should only keep entries recorded or kept in this run.'''
+        manifest = Manifest.load(self.manifest_path)
+        manifest.save(self.context)
+        self.assertFalse(self._is_current())
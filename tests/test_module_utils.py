@@ -137,11 +137,13 @@ class TestModuleUtils(unittest.TestCase):
                                    '  out: ~/outfile\n'
                                    '  final: true\n'
                                    '  exec: true\n'
-                                   '  force_rewrite: true')
+                                   '  force_rewrite: true\n'
+                                   '  raw: true')
         rules = get_rules(module_path)
         self.assertEqual(rules, [
             Rule(module_path/'infile1.txt', Path('/fakehome/outfile'),
-                 final=True, executable=True, force_rewrite=True)])
+                 final=True, executable=True, force_rewrite=True,
+                 raw=True)])
 
     def test_get_rules_dir_contents(self):
         '''dir_contents flag should produce rules for all files in a subdir.'''
@@ -185,3 +187,40 @@ class TestModuleUtils(unittest.TestCase):
                                    '  dir_contents: true')
         with self.assertRaises(NotADirectoryError):
             get_rules(module_path)
+
+    def test_get_rules_dir_contents_recursive_filtered(self):
+        '''Recursive dir_contents should walk subdirs through the globs.'''
+        module_path = self.root / 'mod1'
+        tree_path = module_path / 'tree'
+        (tree_path / 'lua' / 'plugins').mkdir(parents=True)
+        (tree_path / '.git').mkdir()
+        for rel in ('init.lua', 'README.md', 'lua/opts.lua',
+                    'lua/plugins/a.lua', '.git/HEAD'):
+            (tree_path / rel).touch()
+        (module_path / 'module.yaml').write_text(
+            'tree:\n'
+            '  out: /outdir\n'
+            '  dir_contents: true\n'
+            '  recursive: true\n'
+            '  include: ["*.lua"]\n'
+            '  exclude: [".git", "lua/plugins/*"]')
+        deps = []
+        rules = get_rules(module_path, deps)
+        self.assertCountEqual(rules, [
+            Rule(tree_path/'init.lua', Path('/outdir/init.lua')),
+            Rule(tree_path/'lua'/'opts.lua', Path('/outdir/lua/opts.lua'))])
+        self.assertCountEqual(deps, [
+            module_path/'module.yaml', tree_path, tree_path/'lua',
+            tree_path/'lua'/'plugins'])
+
+    def test_get_rules_mirror(self):
+        '''A mirror entry should give one rule for the whole directory.'''
+        module_path = self.root / 'mod1'
+        (module_path / 'tree' / 'sub').mkdir(parents=True)
+        (module_path / 'tree' / 'sub' / 'file').touch()
+        (module_path / 'module.yaml').write_text(
+            'tree:\n'
+            '  out: /outdir\n'
+            '  mirror: true')
+        self.assertEqual(get_rules(module_path), [
+            Rule(module_path/'tree', Path('/outdir'), mirror=True)])
@@ -0,0 +1,72 @@
+'''Test the content-addressed store of rendered outputs.'''
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from modot.object_store import ObjectStore
+
+
+class TestObjectStore(unittest.TestCase):
+    '''Test storing, placing and pruning objects.'''
+    def setUp(self):
+        '''Set up an empty store and an output directory.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.store = ObjectStore(self.tmpdir / 'store')
+        self.outfile = self.tmpdir / 'out'
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def test_put_dedups(self):
+        '''Identical data with the same mode should be stored once.'''
+        key = self.store.put(b'content', 0o444)
+        self.assertEqual(self.store.put(b'content', 0o444), key)
+        self.assertNotEqual(self.store.put(b'content', 0o544), key)
+        self.assertEqual(self.store.object_path(key).read_bytes(), b'content')
+        self.assertEqual(self.store.object_path(key).stat().st_mode,
+                         0o100444)
+
+    def test_place_links(self):
+        '''Placing should hardlink the object over the output.'''
+        self.outfile.write_text('old')
+        key = self.store.put(b'content', 0o444)
+        self.assertTrue(self.store.place(key, self.outfile))
+        self.assertTrue(self.outfile.samefile(self.store.object_path(key)))
+        self.assertFalse(self.store.place(key, self.outfile))
+        self.assertTrue(self.store.place(key, self.outfile, force=True))
+
+    def test_place_copies_without_links(self):
+        '''Without hardlinks, placing should copy with the object's mode.'''
+        key = self.store.put(b'content', 0o544)
+        with patch('modot.object_store.atomic_link', return_value=False):
+            self.assertTrue(self.store.place(key, self.outfile))
+        self.assertFalse(self.outfile.samefile(self.store.object_path(key)))
+        self.assertEqual(self.outfile.read_bytes(), b'content')
+        self.assertEqual(self.outfile.stat().st_mode, 0o100544)
+
+    def test_place_matching_copy_kept(self):
+        '''A copy with the object's content should only have its mode fixed.'''
+        key = self.store.put(b'content', 0o444)
+        self.outfile.write_bytes(b'content')
+        self.outfile.chmod(0o644)
+        self.assertFalse(self.store.place(key, self.outfile))
+        self.assertFalse(self.outfile.samefile(self.store.object_path(key)))
+        self.assertEqual(self.outfile.stat().st_mode, 0o100444)
+
+    def test_prune(self):
+        '''Pruning should remove only objects that aren't kept.'''
+        keep = self.store.put(b'keep', 0o444)
+        drop = self.store.put(b'drop', 0o444)
+        self.assertEqual(self.store.prune([keep]), 1)
+        self.assertTrue(self.store.object_path(keep).exists())
+        self.assertFalse(self.store.object_path(drop).exists())
+
+    def test_prune_keeps_linked(self):
+        '''Objects still linked to by an output should survive pruning.'''
+        key = self.store.put(b'linked', 0o444)
+        self.store.place(key, self.outfile)
+        self.assertEqual(self.store.prune([]), 0)
+        self.assertTrue(self.store.object_path(key).exists())
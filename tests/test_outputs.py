@@ -0,0 +1,91 @@
+'''Test recording deployed outputs and cleaning stale ones.'''
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import Mock
+
+from modot import outputs
+from modot.cat import Cat
+from modot.rule import Rule
+from modot.templater import Templater
+
+
+class TestOutputs(unittest.TestCase):
+    '''Test the recorded output set.'''
+    def setUp(self):
+        '''Set up a tempdir with three deployed outputs.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.state_path = self.tmpdir / outputs.OUTPUTS_FILENAME
+        for name in ('a', 'b', 'c'):
+            (self.tmpdir / name).write_text(name)
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def _cats(self, *names):
+        cats = []
+        for name in names:
+            cat = Cat(Mock(spec=Templater))
+            cat.add(Rule(self.tmpdir / 'src', self.tmpdir / name))
+            cats.append(cat)
+        return cats
+
+    def test_record_accumulates(self):
+        '''Outputs should stay recorded until cleaned.'''
+        outputs.record(self.state_path, self._cats('a', 'b'))
+        outputs.record(self.state_path, self._cats('a', 'c'))
+        self.assertEqual(set(outputs.load(self.state_path)),
+                         {str(self.tmpdir / name) for name in 'abc'})
+        self.assertEqual(outputs.stale(self.state_path, self._cats('a')),
+                         [str(self.tmpdir / 'b'), str(self.tmpdir / 'c')])
+
+    def test_record_skips_failures(self):
+        '''Outputs that failed to deploy should not be recorded.'''
+        outputs.record(self.state_path, self._cats('a', 'b'),
+                       [str(self.tmpdir / 'b')])
+        self.assertEqual(set(outputs.load(self.state_path)),
+                         {str(self.tmpdir / 'a')})
+
+    def test_clean_removes_stale(self):
+        '''Only outputs no cat produces should be removed.'''
+        outputs.record(self.state_path, self._cats('a', 'b', 'c'))
+        (self.tmpdir / 'c').unlink()
+        self.assertEqual(outputs.clean(self.state_path, self._cats('a')),
+                         ([str(self.tmpdir / 'b')], []))
+        self.assertTrue((self.tmpdir / 'a').exists())
+        self.assertFalse((self.tmpdir / 'b').exists())
+        self.assertEqual(set(outputs.load(self.state_path)),
+                         {str(self.tmpdir / 'a')})
+
+    def test_clean_keeps_changed(self):
+        '''Stale outputs changed or replaced since should be left alone.'''
+        outputs.record(self.state_path, self._cats('a', 'b', 'c'))
+        (self.tmpdir / 'a').write_text('edited by the user')
+        (self.tmpdir / 'b').unlink()
+        (self.tmpdir / 'b').write_text('b')
+        os.utime(self.tmpdir / 'b', ns=(0, 0))
+        self.assertEqual(
+            outputs.clean(self.state_path, []),
+            ([str(self.tmpdir / 'c')],
+             [str(self.tmpdir / 'a'), str(self.tmpdir / 'b')]))
+        self.assertEqual((self.tmpdir / 'a').read_text(),
+                         'edited by the user')
+        self.assertEqual((self.tmpdir / 'b').read_text(), 'b')
+        self.assertFalse((self.tmpdir / 'c').exists())
+        self.assertEqual(outputs.load(self.state_path), {})
+
+    def test_clean_keeps_directories(self):
+        '''A stale directory should be left and stay recorded.'''
+        (self.tmpdir / 'tree').mkdir()
+        outputs.record(self.state_path, self._cats('tree'))
+        self.assertEqual(outputs.clean(self.state_path, []), ([], []))
+        self.assertTrue((self.tmpdir / 'tree').is_dir())
+        self.assertEqual(outputs.stale(self.state_path, []),
+                         [str(self.tmpdir / 'tree')])
+
+    def test_load_missing_is_empty(self):
+        '''With no state file, nothing is recorded.'''
+        self.assertEqual(outputs.load(self.state_path), {})
@@ -0,0 +1,73 @@
+'''Test deriving palette colors and their formats.'''
+import unittest
+
+from modot import palette
+from modot.palette import PaletteError
+
+
+class TestPalette(unittest.TestCase):
+    '''Test resolving and expanding palettes.'''
+    def _hex(self, spec, **colors):
+        colors['t'] = spec
+        return palette.formats(palette.resolve(colors)['t'])['hexa']
+
+    def test_literals(self):
+        '''Every literal form should parse to the same color.'''
+        for literal in ('#ff0000', '#f00', '#f00f', '#ff0000ff',
+                        '0xffff0000', 'rgb(255, 0, 0)',
+                        'rgba(255, 0, 0, 1)'):
+            self.assertEqual(self._hex(literal), '#ff0000ff', literal)
+
+    def test_derived(self):
+        '''Derived colors should follow their functions.'''
+        self.assertEqual(self._hex('lighten(bg, 10%)', bg='#282828'),
+                         '#424242ff')
+        self.assertEqual(self._hex('darken(bg, 0.1)', bg='#5c5c5c'),
+                         '#424242ff')
+        self.assertEqual(self._hex('mix(bg, fg)', bg='#000', fg='#fff'),
+                         '#808080ff')
+        self.assertEqual(self._hex('mix(bg, fg, 25%)', bg='#000',
+                                   fg='#ffffff00'), '#404040bf')
+        self.assertEqual(self._hex('alpha(bg, 80%)', bg='#000'),
+                         '#000000cc')
+        self.assertEqual(self._hex('lighten(bg, 100%)', bg='#123'),
+                         '#ffffffff')
+
+    def test_nested_and_out_of_order(self):
+        '''Expressions should nest and refer to colors defined later.'''
+        colors = palette.resolve({'a': 'alpha(mix(b, c), 50%)',
+                                  'b': 'darken(c, 100%)', 'c': '#fff'})
+        self.assertEqual(palette.formats(colors['a'])['hexa'], '#80808080')
+
+    def test_formats(self):
+        '''A color should expand to each of its formats.'''
+        context = palette.expand(
+            {'palette_exprs': {'red': 'alpha(#cc241d, 0.5)'}, 'other': 1})
+        self.assertEqual(context, {'other': 1, 'palette': {'red': {
+            'hex': '#cc241d',
+            'hexa': '#cc241d80',
+            'rgb': 'rgb(204, 36, 29)',
+            'rgba': 'rgba(204, 36, 29, 0.5)',
+            'argb': '0x80cc241d',
+        }}})
+        self.assertEqual(palette.expand({'a': 1}), {'a': 1})
+
+    def test_plain_palette_untouched(self):
+        '''A palette key of the user's own should be left alone.'''
+        context = {'palette': {'bg': '#000', 'size': 3}}
+        self.assertEqual(palette.expand(context),
+                         {'palette': {'bg': '#000', 'size': 3}})
+        with self.assertRaises(PaletteError):
+            palette.expand({'palette': {}, 'palette_exprs': {'bg': '#000'}})
+
+    def test_errors(self):
+        '''Malformed or unresolvable colors should raise PaletteError.'''
+        for spec in ('#12', '#12345', '#1234567', '#12g', '0x123',
+                     'lighten(bg)', 'lighten(bg, 2)', 'blend(bg, bg)',
+                     'mix(bg, nope)', 'alpha(bg, 50%', 'bg bg', '50%',
+                     'rgb(0, 0, 300)', 'loop', '$bg'):
+            with self.assertRaises(PaletteError, msg=spec):
+                palette.resolve({'bg': '#000', 'loop': 'lighten(t, 1%)',
+                                 't': spec})
+        with self.assertRaises(PaletteError):
+            palette.resolve({'bg': 0})
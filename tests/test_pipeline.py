@@ -0,0 +1,92 @@
+'''Test running items through pipeline stages.'''
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from modot import pipeline
+from modot.pipeline import Finished, SourceReader
+
+
+class TestRun(unittest.TestCase):
+    '''Test the staged runner.'''
+    def test_outcomes_in_order(self):
+        '''Outcomes should follow the items, however stages interleave.'''
+        def slow_double(value):
+            time.sleep(0.001 * (value % 3))
+            return value * 2
+        outcomes = pipeline.run(range(20), [(slow_double, 3),
+                                            (lambda value: value + 1, 2)])
+        self.assertEqual(outcomes, [idx * 2 + 1 for idx in range(20)])
+
+    def test_finished_and_errors(self):
+        '''Finished should skip later stages and errors become outcomes.'''
+        def first(value):
+            if value == 1:
+                raise ValueError(value)
+            return Finished('done') if value == 2 else value
+        outcomes = pipeline.run([0, 1, 2], [(first, 2), (str, 1)])
+        self.assertEqual(outcomes[0], '0')
+        self.assertIsInstance(outcomes[1], ValueError)
+        self.assertEqual(outcomes[2], 'done')
+        self.assertEqual(pipeline.run([], [(str, 2)]), [])
+
+    def test_backpressure(self):
+        '''A fast stage should not run far ahead of a slow one.'''
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def produce(value):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            return value
+
+        def consume(value):
+            time.sleep(0.001)
+            with lock:
+                in_flight[0] -= 1
+            return value
+        pipeline.run(range(50), [(produce, 2), (consume, 1)], depth=2)
+        # Two queued, one being consumed and one blocked per producer
+        self.assertLessEqual(in_flight[1], 5)
+
+
+class TestSourceReader(unittest.TestCase):
+    '''Test reading shared sources.'''
+    def setUp(self):
+        '''Write a text and a binary source.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.text = str(self.tmpdir / 'text')
+        self.binary = str(self.tmpdir / 'binary')
+        Path(self.text).write_bytes(b'a\r\nb')
+        Path(self.binary).write_bytes(b'\0\1')
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def test_read_once(self):
+        '''A source should be read once for all its uses, then dropped.'''
+        reader = SourceReader([self.text] * 3 + [self.binary])
+        with patch.object(Path, 'read_bytes', autospec=True,
+                          side_effect=Path.read_bytes) as read_bytes:
+            self.assertEqual(reader.read(self.text), 'a\nb')
+            reader.skip(self.text)
+            self.assertEqual(reader.read(self.text), 'a\nb')
+            self.assertIsNone(reader.read(self.binary))
+            self.assertEqual(read_bytes.call_count, 2)
+            # Every use has been taken, so another read goes to disk
+            reader.read(self.text)
+            self.assertEqual(read_bytes.call_count, 3)
+
+    def test_error_shared(self):
+        '''A failed read should raise for every use.'''
+        missing = str(self.tmpdir / 'dne')
+        reader = SourceReader([missing] * 2)
+        for _ in range(2):
+            with self.assertRaises(FileNotFoundError):
+                reader.read(missing)
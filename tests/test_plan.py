@@ -0,0 +1,114 @@
+'''Test planning deploys and applying saved plans.'''
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from modot import outputs, plan
+from modot.cat import Cat
+from modot.deployer import deploy_all
+from modot.object_store import ObjectStore
+from modot.plan import PlannedCat
+from modot.rule import Rule
+from modot.templater import FakeTemplater
+
+
+class TestPlan(unittest.TestCase):
+    '''Test plans of a small deployed set of cats.'''
+    def setUp(self):
+        '''Deploy three cats, then change one source and add a cat.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.templater = FakeTemplater(self.tmpdir, {'color': 'blue'})
+        self.manifest_path = self.tmpdir / 'manifest.json'
+        self.store = ObjectStore(self.tmpdir / 'store')
+        for name in ('kept', 'changed', 'gone', 'new'):
+            (self.tmpdir / f'{name}.src').write_text(f'{name}: {{{{color}}}}')
+        self.outputs_path = self.tmpdir / outputs.OUTPUTS_FILENAME
+        self._deploy('kept', 'changed', 'gone')
+        (self.tmpdir / 'changed.src').write_text('changed: red')
+        self.cats = self._cats('kept', 'changed', 'new')
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def _deploy(self, *names):
+        '''Deploy the named cats and record their outputs.'''
+        cats = self._cats(*names)
+        deploy_all(cats, self.templater, self.manifest_path, jobs=1)
+        outputs.record(self.outputs_path, cats)
+
+    def _cats(self, *names):
+        cats = []
+        for name in names:
+            cat = Cat(self.templater)
+            cat.add(Rule(self.tmpdir / f'{name}.src',
+                         self.tmpdir / f'{name}.out'))
+            cats.append(cat)
+        return cats
+
+    def _plan(self, **kwargs):
+        return plan.make_plan(self.cats, self.templater, self.manifest_path,
+                              self.outputs_path, self.store, **kwargs)
+
+    def test_statuses(self):
+        '''Each output should be reported with what a deploy would do.'''
+        deploy_plan = self._plan(jobs=2)
+        self.assertEqual(
+            {out: entry.status for out, entry in deploy_plan.entries.items()},
+            {str(self.tmpdir / 'kept.out'): plan.UNCHANGED,
+             str(self.tmpdir / 'changed.out'): plan.MODIFIED,
+             str(self.tmpdir / 'new.out'): plan.CREATED,
+             str(self.tmpdir / 'gone.out'): plan.ORPHANED})
+        self.assertEqual((self.tmpdir / 'changed.out').read_text(),
+                         'changed: blue')
+        self.assertFalse((self.tmpdir / 'new.out').exists())
+
+    def test_orphan_reported_after_redeploy(self):
+        '''An orphan should stay reported until it is cleaned.'''
+        self._deploy('kept', 'changed')
+        self._deploy('kept', 'changed')
+        self.assertEqual(
+            self._plan().entries[str(self.tmpdir / 'gone.out')].status,
+            plan.ORPHANED)
+        outputs.clean(self.outputs_path, self.cats)
+        self.assertNotIn(str(self.tmpdir / 'gone.out'),
+                         self._plan().entries)
+
+    def test_diff(self):
+        '''A modified output should get a unified diff.'''
+        entry = self._plan(diff=True).entries[
+            str(self.tmpdir / 'changed.out')]
+        self.assertIn('-changed: blue\n+changed: red\n', entry.diff)
+
+    def test_save_load(self):
+        '''A saved plan should load back without its diffs.'''
+        deploy_plan = self._plan(diff=True)
+        deploy_plan.save(self.tmpdir / 'plan.json')
+        loaded = plan.Plan.load(self.tmpdir / 'plan.json')
+        self.assertEqual(loaded.counts(), deploy_plan.counts())
+        self.assertEqual(loaded.keys(), deploy_plan.keys())
+        self.assertIsNone(plan.Plan.load(self.tmpdir / 'dne.json'))
+
+    def test_apply_without_rendering(self):
+        '''Planned cats should be deployed from the stored renders.'''
+        cats = plan.planned_cats(self._plan(), self.cats, self.templater,
+                                 self.store)
+        self.assertEqual([isinstance(cat, PlannedCat) for cat in cats],
+                         [False, True, True])
+        with patch.object(FakeTemplater, 'template') as template:
+            self.assertEqual(deploy_all(cats, self.templater,
+                                        self.manifest_path, jobs=1), 2)
+        template.assert_not_called()
+        self.assertEqual((self.tmpdir / 'new.out').read_text(),
+                         'new: blue')
+        self.assertEqual((self.tmpdir / 'new.out').stat().st_mode, 0o100444)
+
+    def test_stale_source_rendered(self):
+        '''A cat whose source changed since planning should not use it.'''
+        deploy_plan = self._plan()
+        (self.tmpdir / 'new.src').write_text('newer: {{color}}')
+        cats = plan.planned_cats(deploy_plan, self.cats, self.templater,
+                                 self.store)
+        self.assertNotIsInstance(cats[2], PlannedCat)
@@ -0,0 +1,122 @@
+'''Test switching theme/color through prerendered outputs.'''
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from modot import deployer
+from modot.hostconfig import HostConfig
+from modot.object_store import ObjectStore
+from modot.prerender import deploy_prerendered, prerender
+from modot.rule import Rule
+from modot.template_cache import TemplateCache
+from modot.templater import Templater
+
+
+class TestPrerender(unittest.TestCase):
+    '''Test prerendering every combination and deploying from it.'''
+    def setUp(self):
+        '''Set up themes, colors, a templated and a plain source.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        (self.tmpdir / 'themes').mkdir()
+        (self.tmpdir / 'colors').mkdir()
+        for theme_name, color_name in (('t1', 'c1'), ('t2', 'c2')):
+            (self.tmpdir / 'themes' / f'{theme_name}.yaml').write_text(
+                f'font: {theme_name}')
+            (self.tmpdir / 'colors' / f'{color_name}.yaml').write_text(
+                f'bg: {color_name}')
+        (self.tmpdir / 'modot').mkdir()
+        (self.tmpdir / 'out').mkdir()
+        self.templated = self.tmpdir / 'templated'
+        self.templated.write_text('font={{font}} bg={{bg}}')
+        (self.tmpdir / 'plain').write_text('plain')
+        self.templater = Templater(self.tmpdir / 'modot', HostConfig(
+            self.tmpdir / 'themes', self.tmpdir / 'colors'))
+        self.templater.set_theme('t1')
+        self.templater.set_color('c1')
+        self.cats = list(deployer.build_cats([[
+            Rule(self.templated, self.tmpdir / 'out' / 'a'),
+            Rule(self.tmpdir / 'plain', self.tmpdir / 'out' / 'b')]],
+            self.templater).values())
+        self.store = ObjectStore(self.tmpdir / 'modot' / 'store')
+        self.index_path = self.tmpdir / 'modot' / 'prerender.json'
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def _deploy(self) -> bool:
+        return deploy_prerendered(
+            self.cats, self.templater, self.store, self.index_path,
+            self.index_path.with_name('manifest.json'))
+
+    def test_prerender_dedups(self):
+        '''Every combination is rendered, identical outputs stored once.'''
+        self.assertEqual(prerender(self.cats, self.templater, self.store,
+                                   self.index_path), 8)
+        objects = list((self.store.path / 'objects').glob('*/*'))
+        self.assertEqual(len(objects), 5)
+
+    def test_template_cache_pruned(self):
+        '''Templates parsed while prerendering should be stored and pruned.'''
+        with patch.object(TemplateCache, 'prune', autospec=True) as prune:
+            prerender(self.cats, self.templater, self.store,
+                      self.index_path)
+        prune.assert_called_once_with(self.templater.template_cache)
+        self.assertTrue(self.templater.template_cache.cache_path.is_dir())
+
+    def test_switch_links_prerendered(self):
+        '''Switching color should link in the prebuilt render.'''
+        prerender(self.cats, self.templater, self.store, self.index_path)
+        self.templater.set_color('c2')
+        self.assertTrue(self._deploy())
+        self.assertEqual((self.tmpdir / 'out' / 'a').read_text(),
+                         'font=t1 bg=c2')
+        self.assertEqual((self.tmpdir / 'out' / 'b').read_text(), 'plain')
+        self.assertEqual((self.tmpdir / 'out' / 'a').stat().st_nlink, 2)
+
+    def test_deploy_updates_manifest(self):
+        '''After a prerendered switch, a normal deploy should skip all cats.'''
+        prerender(self.cats, self.templater, self.store, self.index_path)
+        self.assertTrue(self._deploy())
+        inode = (self.tmpdir / 'out' / 'a').stat().st_ino
+        deployer.deploy_all(self.cats, self.templater,
+                            self.index_path.with_name('manifest.json'))
+        self.assertEqual((self.tmpdir / 'out' / 'a').stat().st_ino, inode)
+
+    def test_source_changed_falls_back(self):
+        '''A source changed since prerendering should make the index stale.'''
+        prerender(self.cats, self.templater, self.store, self.index_path)
+        self.templated.write_text('font={{font}} changed')
+        self.assertFalse(self._deploy())
+        self.assertFalse((self.tmpdir / 'out' / 'a').exists())
+
+    def test_override_changed_falls_back(self):
+        '''Host context overrides changed since prerendering should too.'''
+        self.templater.host_cfg.context = {'bg': 'one'}
+        prerender(self.cats, self.templater, self.store, self.index_path)
+        self.templater.host_cfg.context = {'bg': 'two'}
+        self.templater.invalidate()
+        self.templater.set_color('c2')
+        self.assertFalse(self._deploy())
+        self.assertFalse((self.tmpdir / 'out' / 'a').exists())
+
+    def test_no_index_falls_back(self):
+        '''Without an index nothing should be deployed.'''
+        self.assertFalse(self._deploy())
+
+    def test_raw_cats_deployed(self):
+        '''Cats left out of the index should be deployed and recorded.'''
+        self.cats += deployer.build_cats([[
+            Rule(self.templated, self.tmpdir / 'out' / 'raw', raw=True)]],
+            self.templater).values()
+        prerender(self.cats, self.templater, self.store, self.index_path)
+        self.assertTrue(self._deploy())
+        raw_path = self.tmpdir / 'out' / 'raw'
+        self.assertEqual(raw_path.read_text(), 'font={{font}} bg={{bg}}')
+        inode = raw_path.stat().st_ino
+        self.assertEqual(deployer.deploy_all(
+            self.cats, self.templater,
+            self.index_path.with_name('manifest.json')), 0)
+        self.assertEqual(raw_path.stat().st_ino, inode)
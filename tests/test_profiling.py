@@ -0,0 +1,98 @@
+'''Test the optional timing and counting instrumentation.'''
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+from modot import profiling
+from modot.cat import Cat
+from modot.deployer import deploy_all
+from modot.rule import Rule
+from modot.templater import FakeTemplater
+
+
+@profiling.timed('square')
+def _square(value):
+    return value * value
+
+
+@profiling.timed('count_up')
+def _count_up(limit):
+    yield from range(limit)
+    return limit
+
+
+class TestProfiling(unittest.TestCase):
+    '''Test recording phases and counters.'''
+    def tearDown(self):
+        '''Ensure no profile outlives a test.'''
+        profiling.disable()
+
+    def test_disabled_records_nothing(self):
+        '''Instrumented calls should still work with profiling disabled.'''
+        self.assertEqual(_square(3), 9)
+        self.assertEqual(list(_count_up(3)), [0, 1, 2])
+        profiling.count('ignored')
+        profile = profiling.enable()
+        self.assertEqual(profile.to_dict(),
+                         {'phases': {}, 'counters': {}, 'cats': {}})
+
+    def test_timed_function(self):
+        '''Each call of a timed function should be recorded.'''
+        profile = profiling.enable()
+        _square(2)
+        _square(3)
+        self.assertEqual(profile.to_dict()['phases']['square']['calls'], 2)
+
+    def test_timed_generator(self):
+        '''A timed generator should be recorded once it is exhausted.'''
+        profile = profiling.enable()
+        generator = _count_up(3)
+        self.assertNotIn('count_up', profile.phases)
+        self.assertEqual(list(generator), [0, 1, 2])
+        self.assertEqual(profile.phases['count_up'][0], 1)
+
+    def test_count(self):
+        '''Counts should accumulate by name.'''
+        profile = profiling.enable()
+        profiling.count('things')
+        profiling.count('things', 4)
+        self.assertEqual(profile.counters, {'things': 5})
+
+    def test_cat_deploy_recorded(self):
+        '''Deploying a cat should record its time, bytes and render.'''
+        with TemporaryDirectory() as tmpdir_name:
+            tmpdir = Path(tmpdir_name)
+            (tmpdir / 'src').write_text('theme: {{theme}}')
+            cat = Cat(FakeTemplater(tmpdir, {'theme': 'cooltheme'}))
+            cat.rules = [Rule(tmpdir / 'src', tmpdir / 'out')]
+            profile = profiling.enable()
+            cat.deploy()
+            cat.deploy()
+        report = json.loads(json.dumps(profile.to_dict()))
+        self.assertEqual(report['phases']['Cat.deploy']['calls'], 2)
+        self.assertEqual(list(report['cats']), [str(tmpdir / 'out')])
+        self.assertEqual(report['counters'], {
+            'bytes_read': 32, 'bytes_written': 16, 'outputs_written': 1,
+            'outputs_unchanged': 1, 'renders_cached': 1,
+            'templates_rendered': 1})
+        self.assertIn(str(tmpdir / 'out'), profile.summary())
+
+    def test_deploy_all_recorded(self):
+        '''Cats deployed by deploy_all should be recorded, not fail.'''
+        with TemporaryDirectory() as tmpdir_name:
+            tmpdir = Path(tmpdir_name)
+            templater = FakeTemplater(tmpdir, {'theme': 'cooltheme'})
+            cats = []
+            for idx in range(3):
+                (tmpdir / f'src{idx}').write_text(f'{idx}: {{{{theme}}}}')
+                cat = Cat(templater)
+                cat.rules = [Rule(tmpdir / f'src{idx}', tmpdir / f'out{idx}')]
+                cats.append(cat)
+            profile = profiling.enable()
+            self.assertEqual(
+                deploy_all(cats, templater, tmpdir / 'manifest.json',
+                           jobs=1), 3)
+        self.assertEqual(profile.phases['Cat.deploy'][0], 3)
+        self.assertEqual(sorted(profile.cats),
+                         [str(tmpdir / f'out{idx}') for idx in range(3)])
@@ -0,0 +1,93 @@
+'''Test caching source texts and renders.'''
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from modot.cat import Cat
+from modot.render_cache import LRUCache, RenderCache
+from modot.rule import Rule
+from modot.templater import FakeTemplater
+
+
+class TestLRUCache(unittest.TestCase):
+    '''Test the size-bounded LRU cache.'''
+    def test_evicts_least_recently_used(self):
+        '''Entries past the size bound should go oldest first.'''
+        cache = LRUCache(10)
+        cache.put('a', 'a', 4)
+        cache.put('b', 'b', 4)
+        cache.get('a')
+        cache.put('c', 'c', 4)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')),
+                         ('a', None, 'c'))
+        self.assertEqual(cache.size, 8)
+        cache.put('a', 'A', 2)
+        self.assertEqual((cache.get('a'), cache.size), ('A', 6))
+
+    def test_oversized_not_kept(self):
+        '''An entry larger than the bound should not be cached.'''
+        cache = LRUCache(10)
+        cache.put('a', 'a', 4)
+        cache.put('big', 'big', 11)
+        self.assertEqual((cache.get('a'), cache.get('big')), ('a', None))
+
+
+class TestRenderCache(unittest.TestCase):
+    '''Test the source and render caches.'''
+    def setUp(self):
+        '''Write a templated source.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        self.src = self.tmpdir / 'src'
+        self.src.write_text('color: {{color}}')
+        self.cache = RenderCache()
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def test_read_shared_by_links(self):
+        '''Every path to the same unchanged file should share one read.'''
+        (self.tmpdir / 'link').symlink_to(self.src)
+        with patch.object(Path, 'read_text', autospec=True,
+                          side_effect=Path.read_text) as read_text:
+            text, digest = self.cache.read(self.src)
+            self.assertEqual(self.cache.read(self.tmpdir / 'link'),
+                             (text, digest))
+            self.assertEqual(read_text.call_count, 1)
+            self.src.write_text('changed')
+            os.utime(self.src, ns=(1, 1))
+            self.assertEqual(self.cache.read(self.src)[0], 'changed')
+            self.assertEqual(read_text.call_count, 2)
+
+    def test_render_per_context(self):
+        '''A render should be reused only for the same text and context.'''
+        renders = []
+
+        def template(text):
+            renders.append(text)
+            return text.upper()
+        text = '{{color}}'
+        self.assertEqual(self.cache.render(text, b'ctx', template),
+                         '{{COLOR}}')
+        self.cache.render(text, b'ctx', template)
+        self.cache.render(text, b'other', template)
+        self.cache.render('plain', b'ctx', template)
+        self.cache.render('plain', b'ctx', template)
+        self.assertEqual(renders, [text, text, 'plain', 'plain'])
+
+    def test_shared_source_rendered_once(self):
+        '''Cats sharing a source should render it once between them.'''
+        templater = FakeTemplater(self.tmpdir, {'color': 'blue'})
+        cats = []
+        for idx in range(3):
+            cat = Cat(templater)
+            cat.add(Rule(self.src, self.tmpdir / f'out{idx}'))
+            cats.append(cat)
+        with patch.object(FakeTemplater, 'template', autospec=True,
+                          return_value='color: blue') as template:
+            self.assertEqual([cat.render() for cat in cats],
+                             ['color: blue'] * 3)
+        self.assertEqual(template.call_count, 1)
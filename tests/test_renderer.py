@@ -0,0 +1,152 @@
+'''Test the fast renderer gives byte-identical output to chevron.'''
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import chevron  # type: ignore
+from chevron.tokenizer import tokenize  # type: ignore
+
+from modot.renderer import compile_tokens
+from modot.templater import StaticTemplater
+
+
+class _Attrs():  # pylint: disable=too-few-public-methods
+    '''Object whose attributes templates can read.'''
+    attr = 'attribute <value>'
+
+
+class _Falsy():
+    '''Falsy object chevron is told to render anyway.'''
+    _CHEVRON_return_scope_when_falsy = True
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __str__(self) -> str:
+        return 'falsy & rendered'
+
+
+CONTEXT = {
+    'name': 'world',
+    'html': '<a href="x">&amp;\'</a>',
+    'zero': 0,
+    'zero_float': 0.0,
+    'false': False,
+    'true': True,
+    'none': None,
+    'empty': '',
+    'empty_list': [],
+    'empty_dict': {},
+    'int': 42,
+    'float': 1.50,
+    'list': ['a', '<b>', 3, None],
+    'dict': {'b': '"2"', 'a': 1},
+    'nested': {'deep': {'er': 'x & y'}, 'n': 0, 'list': [{'k': 'v'}]},
+    'obj': _Attrs(),
+    'falsy': _Falsy(),
+    'unicode': 'héllo ✓ \U0001f600',
+    'dotted.key': 'unreachable',
+    1: 'int key',
+    'lambda': lambda text, render: render(text).upper(),
+}
+
+VARIABLE_TEMPLATES = [
+    '',
+    'Hello {{name}}!',
+    '{{ name }}|{{name }}|{{  name}}',
+    '{{html}}|{{{html}}}|{{&html}}|{{& html }}|{{{ html }}}',
+    '{{zero}}|{{zero_float}}|{{false}}|{{true}}|{{none}}|{{empty}}',
+    '{{empty_list}}|{{empty_dict}}|{{missing}}|{{missing.key}}',
+    '{{int}} {{float}} {{int.real}} {{int.missing}}',
+    '{{list}}|{{{list}}}',
+    '{{list.0}}{{list.1}}{{{list.1}}}{{list.2}}{{list.3}}{{list.4}}',
+    '{{list.x}}|{{list.-1}}|{{list.1.x}}|{{list.0.0}}',
+    '{{dict}}|{{{dict}}}|{{dict.a}}|{{dict.b}}|{{&dict.b}}',
+    '{{nested.deep.er}}|{{nested.n}}|{{nested.missing}}|{{nested.deep}}',
+    '{{nested.deep.er.x}}|{{nested.list.0.k}}|{{nested.list.1.k}}',
+    '{{obj.attr}}|{{{obj.attr}}}|{{obj.missing}}',
+    '{{falsy}}|{{{falsy}}}',
+    '{{unicode}}|{{{unicode}}}',
+    '{{dotted.key}}|{{1}}',
+    '{{name.upper}}|{{list.count}}',
+    '{{.}}',
+    'a {{! a comment }} b',
+    'a\n  {{! standalone comment }}\nb\n',
+    '{{=<% %>=}}<% name %> {{name}} <%& html %>',
+    'x\n{{=| |=}}\n|html|\n|={{ }}=|\n{{name}}',
+    '  {{name}}  \n\t{{html}}\r\n{{name}}{{name}}\n',
+    '{{name}}}} {{ {{name}}',
+    'no tags at all { } }} {',
+]
+
+CHEVRON_TEMPLATES = [
+    '{{#list}}[{{.}}]{{/list}}',
+    '{{#nested}}{{deep.er}}{{/nested}}',
+    '{{^empty}}empty{{/empty}}{{^name}}never{{/name}}',
+    '{{#lambda}}hi {{name}}{{/lambda}}',
+    'a {{>partial}} b',
+    '{{name}} {{#true}}{{html}}{{/true}}',
+    '{{=<% %>=}}<%{html}%>',
+]
+
+
+class TestRendererCompatibility(unittest.TestCase):
+    '''Compare renders against chevron's.'''
+    def setUp(self):
+        '''Create a templater rendering CONTEXT.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.templater = StaticTemplater(Path(self.tmpdir_handle.name),
+                                         CONTEXT)
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def _assert_identical(self, template: str):
+        expected = chevron.render(template, CONTEXT)
+        self.assertEqual(self.templater.template(template).encode(),
+                         expected.encode(), template)
+        # Again, with values now memoized
+        self.assertEqual(self.templater.template(template).encode(),
+                         expected.encode(), template)
+
+    def test_variable_templates(self):
+        '''Variable-only templates should render without chevron.'''
+        expected = {template: chevron.render(template, CONTEXT)
+                    for template in VARIABLE_TEMPLATES}
+        with patch('chevron.render', side_effect=AssertionError):
+            for template in VARIABLE_TEMPLATES:
+                for _ in range(2):
+                    self.assertEqual(
+                        self.templater.template(template).encode(),
+                        expected[template].encode(), template)
+
+    def test_chevron_templates(self):
+        '''Templates needing chevron should render as chevron does.'''
+        for template in CHEVRON_TEMPLATES:
+            self.assertIsNone(compile_tokens(list(tokenize(template))))
+            self._assert_identical(template)
+
+    def test_combined_sources(self):
+        '''Every template joined into one source should still match.'''
+        self._assert_identical('\n'.join(VARIABLE_TEMPLATES))
+        self._assert_identical('\n'.join(VARIABLE_TEMPLATES
+                                         + CHEVRON_TEMPLATES))
+
+    def test_malformed_raises(self):
+        '''A malformed template should raise as chevron does.'''
+        for template in ('{{name', '{{=<% %>=}}<% name'):
+            with self.assertRaises(chevron.ChevronError):
+                chevron.render(template, CONTEXT)
+            with self.assertRaises(chevron.ChevronError):
+                self.templater.template(template)
+
+    def test_invalidate_drops_values(self):
+        '''Memoized values should not outlive the context.'''
+        templater = StaticTemplater(Path(self.tmpdir_handle.name),
+                                    {'name': 'old'})
+        self.assertEqual(templater.template('{{name}}'), 'old')
+        templater.template_dict = {'name': 'new'}
+        templater.invalidate()
+        self.assertEqual(templater.template('{{name}}'), 'new')
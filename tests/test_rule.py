@@ -0,0 +1,49 @@
+'''Test the compact concatenation rule value object.'''
+from pathlib import Path
+import pickle
+import unittest
+
+from modot.rule import Rule
+
+
+class TestRule(unittest.TestCase):
+    '''Test rule construction, equality and immutability.'''
+    def test_fields(self):
+        '''Paths and flags should read back as given.'''
+        rule = Rule(Path('/src/a'), '/out/a', executable=True,
+                    force_rewrite=True)
+        self.assertEqual(rule.src, Path('/src/a'))
+        self.assertEqual(rule.out, Path('/out/a'))
+        self.assertTrue(rule.executable)
+        self.assertFalse(rule.final)
+        self.assertTrue(rule.force_rewrite)
+
+    def test_equality(self):
+        '''Rules with the same paths and flags should be equal.'''
+        self.assertEqual(Rule(Path('/a'), Path('/b')), Rule('/a', '/b/'))
+        self.assertNotEqual(Rule('/a', '/b'), Rule('/a', '/b', final=True))
+        self.assertEqual(len({Rule('/a', '/b'), Rule('/a', '/b')}), 1)
+
+    def test_paths_interned(self):
+        '''Rules sharing an output should share its string.'''
+        first = Rule('/a', Path('/out') / 'x')
+        second = Rule('/b', Path('/out') / 'x')
+        self.assertIs(first.out_str, second.out_str)
+
+    def test_immutable(self):
+        '''Assigning to a rule should fail.'''
+        rule = Rule('/a', '/b')
+        with self.assertRaises(AttributeError):
+            rule.executable = True
+        with self.assertRaises(AttributeError):
+            rule.extra = 1
+
+    def test_with_out(self):
+        '''with_out should keep the source and flags.'''
+        rule = Rule('/a', '/b', final=True).with_out('/c')
+        self.assertEqual(rule, Rule('/a', '/c', final=True))
+
+    def test_pickle_round_trip(self):
+        '''Rules should survive pickling.'''
+        rule = Rule('/a', '/b', executable=True)
+        self.assertEqual(pickle.loads(pickle.dumps(rule)), rule)
@@ -0,0 +1,95 @@
+'''Test the pickled snapshot of host config and module rules.'''
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from modot.rule import Rule
+from modot.snapshot import ConfigSnapshot
+
+
+class TestConfigSnapshot(unittest.TestCase):
+    '''Test reusing and invalidating the config snapshot.'''
+    def setUp(self):
+        '''Set up a host config with one module using dir_contents.'''
+        self.root_handle = TemporaryDirectory()
+        self.root = Path(self.root_handle.name)
+        self.module_path = self.root / 'dom' / 'mod'
+        (self.module_path / 'subdir').mkdir(parents=True)
+        (self.module_path / 'conf').touch()
+        (self.module_path / 'subdir' / 'file1').touch()
+        self.module_conf_path = self.module_path / 'module.yaml'
+        self.module_conf_path.write_text(
+            f'conf:\n  out: {self.root}/out\n'
+            f'subdir:\n  out: {self.root}/outdir\n  dir_contents: true')
+        self.host_path = self.root / 'host.yaml'
+        self.host_path.write_text(
+            f'domains: [{self.root}/dom]\nmodules: [mod]\n'
+            f'themes: {self.root}/themes\ncolors: {self.root}/colors')
+        self.snapshot_path = self.root / 'snapshot.pickle'
+        self.expected_rules = [
+            Rule(self.module_path / 'conf', self.root / 'out'),
+            Rule(self.module_path / 'subdir' / 'file1',
+                 self.root / 'outdir' / 'file1')]
+
+    def tearDown(self):
+        self.root_handle.cleanup()
+
+    def _snapshot(self) -> ConfigSnapshot:
+        return ConfigSnapshot(self.host_path, self.snapshot_path)
+
+    def _rules(self):
+        return [rule for rules in self._snapshot().module_rules().values()
+                for rule in rules]
+
+    @staticmethod
+    def _touch_later(path: Path):
+        '''Bump a path's mtime so the change is visible at any resolution.'''
+        path_stat = path.stat()
+        os.utime(path, ns=(path_stat.st_atime_ns,
+                           path_stat.st_mtime_ns + 10**9))
+
+    def test_parse(self):
+        '''The first load should parse the host config and modules.'''
+        snapshot = self._snapshot()
+        self.assertEqual(snapshot.host_config().modules, ['mod'])
+        self.assertEqual(self._rules(), self.expected_rules)
+
+    def test_reuse_without_parsing(self):
+        '''An unchanged config should be loaded without parsing any YAML.'''
+        self._rules()
+        with patch('modot.yaml_utils.safe_load',
+                   side_effect=AssertionError('parsed YAML')):
+            self.assertEqual(self._rules(), self.expected_rules)
+
+    def test_module_conf_changed_reparses(self):
+        '''Changing a module config should reparse the modules.'''
+        self._rules()
+        self.module_conf_path.write_text(f'conf:\n  out: {self.root}/new')
+        self._touch_later(self.module_conf_path)
+        self.assertEqual(self._rules(), [
+            Rule(self.module_path / 'conf', self.root / 'new')])
+
+    def test_dir_contents_changed_reparses(self):
+        '''Adding a file to a dir_contents directory should reparse.'''
+        self._rules()
+        (self.module_path / 'subdir' / 'file2').touch()
+        self._touch_later(self.module_path / 'subdir')
+        self.assertIn(Rule(self.module_path / 'subdir' / 'file2',
+                           self.root / 'outdir' / 'file2'), self._rules())
+
+    def test_host_changed_reparses(self):
+        '''Changing the host config should reparse it.'''
+        self._snapshot().host_config()
+        self.host_path.write_text(
+            f'domains: [{self.root}/dom]\nmodules: [mod, other]\n'
+            f'themes: {self.root}/themes\ncolors: {self.root}/colors')
+        self._touch_later(self.host_path)
+        self.assertEqual(self._snapshot().host_config().modules,
+                         ['mod', 'other'])
+
+    def test_corrupt_snapshot_reparses(self):
+        '''An unreadable snapshot should be ignored.'''
+        self.snapshot_path.write_bytes(b'not a pickle')
+        self.assertEqual(self._rules(), self.expected_rules)
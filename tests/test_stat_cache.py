@@ -0,0 +1,73 @@
+'''Test the per-run directory listing and stat cache.'''
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+from modot.stat_cache import StatCache
+
+
+class TestStatCache(unittest.TestCase):
+    '''Test answering path queries from directory listings.'''
+    def setUp(self):
+        '''Set up a file, a directory and symlinks to each.'''
+        self.tmpdir_handle = TemporaryDirectory()
+        self.tmpdir = Path(self.tmpdir_handle.name)
+        (self.tmpdir / 'file').write_text('content')
+        (self.tmpdir / 'dir').mkdir()
+        (self.tmpdir / 'filelink').symlink_to(self.tmpdir / 'file')
+        (self.tmpdir / 'dirlink').symlink_to(self.tmpdir / 'dir')
+        (self.tmpdir / 'broken').symlink_to(self.tmpdir / 'dne')
+        self.stats = StatCache()
+
+    def tearDown(self):
+        '''Ensure the tempdir is destroyed.'''
+        self.tmpdir_handle.cleanup()
+
+    def test_types_match_pathlib(self):
+        '''Answers should match pathlib's, following symlinks.'''
+        for name in ('file', 'dir', 'filelink', 'dirlink', 'broken', 'dne',
+                     'dne/child', 'file/child'):
+            path = self.tmpdir / name
+            self.assertEqual(self.stats.exists(path), path.exists(), name)
+            self.assertEqual(self.stats.is_file(path), path.is_file(), name)
+            self.assertEqual(self.stats.is_dir(path), path.is_dir(), name)
+
+    def test_string_paths(self):
+        '''Paths given as strings, even relative ones, should be answered.'''
+        self.assertTrue(self.stats.is_file(str(self.tmpdir / 'file')))
+        self.assertTrue(self.stats.is_dir(str(self.tmpdir / 'dirlink')))
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        self.addCleanup(os.chdir, cwd)
+        self.assertTrue(self.stats.is_file('file'))
+        self.assertFalse(self.stats.exists('dne'))
+
+    def test_stat(self):
+        '''stat should match os.stat, or be None for missing paths.'''
+        self.assertEqual(self.stats.stat(self.tmpdir / 'filelink'),
+                         os.stat(self.tmpdir / 'file'))
+        self.assertIsNone(self.stats.stat(self.tmpdir / 'broken'))
+        self.assertIsNone(self.stats.stat(self.tmpdir / 'dne'))
+
+    def test_root(self):
+        '''The root has no parent to list but should still be answered.'''
+        self.assertTrue(self.stats.is_dir(Path('/')))
+        self.assertIsNotNone(self.stats.stat(Path('/')))
+
+    def test_directory_listed_once(self):
+        '''Queries about paths in one directory should list it only once.'''
+        with patch('modot.stat_cache.os.scandir',
+                   side_effect=os.scandir) as scandir:
+            for name in ('file', 'dir', 'dne', 'file'):
+                self.stats.is_file(self.tmpdir / name)
+                self.stats.stat(self.tmpdir / name)
+        scandir.assert_called_once_with(str(self.tmpdir))
+
+    def test_changes_after_listing_unseen(self):
+        '''A cache answers from its listing, so lives for one run only.'''
+        self.assertFalse(self.stats.exists(self.tmpdir / 'new'))
+        (self.tmpdir / 'new').touch()
+        self.assertFalse(self.stats.exists(self.tmpdir / 'new'))
+        self.assertTrue(StatCache().exists(self.tmpdir / 'new'))
@@ -0,0 +1,106 @@
+'''Test the on-disk template token cache.'''
+import hashlib
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+from chevron.tokenizer import ChevronError  # type: ignore
+
+from modot.template_cache import TemplateCache, chevron_version, prune
+
+
+class TestTemplateCache(unittest.TestCase):
+    '''Test tokenizing, persisting and reloading templates.'''
+    def setUp(self):
+        '''Set up a temp directory to hold the cache.'''
+        self.cache_dir_handle = TemporaryDirectory()
+        self.cache_dir = Path(self.cache_dir_handle.name)
+
+    def tearDown(self):
+        self.cache_dir_handle.cleanup()
+
+    def test_no_tags_returns_none(self):
+        '''A source without tags should not be tokenized or persisted.'''
+        cache = TemplateCache(self.cache_dir)
+        self.assertIsNone(cache.tokens('just some text\n'))
+        self.assertFalse((self.cache_dir / chevron_version()).exists())
+
+    def test_set_delimiter_is_tokenized(self):
+        '''A delimiter change is a tag even with no variables.'''
+        cache = TemplateCache(self.cache_dir)
+        self.assertIsNotNone(cache.tokens('a {{=<% %>=}} b'))
+
+    def test_comment_is_tokenized(self):
+        '''A comment is a tag even though it leaves no token.'''
+        cache = TemplateCache(self.cache_dir)
+        self.assertEqual(cache.parsed('a {{! note }} b'),
+                         ([('literal', 'a '), ('literal', ' b')],
+                          (('a  b',), ())))
+
+    def test_parsed_compiled(self):
+        '''Only variable-only templates should be compiled.'''
+        cache = TemplateCache(self.cache_dir)
+        self.assertEqual(cache.parsed('bg: {{bg}}!')[1],
+                         (('bg: ', '', '!'), ((1, ('bg', True)),)))
+        self.assertIsNone(cache.parsed('{{#bg}}x{{/bg}}')[1])
+
+    def test_tokens(self):
+        '''A templated source should be tokenized.'''
+        cache = TemplateCache(self.cache_dir)
+        self.assertEqual(cache.tokens('bg: {{bg}}'),
+                         [('literal', 'bg: '), ('variable', 'bg')])
+
+    def test_tokens_persisted(self):
+        '''Tokens should be reloaded from disk by a fresh cache.'''
+        TemplateCache(self.cache_dir).tokens('bg: {{bg}}')
+        entries = list((self.cache_dir / chevron_version()).iterdir())
+        self.assertEqual(len(entries), 1)
+        entries[0].write_bytes(b'garbage')
+        # a corrupt entry is ignored and retokenized
+        self.assertEqual(TemplateCache(self.cache_dir).tokens('bg: {{bg}}'),
+                         [('literal', 'bg: '), ('variable', 'bg')])
+
+    def test_prune_least_recently_used(self):
+        '''Pruning should drop old versions and the oldest entries.'''
+        (self.cache_dir / 'old-version').mkdir()
+        (self.cache_dir / 'old-version' / 'digest').write_bytes(b'x')
+        version_path = self.cache_dir / chevron_version()
+        entry_paths = {}
+        for name in 'abc':
+            src_string = f'{{{{{name}}}}}'
+            TemplateCache(self.cache_dir).tokens(src_string)
+            entry_paths[name] = version_path / hashlib.sha256(
+                src_string.encode()).hexdigest()
+        for mtime, name in enumerate('abc'):
+            os.utime(entry_paths[name], ns=(mtime, mtime))
+        # loading the oldest entry makes it the most recently used
+        TemplateCache(self.cache_dir).tokens('{{a}}')
+        cache = TemplateCache(self.cache_dir)
+        self.assertEqual(cache.prune(0), 0)
+        cache.tokens('{{d}}')
+        self.assertEqual(
+            cache.prune(entry_paths['a'].stat().st_size * 2), 3)
+        self.assertEqual(list(self.cache_dir.iterdir()), [version_path])
+        self.assertEqual(
+            sorted(version_path.iterdir()),
+            sorted([entry_paths['a'], version_path / hashlib.sha256(
+                b'{{d}}').hexdigest()]))
+
+    def test_prune_skips_stray_files(self):
+        '''Files beside the version directories should not stop a prune.'''
+        (self.cache_dir / 'stray').write_text('x')
+        TemplateCache(self.cache_dir).tokens('{{a}}')
+        self.assertEqual(prune(self.cache_dir, 0), 1)
+        self.assertTrue((self.cache_dir / 'stray').exists())
+
+    def test_memory_only(self):
+        '''A cache without a path should still tokenize.'''
+        cache = TemplateCache()
+        self.assertEqual(cache.tokens('{{bg}}'), [('variable', 'bg')])
+
+    def test_malformed_raises(self):
+        '''Malformed templates should raise the same error as chevron.'''
+        cache = TemplateCache(self.cache_dir)
+        with self.assertRaises(ChevronError):
+            cache.tokens('{{#section}} unclosed')
@@ -252,3 +252,21 @@ class TestTemplaterTemplate(unittest.TestCase):
         templater.set_color('new')
         out_str = templater.template('theme: {{theme}}\ncolor: {{color}}')
         self.assertEqual(out_str, 'theme: cooltheme\ncolor: newcolor')
+
+    def test_template_layered_context(self):
+        '''Base, color, theme and host overrides should layer in order.'''
+        theme_path = self.theme_dir/'main.yaml'
+        color_path = self.color_dir/'main.yaml'
+        base_path = self.link_dir/'base.yaml'
+        (self.link_dir/'theme.yaml').symlink_to(theme_path)
+        (self.link_dir/'color.yaml').symlink_to(color_path)
+        base_path.write_text('font: mono\nbg: {main: black, dim: grey}')
+        color_path.write_text('bg.main: navy\nfg: white')
+        theme_path.write_text('font: serif')
+        host_cfg = HostConfig(self.theme_dir, self.color_dir,
+                              context_base=base_path,
+                              context={'fg': 'ivory'})
+        templater = Templater(self.link_dir, host_cfg)
+        out_str = templater.template(
+            '{{font}} {{bg.main}} {{bg.dim}} {{fg}}')
+        self.assertEqual(out_str, 'serif navy grey ivory')
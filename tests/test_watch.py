@@ -0,0 +1,62 @@
+'''Test the inotify and polling directory watchers.'''
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+from modot.watch import InotifyWatcher, PollingWatcher
+
+
+class TestPollingWatcher(unittest.TestCase):
+    '''Test the polling watcher; other watchers reuse these tests.'''
+    def make_watcher(self, roots):
+        '''Create a fast polling watcher.'''
+        return PollingWatcher(roots, interval=0.01)
+
+    def setUp(self):
+        '''Set up a watched temp directory.'''
+        self.root_handle = TemporaryDirectory()
+        self.root = Path(self.root_handle.name)
+        (self.root / 'existing').write_text('old')
+        (self.root / 'subdir').mkdir()
+        self.watcher = self.make_watcher([self.root])
+
+    def tearDown(self):
+        self.watcher.close()
+        self.root_handle.cleanup()
+
+    def test_no_change_times_out(self):
+        '''Waiting without changes should return nothing.'''
+        self.assertEqual(self.watcher.wait(0.05), set())
+
+    def test_modify_reported(self):
+        '''Modifying a file should report it.'''
+        (self.root / 'existing').write_text('new content')
+        self.assertIn(self.root / 'existing', self.watcher.wait(2))
+
+    def test_create_in_subdir_reported(self):
+        '''Creating a file in a subdirectory should report it.'''
+        (self.root / 'subdir' / 'new').write_text('new')
+        self.assertIn(self.root / 'subdir' / 'new', self.watcher.wait(2))
+
+    def test_delete_reported(self):
+        '''Deleting a file should report it.'''
+        (self.root / 'existing').unlink()
+        self.assertIn(self.root / 'existing', self.watcher.wait(2))
+
+    def test_new_directory_watched(self):
+        '''Files in directories created after watching should be reported.'''
+        (self.root / 'newdir').mkdir()
+        self.watcher.wait(2)
+        (self.root / 'newdir' / 'file').write_text('new')
+        self.assertIn(self.root / 'newdir' / 'file', self.watcher.wait(2))
+
+
+class TestInotifyWatcher(TestPollingWatcher):
+    '''Test the inotify watcher where it is available.'''
+    def make_watcher(self, roots):
+        '''Create an inotify watcher or skip.'''
+        try:
+            return InotifyWatcher(roots)
+        except OSError:
+            self.skipTest('inotify is not available')
+            return None